@@ -6,20 +6,38 @@ $3.0k_motor_control-ver3.3.1a
 192.168.1.121:8802 3.6w电机
 192.168.1.122:8802 3k电机
 """
+import abc
+import asyncio
+import bisect
+import collections
 import csv
+import glob
+import functools
+import itertools
+import mmap
 import os
 import json
+import math
+import operator
+import queue
+import random
 import struct
 import sys
+import tempfile
 import time
 import socket
 import threading
+import zlib
+from concurrent.futures import FIRST_COMPLETED, Future, TimeoutError as FutureTimeoutError, wait
 from datetime import datetime
 
 from openpyxl import Workbook
+import numpy as np
 from PyQt5 import uic, QtGui
-from PyQt5.Qt import QThread, pyqtSignal, Qt
-from PyQt5.QtWidgets import QWidget, QApplication, QMessageBox, QLCDNumber
+from PyQt5.Qt import QThread, QTimer, pyqtSignal, Qt, QPointF, QDateTime
+from PyQt5.QtChart import QChart, QChartView, QLineSeries, QValueAxis, QDateTimeAxis
+from PyQt5.QtWidgets import QWidget, QApplication, QMessageBox, QLCDNumber, QLabel, QVBoxLayout, QFrame, \
+    QGroupBox, QTableWidget, QTableWidgetItem, QHeaderView, QTabWidget
 
 current_file_path = __file__
 file_name = os.path.basename(current_file_path)[:-3]
@@ -27,6 +45,13 @@ print("当前版本:", file_name)
 
 
 class MotorController(QWidget):
+    log_signal = pyqtSignal(str, str, str)
+    COMMAND_WAIT = 2.0  # 等待总线线程返回结果的最长时间(秒)
+    CSV_BACKLOG_WARN = 10000  # CSV写入队列积压超过该行数时告警
+    # 写入二进制记录文件头的配置项 (通道名称、换算参数等)
+    RECORD_CONFIG = ('modbus_head', 'modbus_min', 'modbus_max', 'spdrate', 'rotation_ratio', 'sample_interval',
+                     'poll_registers', 'poll_rates', 'calibration', 'calibration_sets', 'derived_channels')
+
     def __init__(self):
         super().__init__()
         self.config = MotorConfig()  # 先初始化config
@@ -34,10 +59,18 @@ class MotorController(QWidget):
         self._init_ui()
         self._init_variables()
         self._setup_connections()
-        self.sock = None  # 唯一的socket连接
+        self.bus = None  # 总线线程, 独占网关socket连接
+        self.response_timeout = 0.05  # 单次响应超时(秒)
         self.thread = None
-        self.crc_helper = CRCHelper()
+        self.samples = None  # 采样历史 (SampleBuffer), 显示和记录都从这里读取
+        self._shown = 0  # 已显示到的记录序号
+        self._recorded = 0  # 已写入CSV的记录序号
+        self.refresh_timer = QTimer(self)  # 界面刷新定时器, 与采集速率无关
+        self.refresh_timer.timeout.connect(self._refresh_display)
+        self.frame_cache = RequestFrameCache(self.config)  # 加载配置时预编译轮询请求帧
+        self.estop = EmergencyStop(self.config, self.frame_cache, self.log_message, self.response_timeout)
         # self.data_buffer = []  # 数据采集缓冲区
+        self._recover_journals()
 
     def _init_ui(self):
         self.ui = uic.loadUi("./_internal/motor_control.ui")
@@ -60,14 +93,48 @@ class MotorController(QWidget):
         self.ui.labelCH5.setText(self.config.modbus_head[5])
         self.ui.labelCH6.setText(self.config.modbus_head[6])
         self.ui.labelCH7.setText(self.config.modbus_head[7])
+        self._setup_derived_display()
+        # 右侧改为上下排列: 数值显示 + 曲线图 + 统计表
+        layout = self.ui.horizontalLayout
+        index = layout.indexOf(self.ui.Ldatashow)
+        layout.removeWidget(self.ui.Ldatashow)
+        self.right_panel = QVBoxLayout()
+        self.right_panel.addWidget(self.ui.Ldatashow)
+        layout.insertLayout(index, self.right_panel, 5)
+        self._setup_charts()
+        self._setup_stats_view()
 
         self._enable_controls(False)
 
+    # 派生量显示
+    def _setup_derived_display(self):
+        """按配置 derived_channels 在数值显示区 (物理量之前) 添加一列派生量显示"""
+        self.derived_displays = []
+        if not self.config.derived_channels:
+            return
+        column = QVBoxLayout()
+        for item in self.config.derived_channels:
+            lcd = QLCDNumber()
+            label = QLabel(item.get('label', item['name']))
+            label.setFont(self.ui.labeloutpow.font())
+            label.setAlignment(Qt.AlignCenter)
+            column.addWidget(lcd)
+            column.addWidget(label)
+            self.derived_displays.append((lcd, item['name']))
+        line = QFrame()
+        line.setFrameShape(QFrame.VLine)
+        line.setFrameShadow(QFrame.Sunken)
+        layout = self.ui.horizontalLayout_2
+        layout.insertWidget(layout.count() - 1, line)
+        layout.insertLayout(layout.count() - 1, column, 1)
+
     # 初始化变量
     def _init_variables(self):
         """初始化变量"""
         self.csv_file = None  # CSV文件对象
-        self.csv_writer = None  # CSV写入器
+        self.csv_writer = None  # CSV写入器 (CsvWriter 后台线程)
+        self.journal = None  # 预写日志 (JournalWriter 后台线程)
+        self._backlog_warned = False
         self.csv_filename = ""  # 当前CSV文件名
         self.motor_params = {
             'max_speed': self.config.max_speed,
@@ -110,10 +177,11 @@ class MotorController(QWidget):
         ]
         for signal, slot in connections:
             signal.connect(slot)
+        self.log_signal.connect(self._append_log)  # 其他线程的日志排队到GUI线程显示
 
     def _ensure_connection(self):
         """确保socket连接有效"""
-        if self.sock is None:
+        if self.bus is None or not self.bus.connected:
             self.log_message('error', '未建立连接')
             return False
         return True
@@ -130,7 +198,7 @@ class MotorController(QWidget):
     # 处理连接 / 断开连接
     def _handle_connection(self):
         """处理连接/断开连接"""
-        if self.sock is None:
+        if self.bus is None or not self.bus.connected:
             self._connect_to_motor()
         else:
             self._disconnect_from_motor()
@@ -138,11 +206,14 @@ class MotorController(QWidget):
     # 建立socket连接
     def _connect_to_motor(self):
         """建立socket连接"""
+        self.frame_cache.compile(self.config)  # 地址或寄存器表变化时才重新编译
+        self._close_socket()
         try:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # 关闭小包合并算法
-            self.sock.settimeout(0.05)
-            self.sock.connect((self.config.ip_address, self.config.port))
+            address = (self.config.ip_address, self.config.port)
+            sock = BusWorker.open_connection(address, self.response_timeout)
+            self.bus = BusWorker(sock, self.frame_cache, self.log_message, self.response_timeout, address)
+            self.bus.start()
+            self.estop.open()
 
             self._enable_controls(True)
             self.ui.btnlink.setText("断开连接")
@@ -151,7 +222,6 @@ class MotorController(QWidget):
             return True
         except Exception as e:
             self.log_message('error', f'连接失败: {str(e)}')
-            self._close_socket()
             return False
 
     # 断开socket连接
@@ -165,75 +235,63 @@ class MotorController(QWidget):
 
     # 安全关闭socket
     def _close_socket(self):
-        """安全关闭socket"""
-        if self.sock:
-            try:
-                self.sock.close()
-            except:
-                pass
-            finally:
-                self.sock = None
+        """停止总线线程并关闭socket"""
+        self.estop.close()
+        if self.bus:
+            self.bus.stop()
+            self.bus.join(1)
+            stats = self.bus.latency_stats(BusWorker.PRIORITY_CONTROL)
+            if stats:
+                self.log_message('info', f"控制命令延迟: {stats['count']}次, 平均 {stats['mean']:.1f} ms, "
+                                         f"P99 {stats['p99']:.1f} ms, 最大 {stats['max']:.1f} ms")
+            for slave, rtt in sorted(self.bus.rtt.items()):
+                if rtt.samples or rtt.timeouts:  # 广播帧无应答, 不统计
+                    self.log_message('info', f'从站{slave:02X} {rtt}')
+            self.bus = None
 
     # 发送命令并返回响应
-    def send_command(self, command, expected_response_prefix='', retries=3):
-        """发送命令并返回响应"""
+    def send_command(self, request, expect=None, retries=3, priority=None):
+        """发送命令并返回响应
+
+        request 为不含CRC的请求帧(bytes), expect 为期望响应的 (从站地址, 功能码),
+        成功时返回去掉CRC的响应帧 memoryview。
+        请求交给总线线程按优先级串行发送, 默认按控制命令优先级处理。
+        """
         if not self._ensure_connection():
             return False, None
 
-        for attempt in range(retries):
-            try:
-                # 添加CRC并发送
-                data_with_crc = self.crc_helper.add_crc(bytes.fromhex(command))
-                self.sock.sendall(data_with_crc)
-
-                # 接收响应
-                response = self.sock.recv(1024)
-                if not response:
-                    continue
-
-                # 验证CRC
-                crc_valid, payload = self.crc_helper.verify_crc(response)
-                if not crc_valid:
-                    self.log_message('warning', 'CRC校验失败')
-                    continue
-
-                hex_response = payload.hex()
-                if expected_response_prefix and not hex_response.startswith(expected_response_prefix):
-                    self.log_message('warning', f'响应前缀不匹配: 期望 {expected_response_prefix}, 收到 {hex_response[:4]}')
-                    continue
-
-                return True, hex_response
-            except socket.timeout:
-                self.log_message('warning', f'命令超时 (尝试 {attempt + 1}/{retries})')
-            except Exception as e:
-                self.log_message('error', f'发送命令出错: {str(e)}')
-                self._close_socket()
-                break
-
-        return False, None
+        if priority is None:
+            priority = BusWorker.PRIORITY_CONTROL
+        future = self.bus.submit(request, expect, retries, priority)
+        try:
+            return future.result(timeout=self.COMMAND_WAIT)
+        except FutureTimeoutError:
+            self.log_message('error', '等待总线响应超时')
+            return False, None
 
     # 读取电机状态
     def read_motor_status(self):
         """读取电机状态"""
+        polls = self.frame_cache.polls
         commands = [
-            ('010370000007', '0103', self._parse_motor_parameters),
-            ('0103F0110002', '0103', self._parse_timing_parameters),
-            ('010330000001', '0103', self._parse_run_status),
-            ('020300000006', '0203', self._parse_torque_meter)  # 新增转矩仪数据读取
+            (polls['inverter_params'], self._parse_motor_parameters),
+            (polls['timing_params'], self._parse_timing_parameters),
+            (polls['run_status'], self._parse_run_status),
+            (polls['torque_meter'], self._parse_torque_meter)  # 新增转矩仪数据读取
         ]
 
-        for cmd, prefix, parser in commands:
-            success, response = self.send_command(cmd, prefix)
+        for cmd, parser in commands:
+            success, response = self.send_command(cmd, cmd[:2], priority=BusWorker.PRIORITY_READ)
             if success:
                 parser(response)
             else:
-                self.log_message('error', f'读取 {cmd} 失败')
+                self.log_message('error', f'读取 {cmd.hex().upper()} 失败')
 
     # 解析电机参数响应
     def _parse_motor_parameters(self, response):
         """解析电机参数响应"""
         try:
-            read_data = struct.unpack('>hhhhhhh', bytes.fromhex(response)[3:17])
+            read_data = ModbusCodec.INVERTER_PARAMS.unpack_from(response, 3)
             self.current_state['speed'] = round(read_data[0] * 0.6 * self.motor_params['rotation_ratio']*self.config.spdrate)
             self.current_state['set_speed'] = round(read_data[1] * 0.6 * self.motor_params['rotation_ratio']*self.config.spdrate)
             self.current_state['voltage'] = read_data[3]
@@ -256,7 +314,7 @@ class MotorController(QWidget):
     def _parse_timing_parameters(self, response):
         """解析时间参数响应"""
         try:
-            read_data = struct.unpack('>hh', bytes.fromhex(response)[3:7])
+            read_data = ModbusCodec.TIMING_PARAMS.unpack_from(response, 3)
             upt = read_data[0]/10
             dot = read_data[1]/10
 
@@ -271,7 +329,7 @@ class MotorController(QWidget):
     def _parse_run_status(self, response):
         """解析运行状态响应"""
         try:
-            read_data = struct.unpack('>h', bytes.fromhex(response)[3:5])
+            read_data = ModbusCodec.RUN_STATUS.unpack_from(response, 3)
             self.motor_params['is_running'] = read_data[0]
             status = self.motor_params['is_running']
 
@@ -286,7 +344,7 @@ class MotorController(QWidget):
     def _parse_torque_meter(self, response):
         """解析转矩仪数据响应"""
         try:
-            read_data = struct.unpack('>iii', bytes.fromhex(response)[3:15])
+            read_data = ModbusCodec.TORQUE_METER.unpack_from(response, 3)
             self.current_state['torque_meter_torque'] = read_data[0] / 100
             self.current_state['torque_meter_speed'] = read_data[1] / 10
             self.current_state['torque_meter_power'] = read_data[2] / 100
@@ -303,8 +361,8 @@ class MotorController(QWidget):
         """设置加速时间"""
         upt = self.ui.intupt.text()
         if upt and 0 < int(upt) < 6500:
-            cmd = f'0106F011{int(upt) * 10:04X}'
-            success, _ = self.send_command(cmd, '0106')
+            cmd = ModbusCodec.write_register(self.config.inverter_slave, 0xF011, int(upt) * 10)
+            success, _ = self.send_command(cmd, cmd[:2])
             if success:
                 self.ui.ledupt.display(upt)
                 self.log_message('info', f'加速时间设置为 {upt} 秒')
@@ -316,8 +374,8 @@ class MotorController(QWidget):
         """设置减速时间"""
         dot = self.ui.intdot.text()
         if dot and 0 < int(dot) < 6500:
-            cmd = f'0106F012{int(dot) * 10:04X}'
-            success, _ = self.send_command(cmd, '0106')
+            cmd = ModbusCodec.write_register(self.config.inverter_slave, 0xF012, int(dot) * 10)
+            success, _ = self.send_command(cmd, cmd[:2])
             if success:
                 self.ui.leddot.display(dot)
                 self.log_message('info', f'减速时间设置为 {dot} 秒')
@@ -330,8 +388,8 @@ class MotorController(QWidget):
         speed = self.ui.introt.text()
         if speed and 0 <= int(speed) <= self.motor_params['max_speed']*self.config.spdrate:
             value = round(int(speed) / (self.motor_params['rotation_ratio'] * 0.3*self.config.spdrate))
-            cmd = f'01061000{value:04X}'
-            success, _ = self.send_command(cmd, '0106')
+            cmd = ModbusCodec.write_register(self.config.inverter_slave, 0x1000, value)
+            success, _ = self.send_command(cmd, cmd[:2])
             if success:
                 self.ui.ledsetrot.display(speed)
                 self.log_message('info', f'转速设置为 {speed} RPM')
@@ -341,8 +399,8 @@ class MotorController(QWidget):
     # 设置正转
     def set_forward_rotation(self):
         """设置正转"""
-        cmd = '0106F0090000'
-        success, _ = self.send_command(cmd, '0106')
+        cmd = ModbusCodec.write_register(self.config.inverter_slave, 0xF009, 0x0000)
+        success, _ = self.send_command(cmd, cmd[:2])
         if success:
             self.ui.btnrun.setEnabled(True)
             self.log_message('info', '旋向设置为正转')
@@ -350,8 +408,8 @@ class MotorController(QWidget):
     # 设置反转
     def set_reverse_rotation(self):
         """设置反转"""
-        cmd = '0106F0090001'
-        success, _ = self.send_command(cmd, '0106')
+        cmd = ModbusCodec.write_register(self.config.inverter_slave, 0xF009, 0x0001)
+        success, _ = self.send_command(cmd, cmd[:2])
         if success:
             self.ui.btnrun.setEnabled(True)
             self.log_message('info', '旋向设置为反转')
@@ -360,11 +418,11 @@ class MotorController(QWidget):
     def set_local_control(self):
         """设置为本地控制"""
         commands = [
-            ('0106F0020000', '0106'),
-            ('0106F0030004', '0106')
+            ModbusCodec.write_register(self.config.inverter_slave, 0xF002, 0x0000),
+            ModbusCodec.write_register(self.config.inverter_slave, 0xF003, 0x0004)
         ]
-        for cmd, prefix in commands:
-            success, _ = self.send_command(cmd, prefix)
+        for cmd in commands:
+            success, _ = self.send_command(cmd, cmd[:2])
             if not success:
                 return
         self.log_message('info', '设置为面板操作')
@@ -373,11 +431,11 @@ class MotorController(QWidget):
     def set_remote_control(self):
         """设置为远程控制"""
         commands = [
-            ('0106F0020002', '0106'),
-            ('0106F0030009', '0106')
+            ModbusCodec.write_register(self.config.inverter_slave, 0xF002, 0x0002),
+            ModbusCodec.write_register(self.config.inverter_slave, 0xF003, 0x0009)
         ]
-        for cmd, prefix in commands:
-            success, _ = self.send_command(cmd, prefix)
+        for cmd in commands:
+            success, _ = self.send_command(cmd, cmd[:2])
             if not success:
                 return
         self.log_message('info', '设置为远程通讯操作')
@@ -385,26 +443,30 @@ class MotorController(QWidget):
     # 启动电机
     def start_motor(self):
         """启动电机"""
-        cmd = '010620000001'
-        success, _ = self.send_command(cmd, '0106')
+        cmd = ModbusCodec.write_register(self.config.inverter_slave, 0x2000, 0x0001)
+        success, _ = self.send_command(cmd, cmd[:2])
         if success:
             self.log_message('info', '电机启动')
 
     # 软停止电机
     def stop_motor_soft(self):
         """软停止电机"""
-        cmd = '010620000006'  # 减速停机
-        success, _ = self.send_command(cmd, '0106')
+        cmd = ModbusCodec.write_register(self.config.inverter_slave, 0x2000, 0x0006)  # 减速停机
+        success, _ = self.send_command(cmd, cmd[:2])
         if success:
             self.log_message('info', '电机减速停止')
 
     # 急停电机
     def stop_motor_hard(self):
-        """急停电机"""
-        cmd = '010620000005'  # 自由停机
-        success, _ = self.send_command(cmd, '0106')
+        """急停电机 (快速通道, 不经过普通命令排队)"""
+        clicked_at = time.perf_counter()
+        if not self._ensure_connection():
+            return
+        success, latency, path = self.estop.trigger(self.bus, clicked_at)
         if success:
-            self.log_message('info', '电机急停')
+            self.log_message('info', f'电机急停 (经{path}确认, 耗时 {latency * 1000:.1f} ms)')
+        else:
+            self.log_message('error', f'急停未收到确认 (已等待 {latency * 1000:.0f} ms)')
 
     # 切换数据采集状态
     def toggle_data_collection(self):
@@ -420,12 +482,18 @@ class MotorController(QWidget):
         if not self._ensure_connection():
             return
 
-        self.thread = DataCollectionThread(
-            interval=self.motor_params['sample_interval'],
-            controller=self
-        )
-        self.thread.data_ready.connect(self.update_data_display)
+        try:
+            self.thread = DataCollectionThread(
+                interval=self.motor_params['sample_interval'],
+                controller=self
+            )
+        except ValueError as e:
+            self.log_message('error', f'采集配置错误: {str(e)}')
+            return
+        self.samples = self.thread.samples
+        self._shown = self._recorded = 0
         self.thread.start()
+        self.refresh_timer.start(round(1000 / self.config.gui_refresh_hz))
 
         self.ui.pbtndaq.setText("停止采集")
         self.ui.cboxdaq.setEnabled(False)
@@ -446,6 +514,13 @@ class MotorController(QWidget):
         if self.thread:
             self.thread.stop()
             self.thread.wait(2000)
+            self.refresh_timer.stop()
+            self._refresh_display()  # 显示并写入停止前的最后几条记录
+
+            scheduler = self.thread.scheduler
+            if scheduler:
+                self.log_message('info', f'采集定时 {scheduler.jitter}; {scheduler.cycle}')
+            self._write_run_summary()
 
             if self.ui.cboxdaq.isChecked():
                 # 关闭CSV写入器
@@ -464,111 +539,330 @@ class MotorController(QWidget):
 
     # 启动CSV写入器
     def _start_csv_writer(self):
-        """启动CSV写入器"""
+        """启动数据记录 (record_format 为 binary 时写二进制记录, 否则写CSV)"""
         if not self.ui.cboxdaq.isChecked():
             return
 
         try:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            self.csv_filename = f"motor_data_{timestamp}.csv"
+            header = {
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'version': file_name,
+                'config': {key: getattr(self.config, key) for key in self.RECORD_CONFIG},
+            }
+            if self.config.record_format == 'binary':
+                self.csv_filename = f"motor_data_{timestamp}.mrec"
+                self.csv_file = open(self.csv_filename, 'wb')
+                self.csv_writer = BinaryWriter(self.csv_file, self.samples, header, self.config.record_compress,
+                                               self.config.csv_flush_interval, self.config.csv_flush_rows,
+                                               self.config.csv_fsync, self.log_message)
+            else:
+                self.csv_filename = f"motor_data_{timestamp}.csv"
 
-            # 创建CSV文件并写入表头
-            self.csv_file = open(self.csv_filename, 'w', newline='', encoding='utf-8')
-            self.csv_writer = csv.writer(self.csv_file)
+                # 创建CSV文件并写入表头
+                head, format_row = self._csv_layout(header['config'])
+                self.csv_file = open(self.csv_filename, 'w', newline='', encoding='utf-8')
+                csv.writer(self.csv_file).writerow(head)
 
-            # 写入表头
-            headers = [
-                '时间', '变频器转速(RPM)', '设定转速(RPM)', '变频器电压(V)',
-                '变频器电流(A)', '变频器功率(kW)', '变频器转矩(%)',
-                '转矩仪转矩(Nm)', '转矩仪转速(RPM)', '转矩仪功率(W)'
-            ]
-            self.csv_writer.writerow(headers + self.config.modbus_head)
+                self.csv_writer = CsvWriter(self.csv_file, self.samples, format_row,
+                                            self.config.csv_flush_interval, self.config.csv_flush_rows,
+                                            self.config.csv_fsync, self.log_message)
+
+            if self.config.record_pyramid:
+                self.csv_writer.pyramid = PyramidWriter(self.csv_filename, self.samples.fields,
+                                                        self._field_labels())
+
+            # 后台写入线程
+            self.csv_writer.start()
+            self._backlog_warned = False
+
+            if self.config.record_journal:
+                journal = {'record': self.csv_filename, 'format': self.config.record_format,
+                           'compress': self.config.record_compress, 'record_header': header}
+                checkpoint = self.config.journal_checkpoint_interval
+                self.journal = JournalWriter(open(self.csv_filename + '.wal', 'wb'), self.samples, journal,
+                                             self.config.journal_fsync_interval, self.config.csv_flush_interval,
+                                             self.config.csv_flush_rows, self.log_message, retain=checkpoint > 0)
+                if checkpoint > 0:
+                    self.csv_writer.journal = self.journal
+                    self.csv_writer.checkpoint_interval = checkpoint
+                self.journal.start()
 
             self.log_message('info', f'开始记录数据到 {self.csv_filename}')
         except Exception as e:
-            self.log_message('error', f'创建CSV文件失败: {str(e)}')
+            self.log_message('error', f'创建记录文件失败: {str(e)}')
             self._close_csv_writer()
 
+    # CSV表头
+    @staticmethod
+    def _csv_header(modbus_head, derived_channels=()):
+        """CSV表头 (派生量列在物理量之后)"""
+        headers = [
+            '时间', '变频器转速(RPM)', '设定转速(RPM)', '变频器电压(V)',
+            '变频器电流(A)', '变频器功率(kW)', '变频器转矩(%)',
+            '转矩仪转矩(Nm)', '转矩仪转速(RPM)', '转矩仪功率(W)'
+        ]
+        derived = [item.get('label', item['name']) for item in derived_channels]
+        return headers + list(modbus_head) + derived + ['数据状态']
+
+    # CSV格式
+    @classmethod
+    def _csv_layout(cls, config):
+        """按记录配置 (通道名称、派生量) 返回 CSV表头 和 记录字典 -> CSV行 的函数"""
+        derived_channels = config.get('derived_channels', [])
+        derived = [item['name'] for item in derived_channels]
+        return (cls._csv_header(config['modbus_head'], derived_channels),
+                functools.partial(cls._csv_record, derived=derived))
+
     # 关闭CSV写入器
     def _close_csv_writer(self):
-        """关闭CSV写入器"""
+        """关闭CSV写入器 (等待后台线程写完队列中的记录)
+
+        使用预写日志时记录文件先 fsync 落盘, 两者都写入成功后才删除日志; 否则保留日志, 下次启动时恢复。
+        """
         if self.csv_file:
             try:
-                self.csv_file.close()
+                if self.csv_writer:
+                    self.csv_writer.close(sync=self.journal is not None)
+                    self.log_message('info', f'CSV {self.csv_writer}')
+                else:
+                    self.csv_file.close()
+                if self.journal:
+                    self.journal.close()
+                    self.log_message('info', f'预写日志 {self.journal}')
+                    if not (self.journal.error or self.csv_writer is None or self.csv_writer.error):
+                        os.remove(self.journal.path)
             except Exception as e:
                 self.log_message('error', f'关闭CSV文件失败: {str(e)}')
             finally:
                 self.csv_file = None
                 self.csv_writer = None
+                self.journal = None
 
-    # 写入一行数据到CSV
-    def _write_to_csv(self, record):
-        """写入一行数据到CSV"""
-        if self.csv_writer:
+    # 恢复预写日志
+    def _recover_journals(self):
+        """启动时检查上次未正常关闭的记录 (残留的预写日志) 并恢复记录文件"""
+        for path in sorted(glob.glob('motor_data_*.wal')):
             try:
-                self.csv_writer.writerow(record)
-                self.csv_file.flush()  # 立即写入磁盘
-            except Exception as e:
-                self.log_message('error', f'写入CSV失败: {str(e)}')
+                recover_journal(path, self.log_message)
+            except (OSError, ValueError) as e:
+                self.log_message('error', f'恢复预写日志 {path} 失败: {str(e)}')
+
+    # 提交记录到CSV写入线程
+    def _write_to_csv(self, rows):
+        """提交一批记录到CSV写入线程, 写入线程出错时关闭写入器"""
+        if self.csv_writer:
+            if self.journal and not self.journal.write(rows):
+                self._close_csv_writer()
+                return
+            if not self.csv_writer.write(rows):
                 self._close_csv_writer()
+                return
+
+            pending = self.csv_writer.pending
+            if pending > self.CSV_BACKLOG_WARN and not self._backlog_warned:
+                self.log_message('warning', f'磁盘写入跟不上采集, 队列积压 {pending} 行')
+                self._backlog_warned = True
+            elif pending < self.CSV_BACKLOG_WARN // 2:
+                self._backlog_warned = False
+
+    # 界面定时刷新
+    def _refresh_display(self):
+        """界面定时刷新: 显示采样历史中的最新记录 (或两次刷新之间的平均值), 并把新增记录写入CSV
+
+        刷新频率由 gui_refresh_hz 决定, 与采集速率无关; 采集线程只写采样历史, 不等待界面。
+        """
+        samples = self.samples
+        if samples is None:
+            return
+        samples.flush()
+        written = samples.written
+        if written == self._shown:
+            return
+
+        data = samples.record(written - 1)
+        if self.config.display_average:
+            window = samples.window(written - self._shown)
+            for key in samples.fields:
+                if key != 'status':
+                    column = window[key]
+                    valid = column[~np.isnan(column)]
+                    data[key] = float(valid.mean()) if valid.size else None
+        self.update_data_display(data)
+        self._update_charts()
+        self._update_stats_view()
+        self._shown = written
+
+        if self.ui.cboxdaq.isChecked():
+            self._record_samples(written)
+
+    # 统计表
+    def _setup_stats_view(self):
+        """在数值显示区下方添加统计表: 每个统计通道一行, 全程统计和最近 stats_window 秒的滑动窗口统计"""
+        self.stats_table = None
+        if not self.config.stats_channels:
+            return
+        box = QGroupBox('统计')
+        table = self.stats_table = QTableWidget(len(self.config.stats_channels), 2 * len(RunningStats.STATS))
+        labels = self._field_labels()
+        table.setVerticalHeaderLabels([labels.get(name, name) for name in self.config.stats_channels])
+        table.setHorizontalHeaderLabels([f'{prefix}{label}' for prefix in ('全程', f'{self.config.stats_window}秒')
+                                         for _, label in RunningStats.STATS])
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        table.setEditTriggers(QTableWidget.NoEditTriggers)
+        for row in range(table.rowCount()):
+            for column in range(table.columnCount()):
+                table.setItem(row, column, QTableWidgetItem('--'))
+        QVBoxLayout(box).addWidget(table)
+        self.right_panel.addWidget(box)
+
+    # 曲线图
+    def _setup_charts(self):
+        """按配置 charts 添加滚动曲线图, 每个图一页, 只刷新当前显示的一页"""
+        self.chart_tabs = None
+        self._chart_refreshed = 0.0
+        if not self.config.charts:
+            return
+        labels = self._field_labels()
+        self.chart_tabs = QTabWidget()
+        for item in self.config.charts:
+            self.chart_tabs.addTab(RollingChart(item['title'], item['fields'], labels, self.config.chart_span),
+                                   item['title'])
+        self.chart_tabs.currentChanged.connect(self._update_charts)  # 参数为页号, 立即刷新
+        self.right_panel.addWidget(self.chart_tabs, 1)
+
+    # 刷新曲线图
+    def _update_charts(self, force=False):
+        """刷新当前显示的曲线图, 最多每秒 chart_refresh_hz 次 (切换页面时立即刷新)
+
+        正在记录并汇总数据金字塔时, 采样历史容纳不下的较早部分从金字塔读取。
+        """
+        if self.chart_tabs is None or self.samples is None:
+            return
+        now = time.monotonic()
+        if force is not False or now - self._chart_refreshed >= 1 / self.config.chart_refresh_hz:
+            self._chart_refreshed = now
+            pyramid = self.csv_writer.pyramid if self.csv_writer else None
+            self.chart_tabs.currentWidget().refresh(self.samples, pyramid and pyramid.path)
+
+    # 字段名 -> 显示名称
+    def _field_labels(self):
+        """字段名对应的显示名称 (与CSV表头相同)"""
+        derived = [item['name'] for item in self.config.derived_channels]
+        head = self._csv_header(self.config.modbus_head, self.config.derived_channels)
+        return dict(zip(CsvLogReader.FIELDS[:-1] + tuple(derived), head))
+
+    # 更新统计表
+    def _update_stats_view(self):
+        """显示全程统计 (采集线程逐个样本累计) 和采样历史中最近 stats_window 秒的统计
 
+        两者都只计入该通道所属轮询组实际读取过的行, 较慢的组沿用的旧值不重复计入。
+        """
+        if self.stats_table is None or not self.samples.written:
+            return
+        end = self.samples.window(1)['time'][0]
+        window = self.samples.since(end - int(self.config.stats_window * 1e9))
+        for row, name in enumerate(self.config.stats_channels):
+            read = (window['read'] & self.thread.stats_masks[name]) != 0
+            values = self.thread.stats[name].values() + RunningStats.of(window[name][read]).values()
+            for column, value in enumerate(values):
+                self.stats_table.item(row, column).setText('--' if value is None else f'{value:.6g}')
+
+    # 运行统计汇总
+    def _write_run_summary(self):
+        """停止采集时输出全程统计: 写入日志, 记录数据时同时写入 记录文件名_summary.csv"""
+        stats = self.thread.stats
+        if not stats:
+            return
+        labels = self._field_labels()
+        for name, item in stats.items():
+            self.log_message('info', f'统计 {labels.get(name, name)}: {item}')
+        if not (self.ui.cboxdaq.isChecked() and self.csv_filename):
+            return
+        filename = os.path.splitext(self.csv_filename)[0] + '_summary.csv'
+        try:
+            with open(filename, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['通道', '样本数'] + [label for _, label in RunningStats.STATS])
+                for name, item in stats.items():
+                    writer.writerow([labels.get(name, name), item.count] + item.values())
+            self.log_message('info', f'运行统计已保存到 {filename}')
+        except OSError as e:
+            self.log_message('error', f'保存运行统计失败: {str(e)}')
 
     # 更新数据显示
     def update_data_display(self, data):
-        """更新数据显示"""
-        # 更新变频器数据显示
-        self.ui.ledoutrot.display(data['speed'])
-        self.ui.ledoutvot.display(data['voltage'])
-        self.ui.ledoutcur.display(data['current'])
-        self.ui.ledoutpow.display(data['power'])
-        self.ui.ledouttor.display(data['torque'])
-
-        # 更新转矩仪数据显示
-        self.ui.ledreadtor.display(data['torque_meter_torque'])
-        self.ui.ledreadrot.display(data['torque_meter_speed'])
-        self.ui.ledreadpwr.display(data['torque_meter_power'])
-
-        # 更新转矩仪数据显示
-        self.ui.ledCH0.display(data['ch0'])
-        self.ui.ledCH1.display(data['ch1'])
-        self.ui.ledCH2.display(data['ch2'])
-        self.ui.ledCH3.display(data['ch3'])
-        self.ui.ledCH4.display(data['ch4'])
-        self.ui.ledCH5.display(data['ch5'])
-        self.ui.ledCH6.display(data['ch6'])
-        self.ui.ledCH7.display(data['ch7'])
+        """更新数据显示 (读取失败的字段显示为 --)"""
+        displays = [
+            # 更新变频器数据显示
+            (self.ui.ledoutrot, 'speed'),
+            (self.ui.ledoutvot, 'voltage'),
+            (self.ui.ledoutcur, 'current'),
+            (self.ui.ledoutpow, 'power'),
+            (self.ui.ledouttor, 'torque'),
+            (self.ui.ledupt, 'accel_time'),
+            (self.ui.leddot, 'decel_time'),
+            # 更新转矩仪数据显示
+            (self.ui.ledreadtor, 'torque_meter_torque'),
+            (self.ui.ledreadrot, 'torque_meter_speed'),
+            (self.ui.ledreadpwr, 'torque_meter_power'),
+            # 更新物理量数据显示
+            (self.ui.ledCH0, 'ch0'),
+            (self.ui.ledCH1, 'ch1'),
+            (self.ui.ledCH2, 'ch2'),
+            (self.ui.ledCH3, 'ch3'),
+            (self.ui.ledCH4, 'ch4'),
+            (self.ui.ledCH5, 'ch5'),
+            (self.ui.ledCH6, 'ch6'),
+            (self.ui.ledCH7, 'ch7'),
+        ] + self.derived_displays
+        for lcd, key in displays:
+            value = data.get(key)
+            lcd.display('--' if value is None else value)
 
         # 更新运行状态
         status = data['status']
-        if 0 <= status < len(self.run_status_text):
+        if status is not None and 0 <= status < len(self.run_status_text):
             self.ui.labisrun.setText(self.run_status_text[status])
 
-        # 如果需要保存数据
-        if self.ui.cboxdaq.isChecked():
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-            record = [
-                timestamp,
-                data['speed'],
-                data.get('set_speed', 0),  # 如果没有设定转速则使用0
-                data['voltage'],
-                data['current'],
-                data['power'],
-                data['torque'],
-                data['torque_meter_torque'],
-                data['torque_meter_speed'],
-                data['torque_meter_power'],
-                data['ch0'],
-                data['ch1'],
-                data['ch2'],
-                data['ch3'],
-                data['ch4'],
-                data['ch5'],
-                data['ch6'],
-                data['ch7'],
-
-            ]
-            # self.data_buffer.append(record)
-            self._write_to_csv(record)  # 直接写入CSV
+    # 把新增记录写入CSV
+    def _record_samples(self, end):
+        """把采样历史中尚未写入的记录 (到序号end为止) 复制一份交给CSV写入线程"""
+        start = self._recorded
+        if not self.samples.contains(start) and start < end:
+            lost = min(end, self.samples.written - self.samples.capacity) - start
+            self.log_message('warning', f'采样历史已覆盖 {lost} 条未写入的记录')
+            start += lost
+        self._write_to_csv(self.samples.range(start, end).copy())
+        self._recorded = end
+
+    # 记录字典转换为CSV行
+    @staticmethod
+    def _csv_record(data, derived=()):
+        """记录字典转换为CSV行 (在CSV写入线程中调用), derived 为派生量名称"""
+        timestamp = datetime.fromtimestamp(data['time'] / 1e9).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+        return [
+            timestamp,
+            data['speed'],
+            data.get('set_speed', 0),  # 如果没有设定转速则使用0
+            data['voltage'],
+            data['current'],
+            data['power'],
+            data['torque'],
+            data['torque_meter_torque'],
+            data['torque_meter_speed'],
+            data['torque_meter_power'],
+            data['ch0'],
+            data['ch1'],
+            data['ch2'],
+            data['ch3'],
+            data['ch4'],
+            data['ch5'],
+            data['ch6'],
+            data['ch7'],
+        ] + [data.get(name) for name in derived] + [
+            data.get('gap', ''),  # 连接中断标记, 读取失败的字段为空
+        ]
 
     # 发送自定义命令
     def send_custom_command(self):
@@ -582,11 +876,17 @@ class MotorController(QWidget):
             self.log_message('error', '命令长度必须为偶数')
             return
 
+        try:
+            request = bytes.fromhex(command)
+        except ValueError:
+            self.log_message('error', '命令必须为十六进制字符串')
+            return
+
         self.log_message('info', f'发送命令: {command}')
-        success, response = self.send_command(command)
+        success, response = self.send_command(request)
 
         if success:
-            self.log_message('info', f'收到响应: {response}')
+            self.log_message('info', f'收到响应: {bytes(response).hex()}')
         else:
             self.log_message('error', '命令发送失败')
 
@@ -597,7 +897,13 @@ class MotorController(QWidget):
 
     # 记录日志消息
     def log_message(self, level, message):
-        """记录日志消息"""
+        """记录日志消息 (可在任意线程调用)"""
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+        self.log_signal.emit(level, message, timestamp)
+
+    # 在GUI线程显示日志消息
+    def _append_log(self, level, message, timestamp):
+        """在GUI线程显示日志消息"""
         levels = {
             'info': Qt.black,
             'warning': Qt.darkYellow,
@@ -606,7 +912,6 @@ class MotorController(QWidget):
         }
 
         color = levels.get(level.lower(), Qt.black)
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
 
         self.ui.wrigra.setTextColor(color)
         self.ui.wrigra.append(f"[{timestamp}] {level.upper()}: {message}")
@@ -618,236 +923,4157 @@ class MotorController(QWidget):
     # 关闭窗口事件处理
     def closeEvent(self, event):
         """关闭窗口事件处理"""
-        if self.thread and self.thread.isRunning():
-            self.thread.stop()
-            self.thread.wait(2000)
+        self.shutdown()
+        super().closeEvent(event)
 
+    # 退出程序
+    def shutdown(self):
+        """退出前停止采集 (写完队列中的记录、删除预写日志、写运行汇总) 并关闭连接
+
+        写入线程为守护线程, 程序退出时不会等待; 主窗口关闭时由 QApplication.aboutToQuit 调用。
+        """
+        if self.thread and self.thread.isRunning():
+            self._stop_data_collection()
         self._close_socket()
-        super().closeEvent(event)
 
 
 # 数据采集线程
 class DataCollectionThread(QThread):
-    """数据采集线程"""
-    data_ready = pyqtSignal(dict)
+    """数据采集线程
+
+    线程内运行 asyncio 事件循环, 并发读取两条独立连接上的设备:
+    RTU网关(变频器、转矩仪, 经总线线程依次读取) 与 Modbus TCP 采集卡,
+    周期耗时取决于最慢的一路而不是各设备往返时间之和。
+    各轮询组按自己的采样率由 PollScheduler 调度, 每次有组到期读取后把各字段最新值写入
+    采样历史 samples (SampleBuffer); 界面按自己的定时器从采样历史读取, 采集不等待界面。
+    """
+    RTU_FIELDS = ('speed', 'voltage', 'current', 'power', 'torque', 'status', 'accel_time', 'decel_time',
+                  'torque_meter_torque', 'torque_meter_speed', 'torque_meter_power')
+    DAQ_FIELDS = tuple(f'ch{i}' for i in range(8))
+    DAQ_TIMEOUT = 0.5  # 采集卡连接超时, 也是响应超时的初始值(秒)
 
     def __init__(self, interval, controller):
         super().__init__()
         self.interval = interval
         self.controller = controller
         self._running = False
-        self.request = bytes.fromhex("00 00 00 00 00 06 00 04 01 01 00 08")
-        self.sock2 = None  # 第二socket,用于连接modbus采集卡
+        self.frame_cache = controller.frame_cache
+        self.request = self.frame_cache.daq_request
         self.config = MotorConfig()
-        if self.config.usesocket2:
-            self._connect_to_modbus()  # 物理量采集连接
+        self.daq = ModbusTcpClient(self.config.ip_address2, self.config.port2, self.DAQ_TIMEOUT)  # 第二连接,用于连接modbus采集卡
+        self.retry_budget = RetryBudget(self.config.retry_budget)  # 每周期所有设备共享的重试次数
+        self.calibration = Calibration.from_config(self.config)  # 采集卡通道标定
+        self.breakers = {
+            'inverter': CircuitBreaker('变频器', self._on_breaker_change),
+            'torque_meter': CircuitBreaker('转矩仪', self._on_breaker_change),
+            'daq': CircuitBreaker('采集卡', self._on_breaker_change),
+        }
+        self._probes = set()  # 进行中的后台探测任务
+        self.scheduler = None  # 采集开始后可读取其中的抖动和耗时直方图
+        # 各字段的最新值 (未启用采集卡时通道为-1)
+        self.latest = dict.fromkeys(self.RTU_FIELDS)
+        self.latest.update(dict.fromkeys(reg.name for reg in self.frame_cache.plan.registers))
+        self.latest.update(dict.fromkeys(self.DAQ_FIELDS, None if self.config.usesocket2 else -1))
+        self.derived = DerivedChannels.from_config(self.config, self.latest)  # 派生量, 逐个样本计算后一并记录
+        self.latest.update(dict.fromkeys(self.derived.names))
+        unknown = set(self.config.stats_channels) - set(self.latest)
+        if unknown:
+            raise ValueError(f'统计通道未知: {", ".join(sorted(unknown))}')
+        unknown = {name for item in self.config.charts for name in item['fields']} - set(self.latest)
+        if unknown:
+            raise ValueError(f'曲线图字段未知: {", ".join(sorted(unknown))}')
+        self.stats = {name: RunningStats() for name in self.config.stats_channels}  # 全程统计, 逐个样本更新
+        self.device_times = {}  # 各设备最近一次读取成功的时间(纳秒)
+        plan = self.frame_cache.plan
+        integer_fields = {'speed'} | {reg.name for reg in plan.registers
+                                      if reg.scale == 1 and reg.divisor == 1 and reg.type != 'float32'}
+        if not self.config.usesocket2:
+            integer_fields.update(self.DAQ_FIELDS)
+        self.samples = SampleBuffer(self.latest, self.config.history_size, integer_fields,
+                                    list(dict.fromkeys([*plan.groups(), 'daq'])))
+        # 各字段所属轮询组的标志位 (派生量为其输入所属各组的并集); 统计只计入本周期读取过的组,
+        # 沿用的旧值不重复计入 (全程统计在采集线程中判断, 窗口统计按采样历史的 read 列判断)
+        bits = self.samples.group_bits
+        masks = {reg.name: bits[reg.group] for reg in plan.registers}
+        masks.update((name, bits['daq']) for name in self.DAQ_FIELDS)
+        for item in self.derived.channels:
+            masks[item['name']] = functools.reduce(
+                operator.or_, (masks.get(item[key], 0) for key in DerivedChannels.TYPES[item['type']]), 0)
+        self.stats_masks = {name: masks.get(name, 0) for name in self.config.stats_channels}
 
-    # 建立socket2连接
-    def _connect_to_modbus(self):
-        """建立socket连接"""
+    # 建立采集卡连接
+    async def _connect_to_modbus(self):
+        """建立采集卡连接"""
         try:
-            self.sock2 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.sock2.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-            self.sock2.settimeout(0.5)
-            self.sock2.connect((self.config.ip_address2, self.config.port2))
+            await self.daq.connect()
 
             MotorController.log_message(self.controller, 'info', '物理量采集连接成功')
             return True
         except Exception as e:
             MotorController.log_message(self.controller, 'error', f'物理量采集连接失败: {str(e)}')
-            self._close_socket()
+            await self._close_socket()
             return False
 
-    # 安全关闭socket
-    def _close_socket(self):
-        """安全关闭socket"""
-        if self.sock2:
-            try:
-                self.sock2.close()
-            except:
-                pass
-            finally:
-                self.sock2 = None
+    # 熔断器状态变化
+    def _on_breaker_change(self, breaker):
+        """熔断器状态变化时记录日志"""
+        if breaker.state == CircuitBreaker.OPEN:
+            MotorController.log_message(self.controller, 'warning',
+                                        f'{breaker.name}连续无响应, 暂停轮询, {breaker.cooldown:.1f} 秒后探测')
+        elif breaker.state == CircuitBreaker.CLOSED:
+            MotorController.log_message(self.controller, 'info', f'{breaker.name}已恢复响应')
+
+    # 安全关闭采集卡连接
+    async def _close_socket(self):
+        """安全关闭采集卡连接"""
+        await self.daq.close()
 
     def run(self):
+        asyncio.run(self._run_async())
+
+    async def _run_async(self):
         self._running = True
-        next_time = time.time()
+        daq_monitor = None
+        MotorController.log_message(self.controller, 'info', f'寄存器读取规划: {self.frame_cache.plan}')
+        if self.config.usesocket2:
+            MotorController.log_message(self.controller, 'info', f'采集卡标定: {self.calibration}')
+            await self._connect_to_modbus()  # 物理量采集连接
+            daq_monitor = asyncio.create_task(self._maintain_daq_connection())
+        scheduler = self.scheduler = self._create_scheduler()
+        blocked = 0
+        warned_at = scheduler.clock()
+
+        try:
+            while self._running:
+                try:
+                    # 等待最近的截止时间, 读取到期的轮询组
+                    started, due = await scheduler.wait()
+                    data = await self._collect_data(due)
+                    if data:
+                        timestamp = time.time_ns()
+                        self.derived.update(data, timestamp)
+                        read = 0
+                        for task in due:
+                            read |= self.samples.group_bits[task.name]
+                        self.samples.push(data, timestamp, self.device_times, read)
+                        for name, stats in self.stats.items():
+                            if self.stats_masks[name] & read:
+                                stats.add(data[name])
+
+                    blocked += scheduler.complete(due, started)
+                    now = scheduler.clock()
+                    if blocked and now - warned_at >= 1.0:
+                        print("Warning: Data collection can't keep up with interval")
+                        MotorController.log_message(self.controller, 'warning', f'采集阻塞, 跳过 {blocked} 个周期')
+                        blocked = 0
+                        warned_at = now
+                except Exception as e:
+                    print(f"Data collection error: {e}")
+                    MotorController.log_message(self.controller, 'error', f'采集失败: {e}')
+                    await asyncio.sleep(1)  # 出错时短暂等待
+        finally:
+            if daq_monitor:
+                daq_monitor.cancel()
+            for probe in list(self._probes):
+                probe.cancel()
+            MotorController.log_message(self.controller, 'info', f'轮询统计: {scheduler}')
+            if self.daq.rtt.samples:
+                MotorController.log_message(self.controller, 'info', f'采集卡 {self.daq.rtt}')
+            await self._close_socket()
+
+    # 按轮询组建立调度
+    def _create_scheduler(self):
+        """按轮询组建立调度: poll_rates 中列出的组按各自采样率, 其余按采样间隔"""
+        scheduler = PollScheduler(self.config.sched_policy, self.config.sched_spin)
+        rates = self.config.poll_rates
+        for group in self.frame_cache.plan.groups():
+            scheduler.add(group, 'rtu', 1 / rates[group] if rates.get(group) else self.interval)
+        if self.config.usesocket2:
+            scheduler.add('daq', 'daq', 1 / rates['daq'] if rates.get('daq') else self.interval)
+        return scheduler
 
+    # 采集卡断线后台重连
+    async def _maintain_daq_connection(self):
+        """采集卡断线后在后台按指数退避重连, 采集循环不受影响"""
+        backoff = ReconnectBackoff()
+        lost_at = None
         while self._running:
-            try:
-                # 收集数据
-                data = self._collect_data()
-                if data:
-                    self.data_ready.emit(data)
-
-                # 精确的时间控制
-                next_time += self.interval
-                sleep_time = next_time - time.time()
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
-                else:
-                    print("Warning: Data collection can't keep up with interval")
-                    MotorController.log_message(self.controller, 'warning', f'采集阻塞')
-            except Exception as e:
-                print(f"Data collection error: {e}")
-                MotorController.log_message(self.controller, 'error', f'采集失败: {e}')
-                time.sleep(1)  # 出错时短暂等待
+            if self.daq.connected:
+                await asyncio.sleep(0.1)
+                continue
+            if lost_at is None:
+                lost_at = time.monotonic()
+                MotorController.log_message(self.controller, 'warning', '物理量采集连接中断, 正在后台重连')
+            await asyncio.sleep(backoff.next_delay())
+            if await self._connect_to_modbus():
+                backoff.reset()
+                MotorController.log_message(self.controller, 'info',
+                                            f'物理量采集连接已恢复 (中断 {time.monotonic() - lost_at:.1f} 秒)')
+                lost_at = None
 
     # 收集电机数据
-    def _collect_data(self):
-        """收集电机数据"""
-        data = {}
+    async def _collect_data(self, due):
+        """读取到期的轮询组 (RTU网关与采集卡并发读取), 返回各字段的最新值
+
+        本次未到期的组沿用上次读取的值; 读取失败或已熔断的组字段为None;
+        gap 字段标记本周期中断的连接和离线设备, 写入数据记录。
+        """
+        self.retry_budget.reset()
+        await asyncio.gather(self._read_rtu_groups([task.name for task in due if task.lane == 'rtu']),
+                             *(self._read_daq() for task in due if task.lane == 'daq'))
+        data = dict(self.latest)
 
-        # 读取电机参数
-        success, response = self.controller.send_command('010370000007', '0103')
+        gaps = []
+        if not self._bus_connected():
+            gaps.append('网关断开')
+        if self.config.usesocket2 and not self.daq.connected:
+            gaps.append('采集卡断开')
+        gaps.extend(f'{breaker.name}离线' for breaker in self.breakers.values()
+                    if breaker.state != CircuitBreaker.CLOSED)
+        data['gap'] = ';'.join(gaps)
+        return data
 
-        if success:
-            try:
-                read_data = struct.unpack('>hhhhhhh', bytes.fromhex(response)[3:17])
-                data['speed'] = round(read_data[0] * 0.6 * self.controller.motor_params['rotation_ratio']*self.config.spdrate)
-                data['voltage'] = read_data[3]
-                data['current'] = read_data[4] / 100
-                data['power'] = read_data[5] / 10
-                data['torque'] = read_data[6] / 10
-            except Exception as e:
-                print(f"解析电机参数出错: {e}")
+    # 网关连接是否正常
+    def _bus_connected(self):
+        """网关连接是否正常"""
+        bus = self.controller.bus
+        return bus is not None and bus.connected
 
-        # # 读取运行状态
-        if data['speed'] >= 5:
-            data['status'] = 1
+    # 经熔断器读取设备
+    async def _guarded_read(self, breaker, read, link_up):
+        """经熔断器读取设备
+
+        熔断器闭合时正常读取并记录结果; 断开时跳过该设备, 到探测时间后在后台发起一次探测,
+        本周期不等待探测结果。所在连接中断时不计入设备失败 (由重连处理)。
+        read(probe) 返回数据字典, 失败返回None。
+        """
+        if not link_up():
+            return None
+        if breaker.state == CircuitBreaker.CLOSED:
+            result = await read(False)
+            breaker.record(result is not None)
+            return result
+        if breaker.probe_due():
+            probe = asyncio.create_task(read(True))
+            probe.add_done_callback(
+                lambda task: breaker.record(not task.cancelled() and task.exception() is None
+                                            and task.result() is not None))
+            self._probes.add(probe)
+            probe.add_done_callback(self._probes.discard)
+        return None
+
+    # 经总线线程发送轮询请求
+    async def _poll(self, request, probe=False):
+        """经总线线程发送轮询请求 (探测只发一次, 不占用重试预算)"""
+        bus = self.controller.bus
+        if bus is None or not bus.connected:
+            return False, None
+        if probe:
+            future = bus.submit(request, request[:2], 1, BusWorker.PRIORITY_POLL)
         else:
-            data['status'] = 0
-        # 读取转矩仪数据
-        success, response = self.controller.send_command('020300000006', '0203')
+            future = bus.submit(request, request[:2], 3, BusWorker.PRIORITY_POLL, self.retry_budget)
+        return await asyncio.wrap_future(future)
 
-        if success:
+    # 读取RTU网关上的轮询组
+    async def _read_rtu_groups(self, groups):
+        """读取RTU网关上到期的轮询组 (同一条485总线, 按截止时间先后依次读取)"""
+        plan = self.frame_cache.plan
+        for group in groups:
+            device = plan.groups()[group]
+            values = await self._guarded_read(self.breakers[device],
+                                              lambda probe, group=group: self._read_group(group, probe),
+                                              self._bus_connected)
+            if values is None:
+                values = dict.fromkeys(reg.name for reg in plan.registers if reg.group == group)
+            else:
+                self.device_times[device] = time.time_ns()
+            self.latest.update(values)
+
+    # 按读取规划读取轮询组的全部块
+    async def _read_group(self, group, probe):
+        """按读取规划读取轮询组的全部块并换算, 任一块失败返回None"""
+        values = {}
+        for block in self.frame_cache.plan.group_blocks(group):
+            success, response = await self._poll(block.request, probe)
+            if not success:
+                return None
             try:
-                read_data = struct.unpack('>iii', bytes.fromhex(response)[3:15])
-                data['torque_meter_torque'] = read_data[0] / 100
-                data['torque_meter_speed'] = read_data[1] / 10*self.config.spdrate
-                data['torque_meter_power'] = read_data[2] / 100
-            except Exception as e:
-                print(f"解析转矩仪数据出错: {e}")
+                values.update(block.decode(response))
+            except socket.timeout as e:
+                MotorController.log_message(self.controller, 'warning', f'轮询组 {group} {e}')
+                return None  # 按读取失败计入熔断器
 
+        # 转速按传动比和转速系数换算
+        if 'speed' in values:
+            values['speed'] = round(values['speed'] * self.controller.motor_params['rotation_ratio'] *
+                                    self.config.spdrate)
+        if 'torque_meter_speed' in values:
+            values['torque_meter_speed'] = values['torque_meter_speed'] * self.config.spdrate
+        return values
 
-        for i in range(8):
-            data[f'ch{i}'] = -1
+    # 读取采集卡8通道
+    async def _read_daq(self):
+        """读取采集卡8通道 (读取失败或已熔断为None)"""
+        channels = await self._guarded_read(self.breakers['daq'], self._read_daq_channels,
+                                            lambda: self.daq.connected)
+        if channels:
+            self.device_times['daq'] = time.time_ns()
+        self.latest.update(channels or dict.fromkeys(self.DAQ_FIELDS))
 
-        if self.config.usesocket2:
-            self.sock2.sendall(self.request)
-            # 接收响应
-            response = self.sock2.recv(1024)
-            if len(response) >= 25:
-                read_data = struct.unpack('>8H', response[9:25])
-                for i in range(8):
-                    data[f'ch{i}'] = read_data[i] * (self.config.modbus_max[i] - self.config.modbus_min[i]) / 65536 + \
-                                     self.config.modbus_min[i]
-                    data[f'ch{i}']=round(data[f'ch{i}'], 6)
-                print(data[f'ch1'])
-                print(type(data[f'ch1']))
-                # print([data[f'ch{i}'] for i in range(8) ])
-
-        return data if data else None
+    # 读取采集卡通道原始值并换算
+    async def _read_daq_channels(self, probe):
+        """读取采集卡通道原始值并换算"""
+        try:
+            if probe:
+                response = await self.daq.execute(self.request)
+            else:
+                response = await self.daq.execute(self.request, retries=2, budget=self.retry_budget)
+        except asyncio.TimeoutError:
+            MotorController.log_message(self.controller, 'warning', '物理量采集超时')
+            return None
+        except ConnectionError as e:
+            MotorController.log_message(self.controller, 'error', str(e))
+            return None
+        if len(response) < 25 or response[7] != 0x04:
+            return None
+
+        raw = struct.unpack_from(f'>{len(self.DAQ_FIELDS)}H', response, 9)
+        return dict(zip(self.DAQ_FIELDS, self.calibration.apply_frame(raw)))
 
     # 停止线程
     def stop(self):
         """停止线程"""
-        # if self.config.usesocket2:
-        #     self.sock2.close()
         self._running = False
 
 
-class CRCHelper:
-    """CRC校验工具类"""
+# 耗时直方图
+class Histogram:
+    """耗时直方图 (按毫秒对数分桶, 记录为O(1), 可在其他线程读取)"""
+    BOUNDS = (0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)  # 各桶上限(毫秒)
 
-    # 计算CRC16校验码
-    @staticmethod
-    def calculate_crc(data):
-        """计算CRC16校验码"""
-        crc = 0xFFFF
-        for byte in data:
-            crc ^= byte
-            for _ in range(8):
-                if crc & 0x0001:
-                    crc >>= 1
-                    crc ^= 0xA001
-                else:
-                    crc >>= 1
-        return crc.to_bytes(2, 'little')
+    def __init__(self, name):
+        self.name = name
+        self.counts = [0] * (len(self.BOUNDS) + 1)  # 最后一桶为超过1秒
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
 
-    # 验证CRC校验码
-    @staticmethod
-    def verify_crc(data):
-        """验证CRC校验码"""
-        if len(data) < 2:
-            return False, None
+    # 记录一次耗时
+    def record(self, seconds):
+        """记录一次耗时(秒)"""
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.BOUNDS, ms)] += 1
+        self.total += 1
+        self.sum += ms
+        if ms > self.max:
+            self.max = ms
 
-        payload = data[:-2]
-        received_crc = data[-2:]
-        calculated_crc = CRCHelper.calculate_crc(payload)
-        return received_crc == calculated_crc, payload
+    # 分位数上限
+    def percentile(self, p):
+        """返回第p分位所在桶的上限(毫秒), 落在最后一桶时返回最大值"""
+        target = p * self.total
+        cumulative = 0
+        for bound, count in zip(self.BOUNDS, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return self.max
 
-    # 添加CRC校验码到数据
-    @staticmethod
-    def add_crc(data):
-        """添加CRC校验码到数据"""
-        crc = CRCHelper.calculate_crc(data)
-        return data + crc
+    # 各桶计数
+    def buckets(self):
+        """返回 [(桶标签, 计数)], 供界面或测试显示"""
+        labels = [f'≤{bound}ms' for bound in self.BOUNDS] + [f'>{self.BOUNDS[-1]}ms']
+        return list(zip(labels, self.counts))
 
+    def __str__(self):
+        if not self.total:
+            return f'{self.name}: 无数据'
+        return (f'{self.name}: 平均 {self.sum / self.total:.2f} ms, P50 ≤{self.percentile(0.5):g} ms, '
+                f'P99 ≤{self.percentile(0.99):g} ms, 最大 {self.max:.2f} ms ({self.total} 次)')
 
-# 电机配置类
-class MotorConfig:
-    """电机配置类"""
 
-    def __init__(self):
-        self.ip_address = "192.168.1.122"
-        self.port = 8802
-        self.ip_address2 = "192.168.1.220"
-        self.port2 = 502
-        self.max_speed = 3000
-        self.spdrate=1.7
-        self.rotation_ratio = 1
-        self.sample_interval = 1
-        self.usesocket2 = 1
-        self.modbus_head = ["温度1【℉】", "压力1【bar】", "流量1【sccm】", "振动1【mm/s^2】",
-                            "温度2【℃】", "压力2【mpa】", "流量2【slm】", "振动2【mm/s】"]
-        self.modbus_min = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.modbus_max = [100, 100, 100, 100, 100, 100, 100, 100]
-        self.load_from_file("config.json")
+# 多速率轮询调度
+class PollScheduler:
+    """多速率轮询调度
 
-    def save_to_file(self, filename):
-        """保存配置到文件"""
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(self.__dict__, f, ensure_ascii=False, indent=4)
+    每个轮询组 (寄存器组或设备) 有自己的周期和截止时间, 到期的组按截止时间先后读取 (EDF);
+    同一连接上的组依次占用总线, 截止时间最早的先读, 慢速组不会被快速组挤掉。
+    截止时间按周期累加在单调时钟上 (不随读取耗时和系统时间调整漂移)。
+    等待时先 sleep, spin 大于0时最后 spin 秒自旋, 弥补系统定时器精度 (Windows 约15ms);
+    spin 为0时只 sleep (定时器提前触发时再次 sleep 到截止时间), 不在事件循环线程上忙等。
+    错过截止时间的处理策略:
+        skip     跳到下一个未到的截止时间, 不补读 (保持原相位)
+        catchup  立即连续补读错过的周期, 落后超过 CATCHUP_LIMIT 个周期时按 skip 处理
+        rephase  从读取完成时刻起重新计时 (相位后移)
+    启动抖动 (实际开始读取时刻 - 截止时间) 与每次读取耗时记入直方图。
+    """
+    POLICIES = ('skip', 'catchup', 'rephase')
+    CATCHUP_LIMIT = 10
+    clock = staticmethod(time.perf_counter)  # 高精度单调时钟
 
-    # def load_from_file(self, filename):
-    #     """从文件加载配置"""
-    #     with open(filename, 'r') as f:
-    #         data = json.load(f)
-    #         self.__dict__.update(data)
+    class Task:
+        """轮询组"""
 
-    def load_from_file(self, filename):
-        """
-        从文件加载配置
-        如果文件不存在，则保存当前配置为默认值
+        def __init__(self, name, lane, period, due):
+            self.name = name
+            self.lane = lane  # 所在连接: 'rtu' 或 'daq'
+            self.period = period
+            self.due = due
+            self.reads = 0
+            self.missed = 0  # 错过 (未按时读取) 的周期数
+
+    def __init__(self, policy='skip', spin=0.0):
+        if policy not in self.POLICIES:
+            raise ValueError(f'未知的调度策略: {policy}')
+        self.policy = policy
+        self.spin = spin
+        self.start = self.clock()
+        self.tasks = []
+        self.jitter = Histogram('启动抖动')
+        self.cycle = Histogram('读取耗时')
+
+    # 添加轮询组
+    def add(self, name, lane, period):
+        """添加轮询组, 首次截止时间为开始时间"""
+        self.tasks.append(self.Task(name, lane, period, self.start))
+
+    # 最近的截止时间
+    def next_due(self):
+        """最近的截止时间"""
+        return min(task.due for task in self.tasks)
+
+    # 已到期的轮询组
+    def due_tasks(self, now):
+        """已到期的轮询组, 按截止时间先后排列"""
+        return sorted((task for task in self.tasks if task.due <= now), key=lambda task: task.due)
+
+    # 等待下一批到期的轮询组
+    async def wait(self):
+        """等待到最近的截止时间, 返回 (开始时刻, 到期的轮询组) 并记录启动抖动"""
+        deadline = self.next_due()
+        delay = deadline - self.clock() - self.spin
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.spin > 0:
+            while self.clock() < deadline:
+                pass  # 自旋等待最后一段
+        else:
+            # 事件循环的定时器可能提前最多一个时钟精度触发, 未到截止时间时继续 sleep, 不占用CPU
+            remaining = deadline - self.clock()
+            while remaining > 0:
+                await asyncio.sleep(remaining)
+                remaining = deadline - self.clock()
+        now = self.clock()
+        self.jitter.record(now - deadline)
+        return now, self.due_tasks(now)
+
+    # 完成一批读取
+    def complete(self, tasks, started):
+        """完成一批读取, 按策略推进截止时间, 返回本批错过的周期数"""
+        now = self.clock()
+        self.cycle.record(now - started)
+        missed = 0
+        for task in tasks:
+            task.reads += 1
+            task.due += task.period
+            if task.due > now:
+                continue
+            behind = int((now - task.due) // task.period) + 1
+            if self.policy == 'rephase':
+                task.due = now + task.period
+            elif self.policy == 'skip' or behind > self.CATCHUP_LIMIT:
+                task.due += behind * task.period
+            else:
+                continue  # catchup: 保留截止时间, 下次循环立即补读
+            task.missed += behind
+            missed += behind
+        return missed
+
+    def __str__(self):
+        return '; '.join(f'{task.name} {1 / task.period:.1f} Hz 读取 {task.reads} 次 错过 {task.missed} 次'
+                         for task in self.tasks)
+
+
+# 最小/最大值抽取
+class MinMaxDecimator:
+    """按固定时间宽度 (一个像素对应的时间) 分桶, 增量计算每桶各字段的最小值、最大值和平均值
+
+    feed() 只处理新增的行; 最后一个桶可能还会收到数据, 暂不输出, 等下一个桶开始后再输出。
+    每桶输出最小、最大两个点, 曲线点数约为像素宽度的两倍, 与数据量无关。
+    桶按时间的整数倍对齐, 同一宽度的桶在采样历史和数据金字塔中位置相同。
+    """
+
+    def __init__(self, fields, bucket_ns):
+        self.fields = fields
+        self.bucket_ns = max(1, int(bucket_ns))
+        self._open = None  # 未结束的桶: (桶号, 最小值, 最大值, 和, 有效样本数)
+
+    # 加入新行
+    def feed(self, rows):
+        """加入新行 (按时间先后), 返回已结束的桶: (桶起始时间纳秒数组, 最小值 (桶数, 字段数), 最大值)"""
+        starts, lows, highs, _, _ = self.feed_values(rows['time'],
+                                                     np.column_stack([rows[name] for name in self.fields]))
+        return starts, lows, highs
+
+    # 加入新数据
+    def feed_values(self, times, values):
+        """加入新数据 (时间数组和 (行数, 字段数) 的数值), 返回已结束的桶:
+        (桶起始时间纳秒数组, 最小值, 最大值, 平均值, 有效样本数), 后四项形状为 (桶数, 字段数)
         """
+        if not len(times):
+            return self._result(np.empty(0, 'i8'), *(np.empty((0, len(self.fields))) for _ in range(4)))
+        ids = times // self.bucket_ns
+        starts = np.flatnonzero(np.concatenate(([True], ids[1:] != ids[:-1])))
+        valid = ~np.isnan(values)
+        lows = np.fmin.reduceat(values, starts, axis=0)  # fmin/fmax 忽略NaN, 整桶为空时为NaN
+        highs = np.fmax.reduceat(values, starts, axis=0)
+        sums = np.add.reduceat(np.where(valid, values, 0.0), starts, axis=0)
+        counts = np.add.reduceat(valid, starts, axis=0, dtype='i8')
+        buckets = ids[starts]
+        if self._open is not None:
+            bucket, low, high, total, count = self._open
+            if buckets[0] == bucket:
+                lows[0] = np.fmin(lows[0], low)
+                highs[0] = np.fmax(highs[0], high)
+                sums[0] += total
+                counts[0] += count
+            else:
+                buckets = np.concatenate(([bucket], buckets))
+                lows = np.vstack((low, lows))
+                highs = np.vstack((high, highs))
+                sums = np.vstack((total, sums))
+                counts = np.vstack((count, counts))
+        self._open = (buckets[-1], lows[-1], highs[-1], sums[-1], counts[-1])
+        return self._result(buckets[:-1], lows[:-1], highs[:-1], sums[:-1], counts[:-1])
+
+    # 结束
+    def finish(self):
+        """输出最后一个未结束的桶 (记录结束时调用), 格式与 feed_values 相同"""
+        if self._open is None:
+            return self.feed_values(np.empty(0, 'i8'), None)
+        bucket, low, high, total, count = self._open
+        self._open = None
+        return self._result(np.array([bucket]), low[None], high[None], total[None], count[None])
+
+    def _result(self, buckets, lows, highs, sums, counts):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts  # 没有有效样本时为NaN
+        return buckets * self.bucket_ns, lows, highs, means, counts
+
+
+# 滚动曲线图
+class RollingChart(QChartView):
+    """滚动曲线图: 显示采样历史中最近 span 秒的数据
+
+    新增数据按像素宽度做最小/最大值抽取后追加到各曲线的点队列, 移出时间窗口的点从队列头部删除,
+    再一次性 replace 到曲线 (逐点 append 会让曲线逐点重算, 点多时很慢);
+    每次刷新的耗时只与新增数据量和像素宽度有关, 与已运行时间无关。
+    图宽度变化、采样历史更换 (重新开始采集) 或长时间未刷新时按当前宽度从采样历史重建;
+    重建时采样历史容纳不下整个时间窗口且给出了数据金字塔, 较早的部分从金字塔读取。
+    """
+
+    PIXELS_PER_BUCKET = 2  # 每桶最小、最大两个点, 每像素约一个点
+
+    def __init__(self, title, fields, labels, span):
+        chart = QChart()
+        chart.setTitle(title)
+        chart.legend().setAlignment(Qt.AlignBottom)
+        super().__init__(chart)
+        self.fields = fields
+        self.span_ns = int(span * 1e9)
+        self.axis_x = QDateTimeAxis()
+        self.axis_x.setFormat('hh:mm:ss')
+        self.axis_y = QValueAxis()
+        chart.addAxis(self.axis_x, Qt.AlignBottom)
+        chart.addAxis(self.axis_y, Qt.AlignLeft)
+        self.series = []
+        self.points = [collections.deque() for _ in fields]  # 各曲线当前显示的点
+        for name in fields:
+            series = QLineSeries()
+            series.setName(labels.get(name, name))
+            chart.addSeries(series)
+            series.attachAxis(self.axis_x)
+            series.attachAxis(self.axis_y)
+            self.series.append(series)
+        self.decimator = None
+        self._samples = None
+        self._position = 0  # 已处理到的采样序号
+        self._width = 0
+        self._ranges = collections.deque()  # 已显示的桶: (时间纳秒, 最小值, 最大值), 用于纵轴范围
+
+    # 刷新
+    def refresh(self, samples, pyramid=None):
+        """把采样历史中新增的数据追加到曲线; pyramid 为正在汇总的数据金字塔对应的记录文件"""
+        written = samples.written
+        if not written:
+            return
+        width = max(100, self.viewport().width())
+        end = int(samples.window(1)['time'][0])
+        rows = samples.range(self._position, written) if samples.contains(self._position) else None
+        if (samples is not self._samples or width != self._width or rows is None
+                or (len(rows) and rows['time'][0] < end - self.span_ns)):
+            rows = self._reset(samples, width, end, pyramid)
+        self._position = written
+        changed = self._append(*self.decimator.feed(rows))
+
+        cutoff = end - self.span_ns
+        cutoff_ms = cutoff / 1e6
+        for series, points in zip(self.series, self.points):
+            while points and points[0].x() < cutoff_ms:
+                points.popleft()
+                changed = True
+            if changed:
+                series.replace(list(points))
+        while self._ranges and self._ranges[0][0] < cutoff:
+            self._ranges.popleft()
+        self.axis_x.setRange(QDateTime.fromMSecsSinceEpoch(cutoff // 1_000_000),
+                             QDateTime.fromMSecsSinceEpoch(end // 1_000_000))
+        if self._ranges:
+            # 纵轴范围只在数据超出或明显小于当前范围时调整 (每次调整都要重算全部曲线)
+            low = min(item[1] for item in self._ranges)
+            high = max(item[2] for item in self._ranges)
+            current_low, current_high = self.axis_y.min(), self.axis_y.max()
+            span = current_high - current_low
+            if low < current_low or high > current_high or (high - low) < span * 0.7:
+                margin = (high - low) * 0.1 or abs(high) * 0.1 or 1
+                self.axis_y.setRange(low - margin, high + margin)
+
+    # 重建
+    def _reset(self, samples, width, end, pyramid=None):
+        """按当前像素宽度重新抽取, 返回时间窗口内尚未显示的行"""
+        for series, points in zip(self.series, self.points):
+            series.clear()
+            points.clear()
+        self._ranges.clear()
+        self._samples = samples
+        self._width = width
+        self.decimator = MinMaxDecimator(self.fields, self.span_ns * self.PIXELS_PER_BUCKET / width)
+        cutoff = end - self.span_ns
+        rows = samples.since(cutoff)
+        oldest = int(rows['time'][0]) if len(rows) else end
+        if pyramid is not None and oldest - cutoff > self.decimator.bucket_ns:
+            result = PyramidReader(pyramid).query(cutoff, oldest - 1, self.fields,
+                                                  bucket_ns=self.decimator.bucket_ns)
+            if result is not None:
+                self._append(result['time'], result['min'], result['max'])
+                rows = rows[bisect.bisect_left(rows['time'], result['end']):]
+        return rows
+
+    # 追加抽取结果
+    def _append(self, times, lows, highs):
+        """把已结束的桶追加到点队列, 有新点时返回True"""
+        if not len(times):
+            return False
+        times_ms = (times / 1e6).tolist()
+        for i, points in enumerate(self.points):
+            for time_ms, low, high in zip(times_ms, lows[:, i].tolist(), highs[:, i].tolist()):
+                if low == low:
+                    points.append(QPointF(time_ms, low))
+                    points.append(QPointF(time_ms, high))
+        row_lows = np.fmin.reduce(lows, axis=1)
+        row_highs = np.fmax.reduce(highs, axis=1)
+        for item in zip(times.tolist(), row_lows.tolist(), row_highs.tolist()):
+            if item[1] == item[1]:
+                self._ranges.append(item)
+        return True
+
+
+# 采样历史环形缓冲区
+class SampleBuffer:
+    """采样历史环形缓冲区
+
+    预分配的 NumPy 结构化数组, 每个字段一列 (float64, 缺失为NaN), 另有记录时间和各设备
+    最近一次读取成功的时间 (int64 纳秒, 未读到为0) 以及数据状态位。
+    每行同时写入 i 和 i+capacity 两个位置 (镜像), 任意最近 n 行在数组中都是连续的,
+    window() 直接返回视图而不复制。缓冲区预先分配, 写入时不扩容, 每行耗时与已写入的行数无关。
+    采集线程用 push() 把记录放入待写队列 (保存一个元组, 引用记录字典, 不做类型转换), 界面线程每次刷新时
+    flush() 整批转换写入并读取 (每批分配一次临时数组); append() 直接写入一行, 用于单线程场景 (导出、性能测试)。
+    待写队列最多保存 capacity 条: 界面线程长时间未 flush 时丢弃最早的记录 (反正会被环形缓冲区覆盖),
+    丢弃的条数累计在 dropped 中, 序号照常递增。
+    groups 为轮询组名称时另有 read 列 (uint64), 按位标记该行所在采集周期实际读取的组 (位序号见 group_bits),
+    统计时据此跳过沿用上次读取值的行。
+    读取方持有视图期间若又写入超过 capacity 行, 视图内容会被覆盖。
+    """
+    DEVICES = ('inverter', 'torque_meter', 'daq')
+    # 数据状态位, 与 gap 文本一一对应
+    GAPS = ('网关断开', '采集卡断开', '变频器离线', '转矩仪离线', '采集卡离线')
+
+    def __init__(self, fields, capacity, integer_fields=(), groups=()):
+        self.fields = tuple(fields)
+        self.integer_fields = frozenset(integer_fields)  # 取回记录时转为int的字段 (保持原显示和CSV格式)
+        self.capacity = capacity
+        self.groups = tuple(groups)
+        if len(self.groups) > 64:
+            raise ValueError(f'轮询组过多: {len(self.groups)} (最多64个)')
+        self.group_bits = {group: 1 << bit for bit, group in enumerate(self.groups)}
+        dtype = [('time', 'i8')] + [(f'time_{device}', 'i8') for device in self.DEVICES] + \
+                [('gap', 'u1')] + [(name, 'f8') for name in self.fields] + ([('read', 'u8')] if self.groups else [])
+        self._data = np.zeros(capacity * 2, dtype=dtype)
+        self._bytes = self._data.view(np.uint8).reshape(capacity * 2, -1)  # 按字节整行复制 (结构化赋值逐字段复制, 较慢)
+        getter = operator.itemgetter(*self.fields)
+        self._values = getter if len(self.fields) > 1 else lambda data: (getter(data),)
+        self.dtype = self._data.dtype
+        self.written = 0  # 已写入的总行数, 写完一行后才递增
+        self.dropped = 0  # 待写队列已满时丢弃的记录数
+        self._pushed = 0  # 已放入待写队列的记录数 (仅采集线程修改)
+        self._pending = collections.deque(maxlen=capacity)  # push() 放入、flush() 取出的待写记录
+
+    # 放入一条记录 (采集线程)
+    def push(self, data, timestamp, device_times, read=0):
+        """放入一条记录, 下次 flush() 时写入; data 放入后不应再修改, read 为本周期读取的轮询组标志位"""
+        self._pending.append((self._pushed, data, timestamp, device_times.get('inverter', 0),
+                              device_times.get('torque_meter', 0), device_times.get('daq', 0), read))
+        self._pushed += 1
+
+    # 写入待写记录 (读取方线程)
+    def flush(self):
+        """把 push() 放入的记录整批写入, 返回写入的行数"""
+        pending = self._pending
+        items = [pending.popleft() for _ in range(len(pending))]
+        if not items:
+            return 0
+        last = items[-1][0]
+        if items[0][0] != last - len(items) + 1:
+            # 队列已满时 push() 可能在取出过程中丢弃最早的记录, 只保留序号连续的最后一段
+            i = len(items) - 1
+            while i and items[i - 1][0] == items[i][0] - 1:
+                i -= 1
+            items = items[i:]
+        n = len(items)
+        count = last + 1 - self.written  # 含队列已满时丢弃的记录
+        self.dropped += count - n
+        rows = np.empty(n, self.dtype)
+        # 按字节偏移把设备时间和各字段看作连续的二维数组, 整块赋值而不逐字段复制
+        stride = self.dtype.itemsize
+        times = len(self.DEVICES) + 1
+        np.ndarray((n, times), 'i8', rows, 0, (stride, 8))[:] = np.fromiter(
+            itertools.chain.from_iterable(item[2:6] for item in items), 'i8', n * times).reshape(n, times)
+        rows['gap'] = [self._gap_flags(item[1].get('gap')) for item in items]
+        if self.groups:
+            rows['read'] = [item[6] for item in items]
+        values = [self._values(item[1]) for item in items]
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                self.__dict__.update(data)
-        except FileNotFoundError:
-            print(f"配置文件 {filename} 不存在，创建默认配置")
-            self.save_to_file(filename)  # 保存当前配置
-        except json.JSONDecodeError:
-            print(f"配置文件 {filename} 格式错误，创建默认配置")
-            self.save_to_file(filename)  # 保存当前配置
+            values = np.fromiter(itertools.chain.from_iterable(values), 'f8', n * len(self.fields))
+        except TypeError:
+            values = np.array(values, dtype='f8')  # 含None (读取失败), 转为NaN
+        np.ndarray((n, len(self.fields)), 'f8', rows, self.dtype.fields[self.fields[0]][1],
+                   (stride, 8))[:] = values.reshape(n, len(self.fields))
+        # 按环形位置分为不跨越末尾的两段, 每段写入主位置和镜像位置
+        data = rows.view(np.uint8).reshape(n, -1)
+        start = (self.written + count - n) % self.capacity
+        for begin, end in ((0, min(n, self.capacity - start)), (self.capacity - start, n)):
+            if begin < end:
+                position = (start + begin) % self.capacity
+                self._bytes[position:position + end - begin] = data[begin:end]
+                self._bytes[position + self.capacity:position + self.capacity + end - begin] = data[begin:end]
+        self.written += count
+        return count
 
+    # 数据状态位
+    def _gap_flags(self, gap):
+        flags = 0
+        if gap:
+            for bit, text in enumerate(self.GAPS):
+                if text in gap:
+                    flags |= 1 << bit
+        return flags
+
+    # 写入一条记录
+    def append(self, data, timestamp, device_times, read=0):
+        """写入一条记录, 返回其序号
+
+        data 须包含全部字段, None 字段记为NaN; device_times 为 {设备: 纳秒时间}; read 为读取的轮询组标志位。
+        """
+        row = (timestamp, device_times.get('inverter', 0), device_times.get('torque_meter', 0),
+               device_times.get('daq', 0), self._gap_flags(data.get('gap'))) + self._values(data)
+        if self.groups:
+            row += (read,)
+        seq = self.written
+        index = seq % self.capacity
+        self._data[index] = row
+        self._data[index + self.capacity] = row
+        self.written = seq + 1
+        return seq
+
+    # 按序号取连续多行
+    def range(self, start, end):
+        """序号 [start, end) 的记录 (按时间先后, 零拷贝视图), 调用方保证这些记录仍在缓冲区中"""
+        if end <= start:
+            return self._data[:0]
+        stop = (end - 1) % self.capacity + 1 + self.capacity
+        return self._data[stop - (end - start):stop]
+
+    # 最近n行
+    def window(self, n=None):
+        """最近n行 (按时间先后, 零拷贝视图), 默认全部已保存的行"""
+        written = self.written
+        available = min(written, self.capacity)
+        n = available if n is None else min(n, available)
+        return self.range(written - n, written)
+
+    # 某时刻之后的行
+    def since(self, time_ns):
+        """时间不早于 time_ns 的最近若干行 (按时间先后, 零拷贝视图)"""
+        window = self.window()
+        # 逐个元素二分查找, 避免 searchsorted 复制整列
+        return window[bisect.bisect_left(window['time'], time_ns):]
+
+    # 某列最近n个值
+    def column(self, name, n=None):
+        """某列最近n个值 (零拷贝视图)"""
+        return self.window(n)[name]
+
+    # 是否仍保存某序号的记录
+    def contains(self, seq):
+        """是否仍保存某序号的记录"""
+        return self.written - self.capacity <= seq < self.written
+
+    # 取回一条记录
+    def record(self, seq):
+        """按序号取回记录字典, NaN 字段为None, 数据状态还原为文本"""
+        return self.to_dict(self._data[seq % self.capacity])
+
+    # 行转换为记录字典
+    def to_dict(self, row):
+        """把一行 (window/range 的元素或其副本) 转换为记录字典"""
+        values = row.item()
+        data = {'time': values[0]}
+        for i, device in enumerate(self.DEVICES, 1):
+            data[f'time_{device}'] = values[i]
+        flags = values[len(self.DEVICES) + 1]
+        for name, value in zip(self.fields, values[len(self.DEVICES) + 2:]):
+            if value != value:
+                data[name] = None
+            elif name in self.integer_fields:
+                data[name] = int(value)
+            else:
+                data[name] = value
+        data['gap'] = ';'.join(text for bit, text in enumerate(self.GAPS) if flags >> bit & 1)
+        return data
+
+    # 最新一条记录
+    def latest(self):
+        """最新一条记录字典, 尚无数据时返回None"""
+        return self.record(self.written - 1) if self.written else None
+
+
+# 数据记录后台写入线程
+class RecordWriter(threading.Thread, abc.ABC):
+    """数据记录后台写入线程 (组提交)
+
+    界面线程把一批记录 (采样历史的行副本) 放入队列后立即返回, 写入线程负责格式化和写入;
+    每隔 flush_interval 秒或累计 flush_rows 行提交一次 (flush 到操作系统),
+    fsync 开启时提交后再 os.fsync 落盘 (断电也不丢已提交的数据, 吞吐较低);
+    fsync_interval 大于0时最多每隔这么多秒 fsync 一次, 用于限制预写日志的落盘频率。
+    pending 为已入队未提交的行数, commit_latency 为记录入队到提交完成的耗时,
+    两者持续增长说明磁盘写入跟不上采集。
+    pyramid 为 PyramidWriter 时同时汇总数据金字塔, 随组提交一起 flush。
+    journal 为 JournalWriter 时每隔 checkpoint_interval 秒把记录文件 fsync 一次 (检查点),
+    再通知日志丢弃已落盘的行。
+    子类实现 _write_rows (写入一批) 和 _before_commit (提交前写出缓存的数据)。
+    """
+    fsync_interval = 0.0
+
+    def __init__(self, file, samples, flush_interval, flush_rows, fsync, log):
+        super().__init__(name=type(self).__name__, daemon=True)
+        self.file = file
+        self.samples = samples
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.fsync = fsync
+        self.log = log
+        self.queue = queue.Queue()
+        self.error = None
+        self.queued = 0  # 已入队行数 (仅入队线程修改)
+        self.committed = 0  # 已提交行数 (仅写入线程修改)
+        self.commits = 0
+        self.syncs = 0
+        self._synced = 0.0  # 上次 fsync 的时间
+        self.max_pending = 0
+        self.pyramid = None
+        self.journal = None
+        self.checkpoint_interval = 60.0
+        self._checkpointed = time.perf_counter()  # 上次检查点的时间
+        self.commit_latency = Histogram('提交延迟')
+        self.flush_time = Histogram('刷盘耗时')
+
+    @property
+    def pending(self):
+        """已入队未提交的行数"""
+        return self.queued - self.committed
+
+    # 提交一批记录
+    def write(self, rows):
+        """提交一批记录 (NumPy 结构化数组), 立即返回; 写入线程出错后返回False"""
+        if self.error:
+            return False
+        if len(rows):
+            self.queue.put((rows, time.perf_counter()))
+            self.queued += len(rows)
+            self.max_pending = max(self.max_pending, self.pending)
+        return True
+
+    # 停止写入线程
+    def close(self, sync=False):
+        """写完队列中的记录后提交并关闭文件; sync 为真时关闭前 fsync 落盘"""
+        self.queue.put(None)
+        self.join()
+        try:
+            if sync and not self.error:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+        finally:
+            self.file.close()
+            if self.pyramid is not None:
+                self.pyramid.close()
+
+    def run(self):
+        uncommitted = 0
+        oldest = None  # 未提交记录中最早的入队时间
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.perf_counter())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+            try:
+                if item:
+                    rows, queued_at = item
+                    self._write_rows(rows)
+                    if self.pyramid is not None:
+                        self.pyramid.feed_rows(rows)
+                    uncommitted += len(rows)
+                    if oldest is None:
+                        oldest = queued_at
+                        deadline = time.perf_counter() + self.flush_interval
+                if uncommitted and (item is None or uncommitted >= self.flush_rows
+                                    or time.perf_counter() >= deadline):
+                    self._commit(uncommitted, oldest)
+                    uncommitted = 0
+                    oldest = deadline = None
+            except Exception as e:
+                self.error = e
+                self.log('error', f'写入数据记录失败: {str(e)}')
+                return
+            if item is None:
+                return
+
+    # 写入一批记录
+    @abc.abstractmethod
+    def _write_rows(self, rows):
+        """写入 (或缓存) 一批记录"""
+
+    # 提交前写出缓存的数据
+    def _before_commit(self):
+        pass
+
+    # 组提交
+    def _commit(self, rows, oldest):
+        """flush (及可选的 fsync) 一次, 记录刷盘耗时和提交延迟"""
+        start = time.perf_counter()
+        self._before_commit()
+        if self.pyramid is not None:
+            self.pyramid.flush()
+        self.file.flush()
+        if self.fsync and start - self._synced >= self.fsync_interval:
+            os.fsync(self.file.fileno())
+            self._synced = start
+            self.syncs += 1
+        if self.journal is not None and start - self._checkpointed >= self.checkpoint_interval:
+            if self._synced != start:
+                os.fsync(self.file.fileno())
+                self.syncs += 1
+            self._checkpointed = start
+            self.journal.checkpoint(self.committed + rows)
+        now = time.perf_counter()
+        self.flush_time.record(now - start)
+        self.commit_latency.record(now - oldest)
+        self.committed += rows
+        self.commits += 1
+
+    def __str__(self):
+        return (f'写入 {self.committed} 行, 提交 {self.commits} 次, fsync {self.syncs} 次, '
+                f'队列最多积压 {self.max_pending} 行; '
+                f'{self.commit_latency}; {self.flush_time}')
+
+
+# CSV后台写入线程
+class CsvWriter(RecordWriter):
+    """CSV后台写入线程: 每条记录按 format_row 格式化为一行文本"""
+
+    def __init__(self, file, samples, format_row, flush_interval, flush_rows, fsync, log):
+        super().__init__(file, samples, flush_interval, flush_rows, fsync, log)
+        self.format_row = format_row  # 记录字典 -> CSV行
+        self._writer = csv.writer(file)
+
+    def _write_rows(self, rows):
+        to_dict = self.samples.to_dict
+        self._writer.writerows([self.format_row(to_dict(row)) for row in rows])
+
+
+# 二进制记录后台写入线程
+class BinaryWriter(RecordWriter):
+    """二进制记录后台写入线程
+
+    文件格式 (小端, 只追加):
+        文件头  b'MREC' | 版本 u16 | 头长度 u32 | 头 (UTF-8 JSON: 列名和类型、字段、配置)
+        数据块  b'CK' | 压缩 u8 | 行数 u32 | 数据长度 u32 | 首行时间 i64 | 末行时间 i64 | 数据
+    每次组提交写出一个数据块; 块内按列存放 (与采样历史相同的定宽列: 时间为 int64 纳秒,
+    测量值为 float64, 缺失为NaN), 再按 compress 级别 zlib 压缩 (0 不压缩)。
+    进程中断时最多丢失最后一个未写完的数据块, 读取时忽略。
+    append 为真时不写文件头 (续写已有的记录文件)。
+    """
+    MAGIC = b'MREC'
+    VERSION = 1
+    FILE_HEADER = struct.Struct('<4sHI')
+    CHUNK_HEADER = struct.Struct('<2sBIIqq')
+    CHUNK_MAGIC = b'CK'
+
+    def __init__(self, file, samples, header, compress, flush_interval, flush_rows, fsync, log, append=False):
+        super().__init__(file, samples, flush_interval, flush_rows, fsync, log)
+        self.compress = compress
+        self._rows = []
+        self.bytes_written = 0
+        if append:
+            return
+        header = dict(header, columns=[[name, samples.dtype[name].str] for name in samples.dtype.names],
+                      fields=list(samples.fields), integer_fields=sorted(samples.integer_fields),
+                      devices=list(samples.DEVICES), gaps=list(samples.GAPS), groups=list(samples.groups))
+        payload = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        file.write(self.FILE_HEADER.pack(self.MAGIC, self.VERSION, len(payload)) + payload)
+
+    def _write_rows(self, rows):
+        self._rows.append(rows)
+
+    def _before_commit(self):
+        rows = np.concatenate(self._rows) if len(self._rows) > 1 else self._rows[0]
+        self._rows = []
+        data = b''.join(rows[name].tobytes() for name in rows.dtype.names)  # 按列存放
+        if self.compress:
+            data = zlib.compress(data, self.compress)
+        self.file.write(self.CHUNK_HEADER.pack(self.CHUNK_MAGIC, 1 if self.compress else 0, len(rows), len(data),
+                                               rows['time'][0], rows['time'][-1]) + data)
+        self.bytes_written += self.CHUNK_HEADER.size + len(data)
+
+
+# 预写日志后台写入线程
+class JournalWriter(RecordWriter):
+    """预写日志 (write-ahead journal) 后台写入线程
+
+    与数据记录同时写入 <记录文件>.wal, 按 fsync_interval 秒的节奏 fsync, 记录文件本身只 flush 不 fsync;
+    正常停止记录时记录文件 fsync 后删除日志, 断电或崩溃后下次启动由 recover_journal 按日志恢复记录文件。
+    文件格式 (小端, 变长块, 只追加):
+        文件头  b'MWAL' | 版本 u16 | 保留 u16 | 头长度 u32 | 头 (UTF-8 JSON, base_rows 为日志首行在记录中的行号)
+        数据块  b'JB' | 行数 u16 | CRC32 u32 | 序号 u64 | 各行原始字节 (与采样历史相同的定宽行)
+    CRC32 覆盖行数、序号和数据; 序号从0连续递增, 恢复时截断到最后一个校验通过且序号连续的块。
+    每次组提交写出一个只含本次各行的块 (超过 0xFFFF 行时分成多块), 不补零, 已写出的块不再修改。
+    检查点: 记录写入线程把记录文件 fsync 后调用 checkpoint(行数), 日志在下次提交时改写为
+    只含之后各行的新日志 (先写临时文件, 落盘后替换), 日志长度不随记录时长增长。
+    retain 为假时不保留日志中的行, 也不做检查点。
+    版本1 (定长4096字节块, 补零) 的日志仍可读取和恢复。
+    """
+    MAGIC = b'MWAL'
+    VERSION = 2
+    BLOCK_SIZE = 4096  # 版本1的块长度
+    MAX_BLOCK_ROWS = 0xFFFF
+    FILE_HEADER = struct.Struct('<4sHHI')
+    BLOCK_HEADER = struct.Struct('<2sHIQ')
+    BLOCK_MAGIC = b'JB'
+
+    def __init__(self, file, samples, header, fsync_interval, flush_interval, flush_rows, log, retain=True):
+        super().__init__(file, samples, flush_interval, flush_rows, 1, log)
+        self.fsync_interval = fsync_interval
+        self.retain = retain
+        self.path = file.name
+        self._rows = []
+        self._retained = collections.deque()  # 日志中的各批行 (检查点时改写日志用)
+        self.sequence = 0
+        self.base_rows = 0  # 日志首行在记录中的行号
+        self.total_rows = 0  # 已写入日志的总行数 (含检查点前丢弃的)
+        self.checkpoints = 0
+        self._checkpoint = 0  # 记录文件已落盘的行数 (记录写入线程设置)
+        self.header = dict(header, columns=[[name, samples.dtype[name].str] for name in samples.dtype.names],
+                           fields=list(samples.fields), integer_fields=sorted(samples.integer_fields),
+                           groups=list(samples.groups))
+        file.write(self._file_header())
+        file.flush()
+        os.fsync(file.fileno())  # 文件头立即落盘, 保证日志可识别
+
+    # 文件头
+    def _file_header(self):
+        payload = json.dumps(dict(self.header, base_rows=self.base_rows), ensure_ascii=False).encode('utf-8')
+        return self.FILE_HEADER.pack(self.MAGIC, self.VERSION, 0, len(payload)) + payload
+
+    # 块校验值
+    @classmethod
+    def block_crc(cls, count, sequence, payload):
+        return zlib.crc32(payload, zlib.crc32(struct.pack('<HQ', count, sequence)))
+
+    # 编码数据块
+    def _blocks(self, rows):
+        """各行编码为数据块 (每块最多 MAX_BLOCK_ROWS 行)"""
+        blocks = []
+        for start in range(0, len(rows), self.MAX_BLOCK_ROWS):
+            chunk = rows[start:start + self.MAX_BLOCK_ROWS]
+            payload = chunk.tobytes()
+            crc = self.block_crc(len(chunk), self.sequence, payload)
+            blocks.append(self.BLOCK_HEADER.pack(self.BLOCK_MAGIC, len(chunk), crc, self.sequence) + payload)
+            self.sequence += 1
+        return b''.join(blocks)
+
+    # 检查点
+    def checkpoint(self, rows):
+        """记录文件前 rows 行已 fsync 落盘 (由记录写入线程调用), 日志在之后的提交中丢弃这些行"""
+        self._checkpoint = rows
+
+    def _write_rows(self, rows):
+        self._rows.append(rows)
+
+    def _before_commit(self):
+        rows = np.concatenate(self._rows) if len(self._rows) > 1 else self._rows[0]
+        self._rows = []
+        self.total_rows += len(rows)
+        if self.retain:
+            self._retained.append(rows)
+        checkpoint = self._checkpoint
+        if self.retain and self.base_rows < checkpoint <= self.total_rows:
+            self._rotate(checkpoint)
+        else:
+            self.file.write(self._blocks(rows))
+
+    # 按检查点改写日志
+    def _rotate(self, checkpoint):
+        """丢弃记录文件中已落盘的行: 剩余各行写入新日志, 落盘后替换旧日志"""
+        start = self.total_rows - sum(len(rows) for rows in self._retained)
+        while self._retained and start + len(self._retained[0]) <= checkpoint:
+            start += len(self._retained.popleft())
+        if self._retained:
+            self._retained[0] = self._retained[0][checkpoint - start:]
+        self.base_rows = checkpoint
+        self.sequence = 0
+        path = self.path
+        file = open(path + '.tmp', 'wb')
+        try:
+            file.write(self._file_header())
+            for rows in self._retained:
+                file.write(self._blocks(rows))
+            file.flush()
+            os.fsync(file.fileno())
+            os.replace(path + '.tmp', path)
+        except BaseException:
+            file.close()
+            raise
+        self.file.close()
+        self.file = file
+        self._synced = time.perf_counter()
+        self.checkpoints += 1
+
+    def __str__(self):
+        return f'{super().__str__()}; 检查点 {self.checkpoints} 次'
+
+
+# 记录文件稀疏时间索引
+class TimeIndex:
+    """记录文件的稀疏时间索引 (旁路文件 <记录文件>.idx)
+
+    约每 INTERVAL 条记录保存一个 (首条记录时间纳秒, 文件偏移); 查询时二分查找起点, 之后顺序读取。
+    scanned 为下次补建索引的起始偏移, 记录文件继续增长时从这里增量补建, 不必重新扫描。
+    """
+    INTERVAL = 4096
+    MAGIC = b'MIDX'
+    VERSION = 1
+    HEADER = struct.Struct('<4sHqqq')  # 魔数, 版本, 补建起点, 起点前未索引的记录数, 条目数
+
+    def __init__(self, path):
+        self.path = path + '.idx'
+        self.times = []
+        self.offsets = []
+        self.scanned = 0
+        self.pending_rows = 0  # 最后一个条目之后已扫描的记录数
+        self._load()
+
+    # 读取旁路文件
+    def _load(self):
+        """读取旁路文件, 不存在或损坏时从头建立"""
+        try:
+            with open(self.path, 'rb') as f:
+                magic, version, scanned, pending_rows, count = self.HEADER.unpack(f.read(self.HEADER.size))
+                entries = np.frombuffer(f.read(count * 16), dtype='<i8')
+        except (OSError, struct.error):
+            return
+        if magic != self.MAGIC or version != self.VERSION or len(entries) != count * 2:
+            return
+        self.times = entries[0::2].tolist()
+        self.offsets = entries[1::2].tolist()
+        self.scanned = scanned
+        self.pending_rows = pending_rows
+
+    # 保存旁路文件
+    def save(self):
+        """保存旁路文件 (先写临时文件再替换); 记录文件所在目录不可写时忽略"""
+        entries = np.empty(len(self.times) * 2, dtype='<i8')
+        entries[0::2] = self.times
+        entries[1::2] = self.offsets
+        try:
+            with open(self.path + '.tmp', 'wb') as f:
+                f.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.scanned, self.pending_rows, len(self.times)))
+                f.write(entries.tobytes())
+            os.replace(self.path + '.tmp', self.path)
+        except OSError:
+            pass
+
+    # 添加条目
+    def add(self, time_ns, offset):
+        self.times.append(time_ns)
+        self.offsets.append(offset)
+
+    # 查找起点
+    def find(self, start_ns):
+        """返回不晚于 start_ns 的最后一个条目的文件偏移, 无索引时返回None"""
+        i = bisect.bisect_right(self.times, start_ns) - 1
+        return self.offsets[max(i, 0)] if self.offsets else None
+
+
+# 记录文件读取
+class LogReader(abc.ABC):
+    """记录文件读取: 内存映射 + 稀疏时间索引
+
+    LogReader.open(path) 按文件内容返回 RecordingReader (二进制) 或 CsvLogReader (CSV)。
+    query(start, end, columns) 先在索引中二分查找起点, 只读取时间范围内的记录,
+    耗时为 O(log n) 加上结果大小, 与文件总长度无关。时间均为纳秒。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self.mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def open(path):
+        """按文件内容打开二进制记录或CSV记录"""
+        with open(path, 'rb') as f:
+            magic = f.read(len(BinaryWriter.MAGIC))
+        return RecordingReader(path) if magic == BinaryWriter.MAGIC else CsvLogReader(path)
+
+    # 关闭文件
+    def close(self):
+        self.mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # 时间索引
+    def time_index(self):
+        """加载时间索引, 记录文件有新增内容时增量补建并保存"""
+        index = TimeIndex(self.path)
+        if index.scanned < len(self.mm):
+            self._extend_index(index)
+            index.save()
+        return index
+
+    # 增量补建索引
+    @abc.abstractmethod
+    def _extend_index(self, index):
+        """从 index.scanned 起扫描记录文件, 补充索引条目"""
+
+    # 列名转换为字段名
+    def _fields(self, columns):
+        """列名可用字段名 (如 ch3, torque_meter_torque) 或CSV表头中的名称"""
+        fields = []
+        for name in columns:
+            field = self.names.get(name, name)
+            if field not in self.QUERY_FIELDS:
+                raise ValueError(f'未知的列: {name}')
+            fields.append(field)
+        return fields
+
+    # 按时间范围查询
+    @abc.abstractmethod
+    def query(self, start, end, columns):
+        """返回时间在 [start, end] 内的记录: {'time': int64纳秒数组, 列名: float64数组}"""
+
+
+# 二进制记录读取
+class RecordingReader(LogReader):
+    """二进制记录读取: 逐块读取, 内存占用只与单个数据块大小有关"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        if len(self.mm) < BinaryWriter.FILE_HEADER.size:
+            raise ValueError(f'{path} 不是二进制记录文件')
+        magic, version, length = BinaryWriter.FILE_HEADER.unpack_from(self.mm, 0)
+        if magic != BinaryWriter.MAGIC:
+            raise ValueError(f'{path} 不是二进制记录文件')
+        if version > BinaryWriter.VERSION:
+            raise ValueError(f'不支持的记录文件版本: {version}')
+        self.data_offset = BinaryWriter.FILE_HEADER.size + length
+        self.header = json.loads(self.mm[BinaryWriter.FILE_HEADER.size:self.data_offset].decode('utf-8'))
+        self.dtype = np.dtype([tuple(column) for column in self.header['columns']])
+        # 行解码 (NaN -> None, 整数字段, 数据状态文本) 与采样历史相同
+        self.decoder = SampleBuffer(self.header['fields'], 1, self.header['integer_fields'],
+                                    self.header.get('groups', ()))
+        self.QUERY_FIELDS = self.dtype.names[1:]  # 各设备时间戳与数据状态标志位也可查询
+        derived = self.header['config'].get('derived_channels', [])
+        self.names = dict(zip(MotorController._csv_header(self.header['config']['modbus_head'], derived),
+                              CsvLogReader.FIELDS[:-1] + tuple(item['name'] for item in derived) + ('gap',)))
+
+    # 逐块读取块头
+    def chunk_headers(self, offset=None):
+        """依次返回 (块偏移, 压缩, 行数, 数据长度, 首行时间, 末行时间); 末尾不完整的数据块被忽略"""
+        header = BinaryWriter.CHUNK_HEADER
+        position = self.data_offset if offset is None else offset
+        size = len(self.mm)
+        while position + header.size <= size:
+            magic, compressed, count, length, first, last = header.unpack_from(self.mm, position)
+            if magic != BinaryWriter.CHUNK_MAGIC or position + header.size + length > size:
+                return
+            yield position, compressed, count, length, first, last
+            position += header.size + length
+
+    # 逐块读取
+    def chunks(self, offset=None):
+        """依次返回 (块偏移, 结构化数组); 末尾不完整的数据块被忽略"""
+        start = BinaryWriter.CHUNK_HEADER.size
+        for position, compressed, count, length, _, _ in self.chunk_headers(offset):
+            data = self.mm[position + start:position + start + length]
+            yield position, self._decode(data, compressed, count)
+
+    # 解码数据块
+    def _decode(self, data, compressed, count):
+        """按列解码数据块"""
+        if compressed:
+            data = zlib.decompress(data)
+        rows = np.empty(count, dtype=self.dtype)
+        offset = 0
+        for name in self.dtype.names:
+            size = self.dtype[name].itemsize * count
+            rows[name] = np.frombuffer(data, dtype=self.dtype[name], count=count, offset=offset)
+            offset += size
+        return rows
+
+    # 逐条读取记录
+    def records(self):
+        """逐条返回记录字典"""
+        to_dict = self.decoder.to_dict
+        for _, rows in self.chunks():
+            for row in rows:
+                yield to_dict(row)
+
+    def _extend_index(self, index):
+        position = max(index.scanned, self.data_offset)
+        for position, _, count, length, first, _ in self.chunk_headers(position):
+            if not index.times or index.pending_rows >= index.INTERVAL:
+                index.add(first, position)
+                index.pending_rows = 0
+            index.pending_rows += count
+            index.scanned = position + BinaryWriter.CHUNK_HEADER.size + length
+
+    def query(self, start, end, columns):
+        fields = self._fields(columns)
+        offset = self.time_index().find(start)
+        result = {'time': [], **{name: [] for name in fields}}
+        for _, rows in self.chunks(offset):
+            times = rows['time']
+            if times[0] > end:
+                break
+            mask = (times >= start) & (times <= end)
+            if mask.any():
+                for name in result:
+                    result[name].append(rows[name][mask])
+        return {column: np.concatenate(result[name]) if result[name] else np.empty(0, self.dtype[name])
+                for column, name in zip(['time'] + columns, ['time'] + fields)}
+
+
+# CSV记录读取
+class CsvLogReader(LogReader):
+    """CSV记录读取
+
+    时间列为固定格式的本地时间文本 (不含逗号和引号, csv.writer 不会加引号), 可直接按字节比较先后,
+    查询时不逐行解析时间; 范围内的行再用 csv.reader 解析, 含逗号或引号的文本列不会错位。
+    """
+    # CSV各列对应的字段名, 与 MotorController._csv_record 的顺序一致
+    FIELDS = ('time', 'speed', 'set_speed', 'voltage', 'current', 'power', 'torque',
+              'torque_meter_torque', 'torque_meter_speed', 'torque_meter_power',
+              'ch0', 'ch1', 'ch2', 'ch3', 'ch4', 'ch5', 'ch6', 'ch7', 'gap')
+    QUERY_FIELDS = FIELDS[1:-1]  # 数据状态列为文本, 不可查询
+    TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+    def __init__(self, path):
+        super().__init__(path)
+        end = self.mm.find(b'\n')
+        self.data_offset = end + 1 if end >= 0 else len(self.mm)
+        self.header = next(csv.reader([self.mm[:self.data_offset].decode('utf-8-sig')]), [])
+        if len(self.header) > len(self.FIELDS):
+            # 物理量之后、数据状态之前为派生量列: 表头只有显示名称, 按配置中的派生量还原字段名
+            derived = self._derived_names(path)
+            self.FIELDS = self.FIELDS[:-1] + tuple(derived.get(label, label)
+                                                   for label in self.header[len(self.FIELDS) - 1:-1]) + ('gap',)
+            self.QUERY_FIELDS = self.FIELDS[1:-1]
+        # 表头名称和字段名都可用于查询 (与二进制记录相同)
+        self.names = {**{name: name for name in self.FIELDS}, **dict(zip(self.header, self.FIELDS))}
+
+    # 派生量显示名称 -> 字段名
+    @staticmethod
+    def _derived_names(path):
+        """派生量的字段名: 优先取记录时写入的数据金字塔文件头 (字段名和显示名称),
+        其次按记录文件所在目录 (或当前目录) 的 config.json 中的 derived_channels;
+        都找不到或显示名称已修改时该列只能按表头名称查询"""
+        names = {}
+        for directory in (os.path.dirname(os.path.abspath(path)), os.getcwd()):
+            try:
+                with open(os.path.join(directory, 'config.json'), encoding='utf-8') as f:
+                    channels = json.load(f).get('derived_channels', [])
+                names = {item.get('label', item['name']): item['name'] for item in channels}
+                break
+            except (OSError, ValueError, KeyError, TypeError, AttributeError):
+                continue
+        pyramid = PyramidReader(path)
+        names.update((label, name) for label, name in zip(pyramid.labels or (), pyramid.fields or ())
+                     if label != name)
+        return names
+
+    # 时间文本与纳秒互转
+    @classmethod
+    def parse_time(cls, text):
+        return round(datetime.strptime(text, cls.TIME_FORMAT).timestamp() * 1000) * 1_000_000
+
+    @classmethod
+    def format_time(cls, time_ns):
+        return datetime.fromtimestamp(time_ns / 1e9).strftime(cls.TIME_FORMAT)[:-3].encode()
+
+    def _extend_index(self, index):
+        mm = self.mm
+        size = len(mm)
+        # 按前几行的平均长度折算索引间隔对应的字节数, 跳跃式建立索引, 不必逐行扫描
+        sample_end = self.data_offset
+        for _ in range(64):
+            newline = mm.find(b'\n', sample_end)
+            if newline < 0:
+                break
+            sample_end = newline + 1
+        lines = mm[self.data_offset:sample_end].count(b'\n')
+        if not lines:
+            return
+        stride = max(1, (sample_end - self.data_offset) // lines * index.INTERVAL)
+
+        position = max(index.scanned, self.data_offset)
+        while position < size:
+            if position > self.data_offset and mm[position - 1] != ord('\n'):
+                position = mm.find(b'\n', position) + 1  # 对齐到下一行行首
+                if position == 0:
+                    return
+            newline = mm.find(b'\n', position)
+            if newline < 0:
+                return
+            index.add(self.parse_time(mm[position:mm.find(b',', position, newline)].decode()), position)
+            index.scanned = position = position + stride
+
+    def query(self, start, end, columns):
+        indexes = [self.FIELDS.index(name) for name in self._fields(columns)]
+        start_text, end_text = self.format_time(start), self.format_time(end)
+        mm = self.mm
+        position = self.time_index().find(start)
+        position = self.data_offset if position is None else position
+        times = []
+        lines = []
+        while True:
+            newline = mm.find(b'\n', position)
+            if newline < 0:
+                break
+            line = mm[position:newline].rstrip(b'\r')
+            position = newline + 1
+            stamp = line[:len(start_text)]
+            if stamp < start_text:
+                continue
+            if stamp > end_text:
+                break
+            times.append(stamp)
+            lines.append(line.decode('utf-8'))
+        values = [[float(cells[i]) if cells[i] else np.nan for i in indexes] for cells in csv.reader(lines)]
+        # 同一秒内的记录只解析一次日期时间, 毫秒部分直接相加
+        seconds = {}
+        for stamp in times:
+            if stamp[:19] not in seconds:
+                seconds[stamp[:19]] = self.parse_time(stamp[:19].decode() + '.000')
+        result = {'time': np.array([seconds[stamp[:19]] + int(stamp[20:23]) * 1_000_000 for stamp in times],
+                                   dtype='i8')}
+        table = np.array(values, dtype='f8').reshape(len(values), len(indexes))
+        for i, name in enumerate(columns):
+            result[name] = table[:, i]
+        return result
+
+
+# 数据金字塔写入
+class PyramidWriter:
+    """数据金字塔: 记录文件旁的多级汇总 (旁路文件 <记录文件>.1s.pyr、.10s.pyr、.60s.pyr)
+
+    每级按固定时间宽度 (1秒、10秒、1分钟) 分桶, 每桶保存各字段的有效样本数、最小值、最大值和平均值
+    (float64, 与记录文件精度相同, 电能累计等大数值不丢失精度);
+    记录过程中由记录写入线程增量汇总, 桶结束后追加到对应文件, 随组提交一起 flush。
+    没有样本的桶也写入 (样本数为0), 第 i 条汇总对应 首桶时间 + i × 宽度, 查询时按偏移直接定位。
+    文件头: 魔数, 版本, 宽度秒数, 首桶时间纳秒, JSON长度, JSON (字段名和显示名称)。
+    版本1 (float32) 的汇总不再读取, 查询时按记录文件重建。
+    """
+    LEVELS = (1, 10, 60)  # 各级宽度(秒)
+    MAGIC = b'MPYR'
+    VERSION = 2
+    HEADER = struct.Struct('<4sHIqI')
+
+    def __init__(self, path, fields, labels=None):
+        self.path = path
+        self.fields = list(fields)
+        self.labels = [(labels or {}).get(name, name) for name in self.fields]
+        self.dtype = self.record_dtype(len(self.fields))
+        self.decimators = {level: MinMaxDecimator(self.fields, level * 1_000_000_000) for level in self.LEVELS}
+        self.files = {}
+        self.next = {}  # 各级下一条汇总的桶起始时间
+
+    @staticmethod
+    def level_path(path, level):
+        return f'{path}.{level}s.pyr'
+
+    @staticmethod
+    def record_dtype(count):
+        return np.dtype([('count', '<u4', (count,)), ('min', '<f8', (count,)),
+                         ('max', '<f8', (count,)), ('mean', '<f8', (count,))])
+
+    # 加入采样历史的行
+    def feed_rows(self, rows):
+        self.feed(rows['time'], np.column_stack([rows[name] for name in self.fields]))
+
+    # 加入新数据
+    def feed(self, times, values):
+        """加入新数据 (时间数组和 (行数, 字段数) 的数值), 各级已结束的桶写入文件"""
+        for level, decimator in self.decimators.items():
+            self._write(level, *decimator.feed_values(times, values))
+
+    def flush(self):
+        for file in self.files.values():
+            file.flush()
+
+    # 结束
+    def close(self):
+        """写出各级最后一个桶并关闭文件"""
+        try:
+            for level, decimator in self.decimators.items():
+                self._write(level, *decimator.finish())
+        finally:
+            for file in self.files.values():
+                file.close()
+
+    # 写入已结束的桶
+    def _write(self, level, starts, lows, highs, means, counts):
+        if not len(starts):
+            return
+        step = level * 1_000_000_000
+        file = self.files.get(level)
+        if file is None:
+            payload = json.dumps({'fields': self.fields, 'labels': self.labels}, ensure_ascii=False).encode('utf-8')
+            file = self.files[level] = open(self.level_path(self.path, level), 'wb')
+            file.write(self.HEADER.pack(self.MAGIC, self.VERSION, level, int(starts[0]), len(payload)) + payload)
+            self.next[level] = int(starts[0])
+        positions = (starts - self.next[level]) // step
+        keep = positions >= 0  # 系统时间回拨时丢弃已写出位置之前的桶
+        if not keep.all():
+            positions, lows, highs, means, counts = (a[keep] for a in (positions, lows, highs, means, counts))
+            if not len(positions):
+                return
+        records = np.zeros(int(positions[-1]) + 1, self.dtype)
+        for name in ('min', 'max', 'mean'):
+            records[name] = np.nan
+        records['count'][positions] = counts
+        records['min'][positions] = lows
+        records['max'][positions] = highs
+        records['mean'][positions] = means
+        file.write(records.tobytes())
+        self.next[level] += len(records) * step
+
+
+# 数据金字塔查询
+class PyramidReader:
+    """数据金字塔查询
+
+    query(start, end, columns, buckets) 按每桶时间宽度 ((end - start) / buckets, 通常每像素或每两个像素一桶)
+    选择不超过桶宽度的最粗一级, 只读取时间范围内的汇总再合并为所需的桶:
+    查看72小时的记录、1000个桶时只读取约4320条1分钟汇总, 与原始记录的行数无关。
+    envelope() 在时间范围太短、金字塔最细一级也太粗时改为读取原始记录, 按同样方式分桶。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fields = self.labels = self.dtype = None
+        self.levels = {}  # 宽度秒数 -> (首桶时间, 数据偏移, 汇总条数)
+        for level in PyramidWriter.LEVELS:
+            try:
+                with open(PyramidWriter.level_path(path, level), 'rb') as f:
+                    magic, version, seconds, first, length = PyramidWriter.HEADER.unpack(
+                        f.read(PyramidWriter.HEADER.size))
+                    header = json.loads(f.read(length).decode('utf-8'))
+                    size = os.fstat(f.fileno()).st_size
+            except (OSError, struct.error, ValueError):
+                continue
+            if magic != PyramidWriter.MAGIC or version != PyramidWriter.VERSION or seconds != level:
+                continue
+            if self.fields is None:
+                self.fields, self.labels = header['fields'], header['labels']
+                self.dtype = PyramidWriter.record_dtype(len(self.fields))
+            elif header['fields'] != self.fields:
+                continue
+            offset = PyramidWriter.HEADER.size + length
+            self.levels[level] = (first, offset, (size - offset) // self.dtype.itemsize)
+
+    @classmethod
+    def open(cls, path):
+        """打开记录文件的数据金字塔, 没有时先补建"""
+        pyramid = cls(path)
+        if not pyramid.levels:
+            build_pyramid(path)
+            pyramid = cls(path)
+        return pyramid
+
+    @property
+    def end(self):
+        """最细一级汇总覆盖到的时间 (不含), 没有汇总时为None"""
+        if not self.levels:
+            return None
+        level = min(self.levels)
+        first, _, count = self.levels[level]
+        return first + count * level * 1_000_000_000
+
+    # 选择级别
+    def level_for(self, bucket_ns):
+        """每桶时间宽度为 bucket_ns 时使用的一级: 不超过桶宽度的最粗一级, 都更粗时返回None"""
+        usable = [level for level in self.levels if level * 1_000_000_000 <= bucket_ns]
+        return max(usable) if usable else None
+
+    # 列名转换为序号
+    def _indexes(self, columns):
+        """列名可用字段名或显示名称 (CSV表头中的名称)"""
+        names = dict(zip(self.labels or (), itertools.count()))
+        names.update(zip(self.fields or (), itertools.count()))
+        try:
+            return [names[name] for name in columns]
+        except KeyError as e:
+            raise ValueError(f'未知的列: {e.args[0]}') from None
+
+    # 按时间范围查询汇总
+    def query(self, start, end, columns, buckets=1000, bucket_ns=None):
+        """返回 [start, end] 内合并为约 buckets 个桶 (或直接指定每桶宽度 bucket_ns) 的汇总:
+        {'level': 使用的级别秒数, 'time': 桶起始时间, 'end': 汇总覆盖到的时间 (不含),
+         'min'/'max'/'mean'/'count': (桶数, 列数) 数组}; 金字塔最细一级也比桶宽度粗时返回None
+        """
+        bucket_ns = bucket_ns or max(1, (end - start) // max(1, buckets))
+        level = self.level_for(bucket_ns)
+        if level is None:
+            return None
+        indexes = self._indexes(columns)
+        first, offset, count = self.levels[level]
+        step = level * 1_000_000_000
+        low = max(0, (start - first) // step)
+        high = max(low, min(count, (end - first) // step + 1))
+        with open(PyramidWriter.level_path(self.path, level), 'rb') as f:
+            f.seek(offset + low * self.dtype.itemsize)
+            records = np.fromfile(f, self.dtype, high - low)
+        times = first + np.arange(low, low + len(records), dtype='i8') * step
+        times, lows, highs, means, counts = self._merge(
+            times, bucket_ns, records['count'][:, indexes].astype('i8'), records['min'][:, indexes],
+            records['max'][:, indexes], records['mean'][:, indexes])
+        return {'level': level, 'time': times, 'end': first + (low + len(records)) * step,
+                'min': lows, 'max': highs, 'mean': means, 'count': counts}
+
+    # 合并汇总
+    @staticmethod
+    def _merge(times, bucket_ns, counts, lows, highs, means):
+        """把汇总按 bucket_ns 合并: 最小/最大值取极值, 平均值按样本数加权"""
+        if not len(times):
+            return times, lows, highs, means, counts
+        ids = times // bucket_ns
+        starts = np.flatnonzero(np.concatenate(([True], ids[1:] != ids[:-1])))
+        totals = np.add.reduceat(counts, starts, axis=0)
+        sums = np.add.reduceat(np.where(counts > 0, means * counts, 0.0), starts, axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / totals
+        return (ids[starts] * bucket_ns, np.fmin.reduceat(lows, starts, axis=0),
+                np.fmax.reduceat(highs, starts, axis=0), means, totals)
+
+    # 包络查询
+    def envelope(self, start, end, columns, buckets=1000):
+        """同 query, 金字塔太粗 (或没有金字塔) 时读取原始记录按同样方式分桶, 此时 level 为0"""
+        result = self.query(start, end, columns, buckets)
+        if result is not None:
+            return result
+        bucket_ns = max(1, (end - start) // max(1, buckets))
+        with LogReader.open(self.path) as reader:
+            data = reader.query(start, end, columns)
+        decimator = MinMaxDecimator(columns, bucket_ns)
+        values = np.column_stack([data[name] for name in columns]).reshape(len(data['time']), len(columns))
+        parts = list(zip(decimator.feed_values(data['time'], values), decimator.finish()))
+        times, lows, highs, means, counts = (np.concatenate(part) for part in parts)
+        return {'level': 0, 'time': times, 'end': int(data['time'][-1]) + 1 if len(times) else start,
+                'min': lows, 'max': highs, 'mean': means, 'count': counts.astype('i8')}
+
+
+# 补建数据金字塔
+def build_pyramid(path, span=3_600_000_000_000):
+    """为没有数据金字塔的记录文件 (旧版本的记录、崩溃后恢复的记录) 补建, 每次读取 span 纳秒的数据"""
+    with LogReader.open(path) as reader:
+        labels = {field: label for label, field in reader.names.items()}
+        if isinstance(reader, RecordingReader):
+            writer = PyramidWriter(path, reader.header['fields'], labels)
+            try:
+                for _, rows in reader.chunks():
+                    writer.feed_rows(rows)
+            finally:
+                writer.close()
+            return
+        fields = list(reader.QUERY_FIELDS)
+        index = reader.time_index()
+        writer = PyramidWriter(path, fields, labels)
+        try:
+            start = index.times[0] if index.times else None
+            while start is not None:
+                data = reader.query(start, start + span - 1, fields)
+                if not len(data['time']) and start > index.times[-1]:
+                    break
+                writer.feed(data['time'], np.column_stack([data[name] for name in fields]))
+                start += span
+        finally:
+            writer.close()
+
+
+# 预写日志读取
+class JournalReader:
+    """预写日志读取: 依次校验数据块, 遇到第一个损坏或序号不连续的块即停止
+
+    base_rows 为日志首行在记录中的行号 (之前的行在检查点时已落盘到记录文件)。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            data = f.read(JournalWriter.FILE_HEADER.size)
+            if len(data) < JournalWriter.FILE_HEADER.size:
+                raise ValueError(f'{path} 不是预写日志文件')
+            magic, version, blocks, length = JournalWriter.FILE_HEADER.unpack(data)
+            if magic != JournalWriter.MAGIC:
+                raise ValueError(f'{path} 不是预写日志文件')
+            if version > JournalWriter.VERSION:
+                raise ValueError(f'不支持的预写日志版本: {version}')
+            payload = f.read(length)
+            if len(payload) < length:
+                raise ValueError(f'{path} 文件头不完整')
+        self.header = json.loads(payload.decode('utf-8'))
+        self.version = version
+        if version == 1:
+            self.data_offset = blocks * JournalWriter.BLOCK_SIZE
+        else:
+            self.data_offset = JournalWriter.FILE_HEADER.size + length
+        self.base_rows = self.header.get('base_rows', 0)
+        self.dtype = np.dtype([tuple(column) for column in self.header['columns']])
+        self.samples = SampleBuffer(self.header['fields'], 1, self.header['integer_fields'],
+                                    self.header.get('groups', ()))
+        self.valid_size = self.data_offset  # 最后一个有效块的结束位置 (读完 blocks() 后有效)
+        self.rows = 0
+
+    # 逐块读取
+    def blocks(self):
+        """依次返回每个有效块的结构化数组"""
+        header = JournalWriter.BLOCK_HEADER
+        sequence = 0
+        with open(self.path, 'rb') as f:
+            f.seek(self.data_offset)
+            while True:
+                data = f.read(header.size)
+                if len(data) < header.size:
+                    return
+                magic, count, crc, number = header.unpack(data)
+                if magic != JournalWriter.BLOCK_MAGIC or number != sequence:
+                    return
+                if self.version == 1:
+                    size = JournalWriter.BLOCK_SIZE - header.size
+                    if count * self.dtype.itemsize > size:
+                        return
+                else:
+                    size = count * self.dtype.itemsize
+                payload = f.read(size)
+                if len(payload) < size or crc != JournalWriter.block_crc(count, number, payload):
+                    return
+                yield np.frombuffer(payload, dtype=self.dtype, count=count)
+                sequence += 1
+                self.rows += count
+                self.valid_size += header.size + size
+
+
+# 往返时间估计
+class RttEstimator:
+    """往返时间估计 (类似TCP RTO)
+
+    平滑往返时间 srtt 与偏差 rttvar 按 EWMA 更新, 超时时间 timeout = srtt + 4 * rttvar,
+    并限制在 [minimum, maximum] 之间。同一请求的每次重试超时时间加倍;
+    只有加倍后重试成功才保留加倍的超时时间, 全部失败 (设备可能离线) 不抬高超时, 由熔断器处理。
+    """
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self, initial, minimum, maximum):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.srtt = None
+        self.rttvar = None
+        self.timeout = initial
+        self.samples = 0
+        self.timeouts = 0
+
+    # 加入一个往返时间样本
+    def sample(self, rtt):
+        """加入一个往返时间样本(秒)"""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += self.BETA * (abs(self.srtt - rtt) - self.rttvar)
+            self.srtt += self.ALPHA * (rtt - self.srtt)
+        self.samples += 1
+        self.timeout = min(max(self.srtt + 4 * self.rttvar, self.minimum), self.maximum)
+
+    # 超时退避
+    def backoff(self, timeout):
+        """超时退避: 返回下一次重试使用的超时时间 (加倍)"""
+        self.timeouts += 1
+        return min(timeout * 2, self.maximum)
+
+    # 重试成功
+    def retried(self, timeout):
+        """加倍超时后重试成功: 保留该超时时间, 直到新的样本重新计算"""
+        self.timeout = max(self.timeout, timeout)
+
+    def __str__(self):
+        srtt = f'{self.srtt * 1000:.1f} ms' if self.srtt is not None else '-'
+        return f'往返 {srtt}, 超时 {self.timeout * 1000:.1f} ms (样本 {self.samples}, 超时 {self.timeouts}次)'
+
+
+# 每周期重试预算
+class RetryBudget:
+    """每个采集周期的重试预算, 所有设备共享, 防止丢帧时重试风暴拖慢整个周期"""
+
+    def __init__(self, size):
+        self.size = size
+        self._left = size
+        self._lock = threading.Lock()
+
+    # 新周期开始, 恢复预算
+    def reset(self):
+        """新周期开始, 恢复预算"""
+        with self._lock:
+            self._left = self.size
+
+    # 取得一次重试额度
+    def take(self):
+        """取得一次重试额度, 预算用完返回False"""
+        with self._lock:
+            if self._left <= 0:
+                return False
+            self._left -= 1
+            return True
+
+
+# 设备熔断器
+class CircuitBreaker:
+    """设备熔断器
+
+    闭合: 正常轮询; 连续失败 THRESHOLD 次后断开: 跳过该设备, 字段记为缺失;
+    冷却时间到后半开: 发起一次探测, 成功则闭合, 失败则重新断开且冷却时间加倍。
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+    THRESHOLD = 3  # 连续失败次数阈值
+    COOLDOWN = 1.0  # 初始冷却时间(秒)
+    MAX_COOLDOWN = 30.0
+
+    def __init__(self, name, on_change=None):
+        self.name = name
+        self.on_change = on_change
+        self.state = self.CLOSED
+        self.failures = 0
+        self.cooldown = self.COOLDOWN
+        self._probe_at = 0.0
+
+    # 是否到了探测时间
+    def probe_due(self):
+        """断开状态下冷却时间已到则转为半开并返回True (调用方随后发起一次探测)"""
+        if self.state == self.OPEN and time.monotonic() >= self._probe_at:
+            self.state = self.HALF_OPEN
+            return True
+        return False
+
+    # 记录一次读取结果
+    def record(self, success):
+        """记录一次读取结果"""
+        if success:
+            self.failures = 0
+            self.cooldown = self.COOLDOWN
+            if self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+            return
+
+        self.failures += 1
+        if self.state == self.HALF_OPEN:
+            self.cooldown = min(self.cooldown * 2, self.MAX_COOLDOWN)
+            self._trip()
+        elif self.state == self.CLOSED and self.failures >= self.THRESHOLD:
+            self._trip()
+
+    # 断开
+    def _trip(self):
+        """断开, 冷却时间后允许探测"""
+        self._probe_at = time.monotonic() + self.cooldown
+        self._set_state(self.OPEN)
+
+    def _set_state(self, state):
+        self.state = state
+        if self.on_change:
+            self.on_change(self)
+
+
+# 断线重连退避
+class ReconnectBackoff:
+    """断线重连退避: 等待时间按指数增长到上限, 并加入随机抖动, 避免多个连接同时重连"""
+
+    def __init__(self, base=0.5, cap=30.0):
+        self.base = base
+        self.cap = cap
+        self.attempts = 0
+
+    # 下一次重连前的等待时间
+    def next_delay(self):
+        """下一次重连前的等待时间(秒), 在 [d/2, d] 内随机, d = min(cap, base * 2^n)"""
+        delay = min(self.cap, self.base * 2 ** self.attempts)
+        self.attempts += 1
+        return random.uniform(delay / 2, delay)
+
+    # 连接成功, 重置退避
+    def reset(self):
+        """连接成功, 重置退避"""
+        self.attempts = 0
+
+
+# Modbus TCP 异步客户端
+class ModbusTcpClient:
+    """Modbus TCP 异步客户端
+
+    每个请求分配滚动的事务号, 允许多个请求同时在途 (流水线),
+    后台读取任务按MBAP报文头长度切帧, 按事务号把响应交给对应的请求;
+    超时后迟到的旧响应因事务号不匹配被丢弃, 不会被当成新请求的响应。
+    采集循环每个周期只向采集卡发一个请求 (8个通道一次读完), 实际采集时同时在途的请求只有一个;
+    多个请求同时在途只在 --bench 的流水线测试中用到。
+    """
+    MAX_OUTSTANDING = 8  # 同时在途的最大请求数
+    RTO_MIN = 0.02  # 自适应超时下限(秒)
+    RTO_MAX = 2.0  # 自适应超时上限(秒)
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout  # 建立连接超时, 也是响应超时的初始值
+        self.rtt = RttEstimator(timeout, self.RTO_MIN, self.RTO_MAX)
+        self.reader = None
+        self.writer = None
+        self._read_task = None
+        self._pending = {}  # 事务号 -> Future
+        self._transaction = 0
+        self._slots = None
+        self.stale = 0  # 丢弃的迟到/未知事务号响应数
+
+    @property
+    def connected(self):
+        return self.writer is not None
+
+    # 建立连接
+    async def connect(self):
+        """建立连接并启动后台读取任务"""
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout)
+        self.writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._slots = asyncio.Semaphore(self.MAX_OUTSTANDING)
+        self._read_task = asyncio.create_task(self._read_loop())
+
+    # 关闭连接
+    async def close(self):
+        """关闭连接, 在途请求以 ConnectionError 结束"""
+        if self._read_task:
+            self._read_task.cancel()
+            self._read_task = None
+        if self.writer:
+            try:
+                self.writer.close()
+                await self.writer.wait_closed()
+            except Exception:
+                pass
+            finally:
+                self.reader = None
+                self.writer = None
+        self._fail_pending(ConnectionError('连接已关闭'))
+
+    # 发送请求并等待对应事务号的响应
+    async def execute(self, request, retries=1, budget=None):
+        """发送请求并等待对应事务号的响应
+
+        request 为完整的 Modbus TCP 请求帧 (如预编译的模板), 前两字节事务号会被替换。
+        返回完整响应帧; 全部尝试超时抛出 asyncio.TimeoutError。
+        超时时间按往返时间估计自适应, 重发使用新事务号, 因此每次响应都是有效样本;
+        budget 为 RetryBudget 时, 每次重试需从预算中取得额度。
+        """
+        timeout = self.rtt.timeout
+        for attempt in range(retries):
+            if attempt and budget is not None and not budget.take():
+                break
+            try:
+                return await self._execute_once(request, timeout)
+            except asyncio.TimeoutError:
+                timeout = self.rtt.backoff(timeout)
+        raise asyncio.TimeoutError()
+
+    # 发送一次请求
+    async def _execute_once(self, request, timeout):
+        """发送一次请求并等待响应"""
+        async with self._slots:
+            if self.writer is None:
+                raise ConnectionError('未建立连接')
+            transaction = self._next_transaction()
+            future = asyncio.get_running_loop().create_future()
+            self._pending[transaction] = future
+            try:
+                sent_at = time.perf_counter()
+                self.writer.write(transaction.to_bytes(2, 'big') + request[2:])
+                frame = await asyncio.wait_for(future, timeout)
+                self.rtt.sample(time.perf_counter() - sent_at)
+                return frame
+            finally:
+                self._pending.pop(transaction, None)
+
+    # 分配下一个事务号
+    def _next_transaction(self):
+        """分配下一个事务号 (0~65535滚动, 跳过仍在途的事务号)"""
+        while True:
+            self._transaction = (self._transaction + 1) & 0xFFFF
+            if self._transaction not in self._pending:
+                return self._transaction
+
+    # 后台读取响应
+    async def _read_loop(self):
+        """后台读取响应, 按MBAP报文头长度切帧并按事务号分发"""
+        header_size = ModbusCodec.MBAP_HEADER.size
+        try:
+            while True:
+                header = await self.reader.readexactly(header_size)
+                transaction, _, length = ModbusCodec.MBAP_HEADER.unpack(header)
+                frame = header + await self.reader.readexactly(length)
+                future = self._pending.get(transaction)
+                if future is None or future.done():
+                    self.stale += 1
+                    continue
+                future.set_result(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._fail_pending(ConnectionError(f'采集卡连接中断: {e}'))
+            self.writer.close()
+            self.reader = None
+            self.writer = None
+
+    # 结束全部在途请求
+    def _fail_pending(self, error):
+        """结束全部在途请求"""
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending.clear()
+
+
+# 网关总线线程
+class BusWorker(threading.Thread):
+    """网关总线线程
+
+    独占网关socket, GUI和采集线程的请求都经优先级队列串行发送,
+    避免两个线程同时读写同一个socket造成响应错位。
+    启停、设定值等控制命令优先于轮询读取: 排队中的轮询会被插队,
+    正在重试的轮询在有控制命令等待时放弃剩余重试。
+    """
+    PRIORITY_ESTOP = 0  # 急停, 排在所有请求之前
+    PRIORITY_CONTROL = 1  # 启停、设定值等控制命令
+    PRIORITY_READ = 2  # 手动读取状态
+    PRIORITY_POLL = 3  # 采集线程轮询
+    RTO_MIN = 0.01  # 自适应超时下限(秒)
+    RTO_MAX = 0.5  # 自适应超时上限(秒)
+    CONNECT_TIMEOUT = 1.0  # 后台重连的连接超时(秒)
+
+    def __init__(self, sock, frame_cache, log, response_timeout, address=None):
+        super().__init__(daemon=True)
+        self.sock = sock
+        self.address = address  # 网关地址, 为None时断线后不自动重连
+        self.backoff = ReconnectBackoff()
+        self._reconnect_at = None
+        self._lost_at = None
+        self.frame_cache = frame_cache
+        self.log = log
+        self.response_timeout = response_timeout
+        self.queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self.rtt = {}  # 从站地址 -> RttEstimator, 按设备自适应超时
+        # 各优先级最近的请求延迟(秒): 入队到收到响应
+        self.latency = {priority: collections.deque(maxlen=1000)
+                        for priority in (self.PRIORITY_ESTOP, self.PRIORITY_CONTROL,
+                                         self.PRIORITY_READ, self.PRIORITY_POLL)}
+
+    # 建立网关连接
+    @staticmethod
+    def open_connection(address, timeout):
+        """建立网关TCP连接"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # 关闭小包合并算法
+            sock.settimeout(timeout)
+            sock.connect(address)
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    @property
+    def connected(self):
+        return self.sock is not None
+
+    # 提交请求
+    def submit(self, request, expect=None, retries=3, priority=PRIORITY_CONTROL, budget=None):
+        """提交请求, 返回 Future, 结果为 (是否成功, 响应payload)
+
+        budget 为 RetryBudget 时, 每次重试需从预算中取得额度, 预算用完即放弃。
+        """
+        future = Future()
+        self.queue.put((priority, next(self._seq), time.perf_counter(), request, expect, (retries, budget), future))
+        return future
+
+    # 停止线程
+    def stop(self):
+        """停止线程, 已排队的急停仍会发出, 其余未处理的请求返回失败"""
+        self.queue.put((self.PRIORITY_ESTOP, next(self._seq), 0, None, None, None, None))
+
+    def run(self):
+        while True:
+            wait_timeout = None
+            if self.sock is None and self._reconnect_at is not None:
+                wait_timeout = self._reconnect_at - time.monotonic()
+                if wait_timeout <= 0:
+                    self._reconnect()
+                    continue
+            try:
+                item = self.queue.get(timeout=wait_timeout)
+            except queue.Empty:
+                continue
+            priority, _, queued_at, request, expect, retry_policy, future = item
+            if future is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = self._transact(request, expect, retry_policy, priority)
+            except Exception as e:
+                self.log('error', f'总线处理出错: {str(e)}')
+                result = (False, None)
+            self.latency[priority].append(time.perf_counter() - queued_at)
+            future.set_result(result)
+
+        self._close_socket()
+        while not self.queue.empty():
+            future = self.queue.get_nowait()[-1]
+            if future and future.set_running_or_notify_cancel():
+                future.set_result((False, None))
+
+    # 是否有更高优先级的请求在排队
+    def _urgent_waiting(self, priority):
+        """是否有更高优先级的请求在排队"""
+        with self.queue.mutex:
+            return bool(self.queue.queue) and self.queue.queue[0][0] < priority
+
+    # 获取从站的往返时间估计
+    def _rtt_for(self, slave):
+        """获取从站的往返时间估计"""
+        rtt = self.rtt.get(slave)
+        if rtt is None:
+            rtt = self.rtt[slave] = RttEstimator(self.response_timeout, self.RTO_MIN, self.RTO_MAX)
+        return rtt
+
+    # 执行一次请求-响应事务
+    def _transact(self, request, expect, retry_policy, priority):
+        """执行一次请求-响应事务 (含重试)
+
+        超时时间按该从站的往返时间估计自适应; 只用首次发送的响应更新估计 (Karn算法),
+        每次重试超时时间加倍。
+        """
+        if self.sock is None:
+            if self._reconnect_at is None:  # 重连期间不重复报错
+                self.log('error', '未建立连接')
+            return False, None
+
+        retries, budget = retry_policy
+        rtt = self._rtt_for(request[0])
+        timeout = rtt.timeout
+        for attempt in range(retries):
+            if attempt and self._urgent_waiting(priority):
+                break  # 让出总线给更高优先级的命令
+            if attempt and budget is not None and not budget.take():
+                break  # 本周期重试预算已用完
+            try:
+                # 添加CRC并发送
+                data_with_crc = self.frame_cache.get(request)
+                self._drain_socket()
+                self.sock.sendall(data_with_crc)
+                if request[0] == 0x00:  # 广播帧从站不应答
+                    return True, None
+
+                # 接收响应 (按功能码和字节数重组完整帧)
+                sent_at = time.perf_counter()
+                response = self._recv_frame(timeout)
+
+                # 验证CRC
+                crc_valid, payload = CRCHelper.verify_crc(memoryview(response))
+                if not crc_valid:
+                    self.log('warning', 'CRC校验失败')
+                    continue
+                if attempt == 0:
+                    rtt.sample(time.perf_counter() - sent_at)
+                else:
+                    rtt.retried(timeout)
+
+                if expect and not ModbusCodec.matches(payload, *expect):
+                    self.log('warning', f'响应不匹配: 期望 {expect[0]:02X}{expect[1]:02X}, '
+                                        f'收到 {bytes(payload[:2]).hex().upper()}')
+                    continue
+                if expect and not ModbusCodec.data_complete(request, payload):
+                    self.log('warning', f'响应数据长度不符: 收到 {len(payload)} 字节')
+                    continue
+
+                return True, payload
+            except socket.timeout:
+                timeout = rtt.backoff(timeout)
+                self.log('warning', f'命令超时 (尝试 {attempt + 1}/{retries})')
+            except Exception as e:
+                self.log('error', f'发送命令出错: {str(e)}')
+                self._connection_lost()
+                break
+
+        return False, None
+
+    # 连接中断
+    def _connection_lost(self):
+        """连接中断: 关闭socket, 配置了网关地址时安排后台重连"""
+        self._close_socket()
+        if self.address is None:
+            return
+        self._lost_at = time.monotonic()
+        self._reconnect_at = self._lost_at + self.backoff.next_delay()
+        self.log('warning', f'网关连接中断, 正在后台重连 {self.address[0]}:{self.address[1]}')
+
+    # 重新连接网关
+    def _reconnect(self):
+        """重新连接网关, 失败时按指数退避安排下一次重连"""
+        try:
+            self.sock = self.open_connection(self.address, self.CONNECT_TIMEOUT)
+        except OSError as e:
+            delay = self.backoff.next_delay()
+            self._reconnect_at = time.monotonic() + delay
+            self.log('warning', f'网关重连失败: {str(e)}, {delay:.1f} 秒后重试')
+            return
+        self.backoff.reset()
+        self._reconnect_at = None
+        self.log('info', f'网关连接已恢复 (中断 {time.monotonic() - self._lost_at:.1f} 秒)')
+
+    # 清空接收缓冲区中的残留数据
+    def _drain_socket(self):
+        """清空接收缓冲区中的残留数据 (上一次超时后迟到的响应)"""
+        self.sock.setblocking(False)
+        try:
+            while self.sock.recv(1024):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        finally:
+            self.sock.settimeout(self.response_timeout)
+
+    # 接收一帧完整的RTU响应
+    def _recv_frame(self, timeout):
+        """接收一帧完整的RTU响应
+
+        透传网关可能把一帧拆成多个TCP分段, 这里根据功能码和字节数计算
+        期望长度, 持续拼接直到帧完整或超时, 帧完整后立即返回。
+        """
+        deadline = time.monotonic() + timeout
+        buf = bytearray()
+        expected = None
+        while expected is None or len(buf) < expected:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout('响应不完整' if buf else 'timed out')
+            self.sock.settimeout(remaining)
+            chunk = self.sock.recv(1024)
+            if not chunk:
+                raise ConnectionResetError('连接已被对端关闭')
+            buf += chunk
+            expected = ModbusCodec.rtu_response_length(buf)
+            if expected == 0:  # 未知功能码, 按收到的数据返回
+                return bytes(buf)
+        return bytes(buf[:expected])
+
+    # 安全关闭socket
+    def _close_socket(self):
+        """安全关闭socket"""
+        if self.sock:
+            try:
+                self.sock.close()
+            except:
+                pass
+            finally:
+                self.sock = None
+
+    # 请求延迟统计
+    def latency_stats(self, priority):
+        """返回某优先级请求延迟统计(毫秒), 无数据时返回None"""
+        samples = sorted(self.latency[priority])
+        if not samples:
+            return None
+        return {
+            'count': len(samples),
+            'mean': sum(samples) / len(samples) * 1000,
+            'p99': samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000,
+            'max': samples[-1] * 1000,
+        }
+
+
+# 急停快速通道
+class EmergencyStop:
+    """急停快速通道
+
+    急停命令以最高优先级插到总线队列最前面, 并放弃正在重试的其他命令的剩余重试;
+    estop_second_connection 开启时, 另外通过预先建立的第二条网关连接同时发送,
+    不必等待主连接上正在进行的轮询; estop_broadcast 开启时, 先补发一帧广播急停(地址0, 无应答)。
+    每次急停记录从点击到收到确认的耗时。
+    """
+    RETRIES = 5
+    WAIT = 1.0  # 等待确认的最长时间(秒)
+
+    def __init__(self, config, frame_cache, log, response_timeout):
+        self.config = config
+        self.frame_cache = frame_cache
+        self.log = log
+        self.response_timeout = response_timeout
+        self.bus = None  # 第二条网关连接上的总线线程
+        self.latencies = []  # 每次急停的耗时(秒), 未确认记为None
+
+    # 建立第二条网关连接
+    def open(self):
+        """建立第二条网关连接 (仅在配置开启时)"""
+        self.close()
+        if not self.config.estop_second_connection:
+            return
+        try:
+            address = (self.config.ip_address, self.config.port)
+            sock = BusWorker.open_connection(address, self.response_timeout)
+            self.bus = BusWorker(sock, self.frame_cache, self.log, self.response_timeout, address)
+            self.bus.start()
+            self.log('info', '急停备用连接已建立')
+        except Exception as e:
+            self.log('warning', f'急停备用连接失败: {str(e)}')
+
+    # 关闭第二条网关连接
+    def close(self):
+        """关闭第二条网关连接"""
+        if self.bus:
+            self.bus.stop()
+            self.bus.join(1)
+            self.bus = None
+
+    # 触发急停
+    def trigger(self, bus, clicked_at):
+        """触发急停, 返回 (是否确认, 点击到确认的耗时, 确认通道)"""
+        request = ModbusCodec.write_register(self.config.inverter_slave, 0x2000, 0x0005)  # 自由停机
+        broadcast = ModbusCodec.write_register(0x00, 0x2000, 0x0005)
+        paths = {}
+        for name, worker in (('备用连接', self.bus), ('主连接', bus)):
+            if worker is None or not worker.connected:
+                continue
+            if self.config.estop_broadcast:
+                worker.submit(broadcast, None, 1, BusWorker.PRIORITY_ESTOP)
+            paths[worker.submit(request, request[:2], self.RETRIES, BusWorker.PRIORITY_ESTOP)] = name
+
+        pending = set(paths)
+        while pending:
+            remaining = clicked_at + self.WAIT - time.perf_counter()
+            done, pending = wait(pending, timeout=max(remaining, 0), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.result()[0]:
+                    latency = time.perf_counter() - clicked_at
+                    self.latencies.append(latency)
+                    return True, latency, paths[future]
+            if remaining <= 0:
+                break
+
+        self.latencies.append(None)
+        return False, time.perf_counter() - clicked_at, None
+
+
+class ModbusCodec:
+    """Modbus 编解码工具类
+
+    请求帧直接以bytes构造, 响应按从站地址/功能码字节匹配,
+    数据区用预编译的 struct.Struct 通过 unpack_from 解码, 不经过十六进制字符串。
+    """
+
+    _REQUEST = struct.Struct('>BBHH')  # 从站地址 功能码 寄存器地址 数量/数值
+    _TCP_REQUEST = struct.Struct('>HHHBBHH')  # 事务号 协议号 长度 单元号 功能码 地址 数量
+    MBAP_HEADER = struct.Struct('>HHH')  # Modbus TCP报文头: 事务号 协议号 后续长度
+
+    # 响应数据区解码 (偏移3: 跳过地址、功能码、字节数)
+    INVERTER_PARAMS = struct.Struct('>7h')  # 7000h~7006h 变频器运行参数
+    TIMING_PARAMS = struct.Struct('>2h')  # F011h~F012h 加减速时间
+    RUN_STATUS = struct.Struct('>h')  # 3000h 运行状态
+    TORQUE_METER = struct.Struct('>3i')  # 转矩仪 转矩/转速/功率
+
+    # 构造读寄存器请求帧
+    @staticmethod
+    def read_registers(slave, address, count, function=0x03):
+        """构造读寄存器请求帧 (不含CRC)"""
+        return ModbusCodec._REQUEST.pack(slave, function, address, count)
+
+    # 构造写单个寄存器请求帧
+    @staticmethod
+    def write_register(slave, address, value):
+        """构造写单个寄存器请求帧 (不含CRC)"""
+        return ModbusCodec._REQUEST.pack(slave, 0x06, address, value)
+
+    # 构造Modbus TCP读寄存器请求帧
+    @staticmethod
+    def tcp_read_registers(transaction, unit, address, count, function=0x03):
+        """构造Modbus TCP读寄存器请求帧"""
+        return ModbusCodec._TCP_REQUEST.pack(transaction, 0, 6, unit, function, address, count)
+
+    # 判断响应是否来自期望的从站和功能码
+    @staticmethod
+    def matches(payload, slave, function):
+        """判断响应是否来自期望的从站和功能码"""
+        return len(payload) >= 2 and payload[0] == slave and payload[1] == function
+
+    # 判断读响应的数据长度是否与请求的数量一致
+    @staticmethod
+    def data_complete(request, payload):
+        """读寄存器/线圈的响应字节数与请求的数量一致且数据完整时为真, 其他请求不检查"""
+        function = request[1]
+        if function not in (0x01, 0x02, 0x03, 0x04) or len(request) < 6:
+            return True
+        count = int.from_bytes(request[4:6], 'big')
+        expected = (count + 7) // 8 if function in (0x01, 0x02) else count * 2
+        return len(payload) >= 3 + expected and payload[2] == expected
+
+    # 根据已收到的数据计算RTU响应帧总长度
+    @staticmethod
+    def rtu_response_length(buf):
+        """根据已收到的数据计算RTU响应帧总长度 (含CRC)
+
+        返回None表示帧头尚不完整, 返回0表示功能码未知无法判断长度。
+        """
+        if len(buf) < 2:
+            return None
+        function = buf[1]
+        if function & 0x80:  # 异常响应: 地址 功能码 异常码 CRC
+            return 5
+        if function in (0x01, 0x02, 0x03, 0x04):  # 地址 功能码 字节数 数据 CRC
+            if len(buf) < 3:
+                return None
+            return 5 + buf[2]
+        if function in (0x05, 0x06, 0x0F, 0x10):  # 写响应固定8字节
+            return 8
+        return 0
+
+
+class ReadPlanner:
+    """寄存器读取规划
+
+    按声明的寄存器表 (名称/设备/轮询组/功能码/地址/数据类型/比例) 生成尽量少的块读取:
+    同一从站、同一功能码、同一轮询组内相邻的寄存器合并为一次读取, 间隔不超过 max_gap 个寄存器时
+    连同中间未用的寄存器一起读出, 单次读取不超过125个寄存器 (Modbus FC03/FC04 上限)。
+    """
+
+    MAX_BLOCK = 125
+    TYPES = {
+        'int16': struct.Struct('>h'),
+        'uint16': struct.Struct('>H'),
+        'int32': struct.Struct('>i'),
+        'uint32': struct.Struct('>I'),
+        'float32': struct.Struct('>f'),
+    }
+    DEVICES = {'inverter': 'inverter_slave', 'torque_meter': 'torque_meter_slave'}  # 设备 -> 从站地址配置项
+
+    # 寄存器声明: 原始值 * scale / divisor 为输出值
+    Register = collections.namedtuple('Register', 'name device group slave function address type scale divisor')
+
+    class Block:
+        """一次块读取: 请求帧及块内各寄存器的解码位置"""
+
+        def __init__(self, device, group, slave, function, address):
+            self.device = device
+            self.group = group
+            self.slave = slave
+            self.function = function
+            self.address = address
+            self.count = 0
+            self.fields = []  # (名称, 响应中的字节偏移, 解码器, scale, divisor)
+            self.request = b''
+
+        @property
+        def end(self):
+            return self.address + self.count
+
+        # 按响应帧解码块内寄存器
+        def decode(self, payload):
+            """按响应帧 (含地址/功能码/字节数头) 解码块内寄存器; 数据不足块长度时抛出 socket.timeout"""
+            if len(payload) < 3 + self.count * 2:
+                raise socket.timeout('响应不完整')
+            values = {}
+            for name, offset, codec, scale, divisor in self.fields:
+                value = codec.unpack_from(payload, offset)[0]
+                values[name] = value * scale / divisor if scale != 1 or divisor != 1 else value
+            return values
+
+    def __init__(self, registers, max_gap=0):
+        self.registers = list(registers)
+        self.max_gap = max_gap
+        self.blocks = self._plan()
+
+    # 按配置生成读取规划
+    @classmethod
+    def from_config(cls, config):
+        """按配置中的 poll_registers 和 read_gap_fill 生成读取规划"""
+        registers = []
+        groups = {}
+        for item in config.poll_registers:
+            device = item['device']
+            if device not in cls.DEVICES:
+                raise ValueError(f'寄存器 {item["name"]} 的设备未知: {device}')
+            group = item.get('group', device)
+            if groups.setdefault(group, device) != device:
+                raise ValueError(f'轮询组 {group} 不能跨设备 (寄存器 {item["name"]})')
+            if item.get('type', 'int16') not in cls.TYPES:
+                raise ValueError(f'寄存器 {item["name"]} 的数据类型未知: {item.get("type")}')
+            address = item['address']
+            registers.append(cls.Register(
+                item['name'], device, group, getattr(config, cls.DEVICES[device]),
+                item.get('function', 0x03),
+                int(address, 0) if isinstance(address, str) else address,
+                item.get('type', 'int16'), item.get('scale', 1), item.get('divisor', 1),
+            ))
+        return cls(registers, config.read_gap_fill)
+
+    # 合并相邻寄存器
+    def _plan(self):
+        """合并相邻寄存器, 返回块读取列表"""
+        blocks = []
+        block = None
+        for reg in sorted(self.registers, key=lambda r: (r.slave, r.function, r.group, r.address)):
+            size = self.TYPES[reg.type].size // 2
+            if (block is None or (reg.slave, reg.function, reg.group) != (block.slave, block.function, block.group)
+                    or reg.address - block.end > self.max_gap
+                    or reg.address + size - block.address > self.MAX_BLOCK):
+                block = self.Block(reg.device, reg.group, reg.slave, reg.function, reg.address)
+                blocks.append(block)
+            block.count = max(block.count, reg.address + size - block.address)
+            block.fields.append((reg.name, 3 + (reg.address - block.address) * 2,
+                                 self.TYPES[reg.type], reg.scale, reg.divisor))
+        for block in blocks:
+            block.request = ModbusCodec.read_registers(block.slave, block.address, block.count, block.function)
+        return blocks
+
+    # 轮询组
+    def groups(self):
+        """轮询组 -> 设备, 按声明顺序"""
+        return {reg.group: reg.device for reg in self.registers}
+
+    # 某轮询组的块读取
+    def group_blocks(self, group):
+        """某轮询组的块读取"""
+        return [block for block in self.blocks if block.group == group]
+
+    @property
+    def saved(self):
+        """相比每个寄存器单独读取, 每周期节省的总线事务数"""
+        return len(self.registers) - len(self.blocks)
+
+    def __str__(self):
+        return (f'{len(self.registers)} 个寄存器合并为 {len(self.blocks)} 次块读取, '
+                f'每周期节省 {self.saved} 次总线事务 (间隔填充 {self.max_gap} 个寄存器)')
+
+
+# 单通道累计统计
+class RunningStats:
+    """单通道累计统计 (Welford 算法): 每个样本 O(1) 更新, 不保存历史, 长时间运行数值稳定
+
+    空值 (None/NaN, 读取失败) 不计入。of() 用同样的定义一次算出一段数据 (如采样历史中的滑动窗口) 的统计。
+    """
+    __slots__ = ('count', 'mean', 'm2', 'minimum', 'maximum')
+    STATS = (('mean', '均值'), ('stdev', '标准差'), ('rms', 'RMS'), ('minimum', '最小'), ('maximum', '最大'))
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # 与均值之差的平方和
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    # 加入一个样本
+    def add(self, value):
+        if value is None or value != value:
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+
+    @classmethod
+    def of(cls, values):
+        """一段数据 (float64数组, NaN为空) 的统计"""
+        stats = cls()
+        valid = values[~np.isnan(values)]
+        if valid.size:
+            stats.count = int(valid.size)
+            stats.mean = float(valid.mean())
+            stats.m2 = float(np.square(valid - stats.mean).sum())
+            stats.minimum = float(valid.min())
+            stats.maximum = float(valid.max())
+        return stats
+
+    @property
+    def variance(self):
+        """样本方差 (n-1)"""
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def stdev(self):
+        return math.sqrt(self.variance)
+
+    @property
+    def rms(self):
+        """均方根 = sqrt(均值² + 总体方差)"""
+        return math.sqrt(self.mean * self.mean + self.m2 / self.count) if self.count else 0.0
+
+    # 各统计量
+    def values(self):
+        """按 STATS 顺序返回各统计量, 没有有效样本时为None"""
+        if not self.count:
+            return [None] * len(self.STATS)
+        return [getattr(self, name) for name, _ in self.STATS]
+
+    def __str__(self):
+        if not self.count:
+            return '无有效数据'
+        return f'{self.count} 个样本, ' + ', '.join(f'{label} {value:.6g}'
+                                                for (_, label), value in zip(self.STATS, self.values()))
+
+
+# 派生量计算
+class DerivedChannels:
+    """派生量计算 (机械功率、效率、转差率、电能等)
+
+    按配置 derived_channels 中的声明依次计算, 后面的派生量可以引用前面的结果:
+        mech_power  机械功率(W) = 转矩(Nm) * 转速(rpm) * 2π / 60, 参数 torque, speed
+        ratio       比值 = numerator / denominator * scale (分母不大于0时为空), 如效率
+        slip        转差率(%) = (sync - actual) / sync * 100 (同步转速不大于0时为空)
+        energy      电能(kWh) = ∫ power * scale dt, power * scale 的单位为 kW; 按梯形累加,
+                    相邻两个有效样本间隔超过 max_gap 秒 (默认5) 时该段不计入
+    update() 逐个样本计算并累加, 不需要重新扫描历史; compute() 对整批数据做同样的计算, 并延续累加状态。
+    输入为空 (读取失败) 时该派生量为空, 电能保持上次的累计值。
+    """
+    TYPES = {'mech_power': ('torque', 'speed'), 'ratio': ('numerator', 'denominator'),
+             'slip': ('sync', 'actual'), 'energy': ('power',)}
+
+    def __init__(self, channels):
+        self.channels = channels
+        self.names = tuple(item['name'] for item in channels)
+        self.energy = {item['name']: 0.0 for item in channels if item['type'] == 'energy'}  # 累计电能(kWh)
+        self._last = {}  # 电能: 名称 -> (上一个有效样本的时间纳秒, 功率kW)
+
+    @classmethod
+    def from_config(cls, config, fields):
+        """按配置中的 derived_channels 生成派生量, fields 为可引用的原始字段; 声明有误时抛出ValueError"""
+        channels = []
+        known = set(fields)
+        for item in config.derived_channels:
+            name, kind = item.get('name'), item.get('type')
+            if not name or name in known:
+                raise ValueError(f'派生量名称为空或重复: {name}')
+            if kind not in cls.TYPES:
+                raise ValueError(f'派生量 {name} 的类型未知: {kind}')
+            for key in cls.TYPES[kind]:
+                if item.get(key) not in known:
+                    raise ValueError(f'派生量 {name} 的 {key} 引用了未知字段: {item.get(key)}')
+            channels.append(dict(item))
+            known.add(name)
+        return cls(channels)
+
+    # 逐个样本计算
+    def update(self, data, time_ns):
+        """计算一个样本的各派生量并写入 data"""
+        for item in self.channels:
+            kind = item['type']
+            if kind == 'energy':
+                data[item['name']] = self._integrate(item, data[item['power']], time_ns)
+                continue
+            a, b = data[item[self.TYPES[kind][0]]], data[item[self.TYPES[kind][1]]]
+            value = None
+            if a is not None and b is not None:
+                if kind == 'mech_power':
+                    value = a * b * math.pi / 30
+                elif kind == 'ratio':
+                    if b > 0:
+                        value = a / b * item.get('scale', 1)
+                elif a > 0:
+                    value = (a - b) / a * 100
+            data[item['name']] = None if value is None else round(value, 6)
+
+    # 电能累加
+    def _integrate(self, item, power, time_ns):
+        """梯形累加一个样本的电能, 返回累计值(kWh)"""
+        name = item['name']
+        if power is None:
+            return round(self.energy[name], 6)
+        power *= item.get('scale', 1)
+        last = self._last.get(name)
+        if last is not None:
+            dt = (time_ns - last[0]) / 1e9
+            if 0 < dt <= item.get('max_gap', 5):
+                self.energy[name] += (power + last[1]) / 2 * dt / 3600
+        self._last[name] = (time_ns, power)
+        return round(self.energy[name], 6)
+
+    # 整批计算
+    def compute(self, columns, times):
+        """整批计算: columns 为 字段名 -> float64数组 (缺失为NaN), times 为纳秒数组, 返回 派生量名 -> 数组"""
+        columns = dict(columns)
+        for item in self.channels:
+            kind = item['type']
+            name = item['name']
+            with np.errstate(divide='ignore', invalid='ignore'):
+                if kind == 'mech_power':
+                    value = columns[item['torque']] * columns[item['speed']] * (math.pi / 30)
+                elif kind == 'ratio':
+                    denominator = columns[item['denominator']]
+                    value = np.where(denominator > 0, columns[item['numerator']] / denominator, np.nan)
+                    value *= item.get('scale', 1)
+                elif kind == 'slip':
+                    sync = columns[item['sync']]
+                    value = np.where(sync > 0, (sync - columns[item['actual']]) / sync * 100, np.nan)
+                else:
+                    value = self._integrate_batch(item, columns[item['power']], times)
+            columns[name] = np.round(value, 6)
+        return {name: columns[name] for name in self.names}
+
+    # 整批电能累加
+    def _integrate_batch(self, item, power, times):
+        """按有效样本梯形累加, 与 _integrate 逐个样本的结果一致"""
+        name = item['name']
+        power = power * item.get('scale', 1)
+        valid = np.flatnonzero(~np.isnan(power))
+        result = np.empty(len(power))
+        if not len(valid):
+            result.fill(self.energy[name])
+            return result
+        valid_times = times[valid]
+        valid_power = power[valid]
+        last = self._last.get(name)
+        previous_times = np.concatenate(([last[0] if last else valid_times[0]], valid_times[:-1]))
+        previous_power = np.concatenate(([last[1] if last else valid_power[0]], valid_power[:-1]))
+        dt = (valid_times - previous_times) / 1e9
+        steps = np.where((dt > 0) & (dt <= item.get('max_gap', 5)),
+                         (valid_power + previous_power) / 2 * dt / 3600, 0.0)
+        totals = self.energy[name] + np.cumsum(steps)
+        # 无效样本保持前一个有效样本的累计值
+        positions = np.searchsorted(valid, np.arange(len(power)), side='right') - 1
+        result[:] = np.where(positions >= 0, totals[np.maximum(positions, 0)], self.energy[name])
+        self.energy[name] = float(totals[-1])
+        self._last[name] = (int(valid_times[-1]), float(valid_power[-1]))
+        return result
+
+
+# 采集卡通道标定
+class Calibration:
+    """采集卡通道标定
+
+    每个通道按标定集中的声明把原始计数 (0~65535) 换算为物理量:
+        linear  原始值 * gain + offset, 或按 min/max 线性映射 (原始值 * (max - min) / 65536 + min)
+        poly    多项式 c0 + c1*x + c2*x^2 + ..., coefficients 为 [c0, c1, c2, ...], x 为原始计数
+        table   分段线性插值, points 为按原始计数升序的 [[原始计数, 物理量], ...], 超出范围取端点值
+    标定集保存在配置 calibration_sets 中 (名称 -> {version, date, note, channels}), calibration 为当前使用的名称;
+    标定集未列出的通道按 modbus_min/modbus_max 线性换算。
+    apply() 对形状为 (..., 8) 的原始值数组整批换算 (导出、回放等批量场合): 线性通道一次向量运算,
+    多项式和查表通道逐通道向量运算; 采集时每次只有一帧, 用 apply_frame() 按纯Python浮点运算逐通道换算,
+    避免为8个数构造NumPy数组的开销, 结果与 apply() 相同。
+    """
+    TYPES = ('linear', 'poly', 'table')
+    CHANNELS = 8
+
+    def __init__(self, channels, name='', version=0):
+        self.name = name
+        self.version = version
+        self.channels = channels
+        self.linear = [i for i, item in enumerate(channels) if item['type'] == 'linear']
+        self.gain = np.array([self._gain_offset(channels[i])[0] for i in self.linear])
+        self.offset = np.array([self._gain_offset(channels[i])[1] for i in self.linear])
+        self.polys = [(i, np.array(item['coefficients'], dtype='f8'))
+                      for i, item in enumerate(channels) if item['type'] == 'poly']
+        self.tables = [(i, np.array([p[0] for p in item['points']], dtype='f8'),
+                        np.array([p[1] for p in item['points']], dtype='f8'))
+                       for i, item in enumerate(channels) if item['type'] == 'table']
+        self.all_linear = len(self.linear) == len(channels)
+        self._gain_offsets = [self._gain_offset(item) for item in channels] if self.all_linear else None
+        self._converters = [self._converter(item) for item in channels]
+
+    @staticmethod
+    def _gain_offset(item):
+        """线性通道的增益和偏移"""
+        if 'gain' in item:
+            return item['gain'], item.get('offset', 0)
+        return (item['max'] - item['min']) / 65536, item['min']
+
+    # 单通道换算函数
+    @classmethod
+    def _converter(cls, item):
+        """返回单个原始计数 -> 物理量的Python函数 (运算顺序与 apply() 中的NumPy函数相同)"""
+        if item['type'] == 'linear':
+            gain, offset = cls._gain_offset(item)
+            return lambda x: x * gain + offset
+        if item['type'] == 'poly':
+            coefficients = [float(c) for c in reversed(item['coefficients'])]
+
+            def poly(x):
+                value = coefficients[0]
+                for c in coefficients[1:]:
+                    value = c + value * x
+                return value
+            return poly
+        points = [float(p[0]) for p in item['points']]
+        outputs = [float(p[1]) for p in item['points']]
+
+        def table(x):
+            if x <= points[0]:
+                return outputs[0]
+            if x >= points[-1]:
+                return outputs[-1]
+            j = bisect.bisect_right(points, x) - 1
+            return (outputs[j + 1] - outputs[j]) / (points[j + 1] - points[j]) * (x - points[j]) + outputs[j]
+        return table
+
+    @classmethod
+    def from_config(cls, config):
+        """按配置中的 calibration 和 calibration_sets 生成标定, 标定集有误时抛出ValueError"""
+        name = config.calibration
+        if name and name not in config.calibration_sets:
+            raise ValueError(f'标定集不存在: {name}')
+        calibration = config.calibration_sets.get(name, {}) if name else {}
+        declared = calibration.get('channels', {})
+        unknown = set(declared) - {f'ch{i}' for i in range(cls.CHANNELS)}
+        if unknown:
+            raise ValueError(f'标定集 {name} 中的通道未知: {", ".join(sorted(unknown))}')
+        channels = []
+        for i in range(cls.CHANNELS):
+            item = declared.get(f'ch{i}') or {'type': 'linear', 'min': config.modbus_min[i],
+                                               'max': config.modbus_max[i]}
+            kind = item.get('type', 'linear')
+            if kind not in cls.TYPES:
+                raise ValueError(f'通道 ch{i} 的标定类型未知: {kind}')
+            if kind == 'linear' and 'gain' not in item and not ('min' in item and 'max' in item):
+                raise ValueError(f'通道 ch{i} 的线性标定需要 gain/offset 或 min/max')
+            if kind == 'poly' and not item.get('coefficients'):
+                raise ValueError(f'通道 ch{i} 的多项式标定缺少 coefficients')
+            if kind == 'table':
+                points = item.get('points') or []
+                if len(points) < 2 or any(b[0] <= a[0] for a, b in zip(points, points[1:])):
+                    raise ValueError(f'通道 ch{i} 的查表标定至少需要2个按原始计数升序的点')
+            channels.append(dict(item, type=kind))
+        return cls(channels, name, calibration.get('version', 0))
+
+    # 整批换算
+    def apply(self, raw):
+        """把形状为 (..., 8) 的原始计数换算为物理量 (float64, 保留6位小数)"""
+        raw = np.asarray(raw, dtype='f8')
+        if self.all_linear:
+            values = raw * self.gain + self.offset
+        else:
+            values = np.empty_like(raw)
+            values[..., self.linear] = raw[..., self.linear] * self.gain + self.offset
+            for i, coefficients in self.polys:
+                values[..., i] = np.polynomial.polynomial.polyval(raw[..., i], coefficients)
+            for i, points, outputs in self.tables:
+                values[..., i] = np.interp(raw[..., i], points, outputs)
+        return np.round(values, 6, out=values)
+
+    # 逐帧换算
+    def apply_frame(self, raw):
+        """把一帧8个原始计数换算为物理量列表 (float, 保留6位小数), 采集时使用"""
+        # round(v * 1e6) / 1e6 与 np.round(v, 6) 的算法相同 (乘后取最近偶整数再除), 比 round(v, 6) 快
+        if self.all_linear:
+            return [round((x * gain + offset) * 1e6) / 1e6 for x, (gain, offset) in zip(raw, self._gain_offsets)]
+        return [round(convert(x) * 1e6) / 1e6 for convert, x in zip(self._converters, raw)]
+
+    def __str__(self):
+        kinds = collections.Counter(item['type'] for item in self.channels)
+        name = f'{self.name} v{self.version}' if self.name else '默认 (modbus_min/modbus_max)'
+        return f'{name}, ' + ', '.join(f'{kind} {count} 个通道' for kind, count in sorted(kinds.items()))
+
+
+class RequestFrameCache:
+    """请求帧缓存
+
+    静态轮询请求在加载配置时编译一次 (请求帧+CRC), 之后每个采集周期直接取用;
+    只有设备地址或寄存器表变化时 compile() 才会重新编译。
+    采集线程的块读取由 ReadPlanner 按配置的寄存器表规划后一并编译。
+    其他请求 (如写寄存器) 按请求内容缓存已加CRC的完整帧。
+    """
+
+    # 轮询寄存器表: 名称 -> (从站地址配置项, 功能码, 起始地址, 寄存器数量)
+    POLL_REGISTERS = {
+        'inverter_params': ('inverter_slave', 0x03, 0x7000, 7),
+        'timing_params': ('inverter_slave', 0x03, 0xF011, 2),
+        'run_status': ('inverter_slave', 0x03, 0x3000, 1),
+        'torque_meter': ('torque_meter_slave', 0x03, 0x0000, 6),
+    }
+    DAQ_REGISTERS = (0x04, 0x0101, 8)  # 采集卡: 功能码, 起始地址, 通道数
+    MAX_ENTRIES = 256
+
+    def __init__(self, config):
+        self._key = None
+        self._frames = {}
+        self.polls = {}
+        self.plan = None
+        self.daq_request = b''
+        self.compile(config)
+
+    # 编译轮询请求帧
+    def compile(self, config):
+        """编译轮询请求帧, 地址和寄存器表未变化时直接返回False"""
+        key = (
+            tuple((getattr(config, slave), function, address, count)
+                  for slave, function, address, count in self.POLL_REGISTERS.values()),
+            config.daq_unit, self.DAQ_REGISTERS,
+            json.dumps(config.poll_registers, sort_keys=True), config.read_gap_fill
+        )
+        if key == self._key:
+            return False
+
+        self.invalidate()
+        for name, (slave, function, address, count) in self.POLL_REGISTERS.items():
+            request = ModbusCodec.read_registers(getattr(config, slave), address, count, function)
+            self._frames[request] = CRCHelper.add_crc(request)
+            self.polls[name] = request
+        self.plan = ReadPlanner.from_config(config)
+        for block in self.plan.blocks:
+            self._frames[block.request] = CRCHelper.add_crc(block.request)
+        function, address, count = self.DAQ_REGISTERS
+        self.daq_request = ModbusCodec.tcp_read_registers(0x0000, config.daq_unit, address, count, function)
+        self._key = key
+        return True
+
+    # 清空缓存
+    def invalidate(self):
+        """清空缓存"""
+        self._key = None
+        self._frames = {}
+        self.polls = {}
+
+    # 获取带CRC的完整请求帧
+    def get(self, request):
+        """获取带CRC的完整请求帧"""
+        frame = self._frames.get(request)
+        if frame is None:
+            if len(self._frames) >= self.MAX_ENTRIES:
+                # 只保留预编译的轮询帧
+                polls = list(self.polls.values()) + [block.request for block in self.plan.blocks]
+                self._frames = {req: self._frames[req] for req in polls}
+            frame = self._frames[request] = CRCHelper.add_crc(request)
+        return frame
+
+
+class CRCHelper:
+    """CRC校验工具类
+
+    Modbus CRC16 (多项式0xA001, 初值0xFFFF) 查表实现。
+    _CRC_TABLE 为256项预计算表, 每字节只需一次查表和一次移位;
+    update() 支持分段增量计算, verify_many() 用于批量校验录制的原始帧。
+    """
+
+    CRC_INIT = 0xFFFF
+
+    # 生成CRC16查表
+    @staticmethod
+    def _build_table():
+        """生成CRC16查表"""
+        table = []
+        for i in range(256):
+            crc = i
+            for _ in range(8):
+                if crc & 0x0001:
+                    crc = (crc >> 1) ^ 0xA001
+                else:
+                    crc >>= 1
+            table.append(crc)
+        return tuple(table)
+
+    # 增量更新CRC值
+    @staticmethod
+    def update(crc, data):
+        """增量更新CRC值, 返回新的整数CRC (分段数据可连续调用)"""
+        table = _CRC_TABLE
+        for byte in data:
+            crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+        return crc
+
+    # 计算CRC16校验码
+    @staticmethod
+    def calculate_crc(data):
+        """计算CRC16校验码"""
+        return CRCHelper.update(CRCHelper.CRC_INIT, data).to_bytes(2, 'little')
+
+    # 逐位计算CRC16校验码 (旧实现, 仅用于对照和性能测试)
+    @staticmethod
+    def calculate_crc_bitwise(data):
+        """逐位计算CRC16校验码"""
+        crc = 0xFFFF
+        for byte in data:
+            crc ^= byte
+            for _ in range(8):
+                if crc & 0x0001:
+                    crc >>= 1
+                    crc ^= 0xA001
+                else:
+                    crc >>= 1
+        return crc.to_bytes(2, 'little')
+
+    # 验证CRC校验码
+    @staticmethod
+    def verify_crc(data):
+        """验证CRC校验码"""
+        if len(data) < 2:
+            return False, None
+
+        payload = data[:-2]
+        # 对包含CRC的整帧计算, 结果为0即校验通过
+        return CRCHelper.update(CRCHelper.CRC_INIT, data) == 0, payload
+
+    # 批量验证CRC校验码
+    @staticmethod
+    def verify_many(frames):
+        """批量验证CRC校验码, 返回 [(是否通过, payload), ...]"""
+        table = _CRC_TABLE
+        results = []
+        for frame in frames:
+            if len(frame) < 2:
+                results.append((False, None))
+                continue
+            crc = 0xFFFF
+            for byte in frame:
+                crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+            results.append((crc == 0, frame[:-2]))
+        return results
+
+    # 添加CRC校验码到数据
+    @staticmethod
+    def add_crc(data):
+        """添加CRC校验码到数据"""
+        crc = CRCHelper.calculate_crc(data)
+        return data + crc
+
+
+_CRC_TABLE = CRCHelper._build_table()
+
+
+# 电机配置类
+class MotorConfig:
+    """电机配置类"""
+
+    # 默认采集寄存器表: 输出值 = 原始值 * scale / divisor, 读取时由 ReadPlanner 合并为块读取
+    POLL_REGISTERS = [
+        {"name": "speed", "device": "inverter", "address": "0x7000", "type": "int16", "scale": 0.6},
+        {"name": "voltage", "device": "inverter", "address": "0x7003", "type": "int16"},
+        {"name": "current", "device": "inverter", "address": "0x7004", "type": "int16", "divisor": 100},
+        {"name": "power", "device": "inverter", "address": "0x7005", "type": "int16", "divisor": 10},
+        {"name": "torque", "device": "inverter", "address": "0x7006", "type": "int16", "divisor": 10},
+        {"name": "torque_meter_torque", "device": "torque_meter", "address": "0x0000", "type": "int32",
+         "divisor": 100},
+        {"name": "torque_meter_speed", "device": "torque_meter", "address": "0x0002", "type": "int32",
+         "divisor": 10},
+        {"name": "torque_meter_power", "device": "torque_meter", "address": "0x0004", "type": "int32",
+         "divisor": 100},
+        {"name": "status", "device": "inverter", "group": "status", "address": "0x3000", "type": "int16"},
+        {"name": "accel_time", "device": "inverter", "group": "timing", "address": "0xF011", "type": "int16",
+         "divisor": 10},
+        {"name": "decel_time", "device": "inverter", "group": "timing", "address": "0xF012", "type": "int16",
+         "divisor": 10},
+    ]
+
+    def __init__(self):
+        self.ip_address = "192.168.1.122"
+        self.port = 8802
+        self.ip_address2 = "192.168.1.220"
+        self.port2 = 502
+        self.max_speed = 3000
+        self.spdrate=1.7
+        self.inverter_slave = 1  # 变频器485地址
+        self.torque_meter_slave = 2  # 转矩仪485地址
+        self.daq_unit = 0  # 采集卡Modbus TCP单元号
+        self.estop_second_connection = 0  # 急停是否另开一条网关连接 (网关需支持多连接)
+        self.estop_broadcast = 0  # 急停是否补发广播帧
+        self.retry_budget = 3  # 每个采集周期所有设备共享的重试次数
+        self.poll_registers = [dict(item) for item in self.POLL_REGISTERS]  # 采集寄存器表
+        self.read_gap_fill = 4  # 相邻寄存器间隔不超过该数量时合并为一次读取
+        self.poll_rates = {"status": 1, "timing": 1}  # 轮询组采样率(Hz), 未列出的组(含采集卡daq)按采样间隔
+        self.sched_policy = "skip"  # 错过截止时间的处理: skip 跳过 / catchup 连续补读 / rephase 重新计时
+        self.sched_spin = 0  # 每次等待最后自旋的时间(秒), 如0.002可提高定时精度, 0为只用sleep
+        self.history_size = 36000  # 采样历史保存的记录数 (10Hz约1小时)
+        self.gui_refresh_hz = 10  # 界面刷新频率(Hz), 与采样率无关
+        self.display_average = 0  # 1: 显示两次刷新之间的平均值, 0: 显示最新值
+        self.csv_flush_interval = 0.5  # CSV组提交间隔(秒)
+        self.csv_flush_rows = 500  # CSV累计该行数时立即提交
+        self.csv_fsync = 0  # 1: 每次提交后 fsync 落盘 (防断电丢数据, 吞吐较低)
+        self.record_format = "csv"  # 数据记录格式: csv 或 binary (二进制, 可用 --export 导出为CSV/Excel)
+        self.record_compress = 1  # 二进制记录的zlib压缩级别, 0为不压缩
+        self.record_journal = 1  # 1: 同时写预写日志 (.wal), 崩溃或断电后启动时恢复记录文件
+        self.journal_fsync_interval = 1.0  # 预写日志 fsync 间隔(秒), 断电时最多丢失这段时间的数据
+        self.journal_checkpoint_interval = 60.0  # 检查点间隔(秒): 记录文件 fsync 后丢弃日志中已落盘的行, 0 为不做检查点
+        self.record_pyramid = 1  # 1: 记录时同时汇总数据金字塔 (1秒/10秒/1分钟的最小、最大、平均值), 用于长时间曲线
+        self.rotation_ratio = 1
+        self.sample_interval = 1
+        self.usesocket2 = 1
+        self.modbus_head = ["温度1【℉】", "压力1【bar】", "流量1【sccm】", "振动1【mm/s^2】",
+                            "温度2【℃】", "压力2【mpa】", "流量2【slm】", "振动2【mm/s】"]
+        self.modbus_min = [0, 0, 0, 0, 0, 0, 0, 0]
+        self.modbus_max = [100, 100, 100, 100, 100, 100, 100, 100]
+        self.calibration = "default"  # 当前使用的采集卡标定集, 为空时全部按 modbus_min/modbus_max 线性换算
+        self.calibration_sets = {  # 采集卡标定集: 名称 -> 版本、日期、说明和各通道标定 (未列出的通道按线性换算)
+            "default": {"version": 1, "date": "", "note": "按 modbus_min/modbus_max 线性换算", "channels": {}},
+        }
+        self.charts = [  # 滚动曲线图: 标题和字段
+            {"title": "变频器", "fields": ["speed", "current", "power", "torque"]},
+            {"title": "转矩仪", "fields": ["torque_meter_torque", "torque_meter_speed", "torque_meter_power"]},
+            {"title": "采集卡", "fields": ["ch0", "ch1", "ch2", "ch3", "ch4", "ch5", "ch6", "ch7"]},
+        ]
+        self.chart_span = 60  # 曲线图显示最近多少秒
+        self.chart_refresh_hz = 5  # 曲线图刷新频率(Hz), 不超过界面刷新频率
+        self.stats_channels = ["ch3", "ch7", "torque_meter_torque", "current"]  # 统计通道 (均值、标准差、RMS、极值)
+        self.stats_window = 10  # 滑动窗口统计的时间长度(秒)
+        self.derived_channels = [
+            {"name": "mech_power", "label": "机械功率【W】", "type": "mech_power",
+             "torque": "torque_meter_torque", "speed": "torque_meter_speed"},
+            {"name": "efficiency", "label": "效率【%】", "type": "ratio",
+             "numerator": "torque_meter_power", "denominator": "power", "scale": 0.1},
+            {"name": "slip", "label": "转差率【%】", "type": "slip", "sync": "speed", "actual": "torque_meter_speed"},
+            {"name": "energy", "label": "输入电能【kWh】", "type": "energy", "power": "power"},
+        ]  # 派生量: 效率 = 转矩仪功率(W) / 变频器功率(kW) * 0.1
+        self.load_from_file("config.json")
+
+    def save_to_file(self, filename):
+        """保存配置到文件"""
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(self.__dict__, f, ensure_ascii=False, indent=4)
+
+    # def load_from_file(self, filename):
+    #     """从文件加载配置"""
+    #     with open(filename, 'r') as f:
+    #         data = json.load(f)
+    #         self.__dict__.update(data)
+
+    def load_from_file(self, filename):
+        """
+        从文件加载配置
+        如果文件不存在，则保存当前配置为默认值
+        """
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+                self.__dict__.update(data)
+        except FileNotFoundError:
+            print(f"配置文件 {filename} 不存在，创建默认配置")
+            self.save_to_file(filename)  # 保存当前配置
+        except json.JSONDecodeError:
+            print(f"配置文件 {filename} 格式错误，创建默认配置")
+            self.save_to_file(filename)  # 保存当前配置
+
+
+EXCEL_MAX_ROWS = 1048576  # Excel 单个工作表的最大行数
+
+
+# 导出二进制记录
+def export_recording(path, output):
+    """把二进制记录逐块导出为CSV或Excel (按输出文件扩展名), 不把整个文件读入内存, 返回导出的行数
+
+    Excel 使用 openpyxl 只写模式逐行写出, 超过单表行数上限时自动新建工作表。
+    """
+    with RecordingReader(path) as reader:
+        head, format_row = MotorController._csv_layout(reader.header['config'])
+        count = 0
+        if output.lower().endswith('.xlsx'):
+            workbook = Workbook(write_only=True)
+            sheet = None
+            sheet_rows = 0
+            for record in reader.records():
+                if sheet is None or sheet_rows >= EXCEL_MAX_ROWS:
+                    sheet = workbook.create_sheet(f'数据{len(workbook.worksheets) + 1}')
+                    sheet.append(head)
+                    sheet_rows = 1
+                sheet.append(format_row(record))
+                sheet_rows += 1
+                count += 1
+            if sheet is None:
+                workbook.create_sheet('数据1').append(head)
+            workbook.save(output)
+        else:
+            with open(output, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(head)
+                for record in reader.records():
+                    writer.writerow(format_row(record))
+                    count += 1
+    return count
+
+
+# 按预写日志恢复记录文件
+def recover_journal(path, log):
+    """崩溃或断电后按预写日志恢复记录文件, 返回恢复后的记录行数
+
+    日志先截断到最后一个有效块; 记录文件中完整的部分 (CSV的完整行, 二进制记录的完整数据块)
+    已包含日志的全部行时只截掉末尾不完整的部分, 否则截掉不完整的部分后用日志补写缺少的行;
+    记录文件头也不完整时用日志重写记录文件。日志从检查点 (base_rows) 开始, 之前的行已落盘到记录文件。
+    恢复完成后删除日志。
+    """
+    journal = JournalReader(path)
+    for _ in journal.blocks():
+        pass
+    if os.path.getsize(path) > journal.valid_size:
+        os.truncate(path, journal.valid_size)
+        log('warning', f'预写日志 {path} 末尾损坏, 已截断到 {journal.valid_size} 字节')
+
+    record = os.path.join(os.path.dirname(path), journal.header['record'])
+    binary = journal.header['format'] == 'binary'
+    base = journal.base_rows
+    intact_rows, intact_size = 0, 0
+    if os.path.exists(record):
+        try:
+            with LogReader.open(record) as reader:
+                if binary:
+                    for position, _, count, length, _, _ in reader.chunk_headers():
+                        intact_rows += count
+                        intact_size = position + BinaryWriter.CHUNK_HEADER.size + length
+                    intact_size = intact_size or reader.data_offset
+                else:
+                    intact_size = reader.mm.rfind(b'\n') + 1
+                    intact_rows = max(0, reader.mm[:intact_size].count(b'\n') - 1)
+        except ValueError:
+            pass  # 文件头不完整, 用日志重写
+
+    # 把日志中第 skip 行起的各行写入记录文件 (head 为真时先写文件头), 返回写入的行数
+    def replay(f, head, skip):
+        samples = journal.samples
+        if binary:
+            writer = BinaryWriter(f, samples, journal.header['record_header'], journal.header['compress'],
+                                  0.5, 10000, 0, log, append=not head)
+        else:
+            header, format_row = MotorController._csv_layout(journal.header['record_header']['config'])
+            if head:
+                csv.writer(f).writerow(header)
+            writer = CsvWriter(f, samples, format_row, 0.5, 10000, 0, log)
+        writer.start()
+        for block in JournalReader(path).blocks():
+            writer.write(block[skip:])
+            skip = max(0, skip - len(block))
+        writer.close(sync=True)
+        if writer.error:
+            raise OSError(f'写入记录文件失败: {writer.error}')
+        return writer.committed
+
+    text = {} if binary else {'newline': '', 'encoding': 'utf-8'}
+    if intact_size and intact_rows >= base + journal.rows:
+        if os.path.getsize(record) > intact_size:
+            os.truncate(record, intact_size)
+            log('warning', f'记录文件 {record} 末尾不完整, 已截断到 {intact_rows} 行')
+        count = intact_rows
+    elif intact_size:
+        # 截掉不完整的部分, 从日志补写缺少的行
+        if intact_rows < base:
+            log('error', f'记录文件 {record} 缺少检查点前已落盘的 {base - intact_rows} 行, 无法从日志恢复')
+        os.truncate(record, intact_size)
+        with open(record, 'ab' if binary else 'a', **text) as f:
+            count = intact_rows + replay(f, False, max(0, intact_rows - base))
+        log('warning', f'已按预写日志补写记录文件 {record}: {intact_rows} -> {count} 行')
+    else:
+        # 用日志重写记录文件: 先写临时文件, 落盘后替换
+        if base:
+            log('error', f'记录文件 {record} 已损坏, 只能从日志恢复第 {base} 行之后的数据')
+        with open(record + '.tmp', 'wb' if binary else 'w', **text) as f:
+            count = replay(f, True, 0)
+        os.replace(record + '.tmp', record)
+        log('warning', f'已按预写日志恢复记录文件 {record}: {intact_rows} -> {count} 行')
+    # 崩溃时数据金字塔缺少最后的汇总, 删除后查询时按记录文件补建
+    for level in PyramidWriter.LEVELS:
+        if os.path.exists(PyramidWriter.level_path(record, level)):
+            os.remove(PyramidWriter.level_path(record, level))
+    os.remove(path)
+    return count
+
+
+# 命令行导出
+def run_export(argv):
+    """命令行: --export 记录文件.mrec [输出文件.csv|.xlsx]"""
+    index = argv.index('--export')
+    if len(argv) <= index + 1:
+        print('用法: --export 记录文件.mrec [输出文件.csv|输出文件.xlsx]')
+        return 2
+    path = argv[index + 1]
+    output = argv[index + 2] if len(argv) > index + 2 else os.path.splitext(path)[0] + '.csv'
+    start = time.perf_counter()
+    try:
+        count = export_recording(path, output)
+    except (OSError, ValueError) as e:
+        print(f'导出失败: {e}')
+        return 1
+    print(f'已导出 {count} 行到 {output} ({time.perf_counter() - start:.1f} 秒)')
+    return 0
+
+
+# 解析查询时间
+def _parse_query_time(text, day):
+    """解析 'HH:MM[:SS[.fff]]' (记录首日) 或 'YYYY-mm-dd HH:MM[:SS[.fff]]', 返回纳秒"""
+    for fmt in ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M'):
+        try:
+            return round(datetime.strptime(text, fmt).timestamp() * 1000) * 1_000_000
+        except ValueError:
+            pass
+    return _parse_query_time(f'{day} {text}', day)
+
+
+# 命令行查询
+def run_query(argv):
+    """命令行: --query 记录文件 [--from 时间] [--to 时间] [--columns 列1,列2] [--width 桶数] [--out 输出文件.csv]
+
+    给出 --width 时按数据金字塔输出每桶各列的最小、最大、平均值 (记录文件没有金字塔时先补建)。
+    """
+    index = argv.index('--query')
+    if len(argv) <= index + 1:
+        print('用法: --query 记录文件 [--from 14:02] [--to 14:05] [--columns ch3,torque_meter_torque] '
+              '[--width 1000] [--out 输出文件.csv]')
+        return 2
+    options = dict(zip(argv[index + 2::2], argv[index + 3::2]))
+    try:
+        with LogReader.open(argv[index + 1]) as reader:
+            index = reader.time_index()
+            if not index.times:
+                print('记录文件为空')
+                return 1
+            day = datetime.fromtimestamp(index.times[0] / 1e9).strftime('%Y-%m-%d')
+            start = _parse_query_time(options['--from'], day) if '--from' in options else index.times[0]
+            end = _parse_query_time(options['--to'], day) if '--to' in options else 2 ** 63 - 1
+            columns = options.get('--columns', 'speed,torque_meter_torque').split(',')
+            began = time.perf_counter()
+            if '--width' in options:
+                pyramid = PyramidReader.open(reader.path)
+                if '--to' not in options:
+                    end = pyramid.end or end
+                result = pyramid.envelope(start, end, columns, int(options['--width']))
+                header = ['time'] + [f'{name}_{stat}' for name in columns for stat in ('min', 'max', 'mean')]
+                table = np.stack([result['min'], result['max'], result['mean']], axis=2).reshape(
+                    len(result['time']), len(header) - 1)
+            else:
+                result = reader.query(start, end, columns)
+                header = ['time'] + columns
+                table = np.column_stack([result[name] for name in columns]).reshape(len(result['time']), len(columns))
+            elapsed = time.perf_counter() - began
+    except (OSError, ValueError) as e:
+        print(f'查询失败: {e}')
+        return 1
+
+    out = open(options['--out'], 'w', newline='', encoding='utf-8') if '--out' in options else sys.stdout
+    writer = csv.writer(out)
+    writer.writerow(header)
+    for time_ns, values in zip(result['time'].tolist(), table.tolist()):
+        writer.writerow([datetime.fromtimestamp(time_ns / 1e9).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]] + values)
+    if out is not sys.stdout:
+        out.close()
+    if 'level' in result:
+        source = f'{result["level"]}秒汇总' if result['level'] else '原始记录'
+        print(f'汇总为 {len(result["time"])} 个桶, 来自{source} ({elapsed * 1000:.1f} 毫秒)', file=sys.stderr)
+    else:
+        print(f'查询到 {len(result["time"])} 行 ({elapsed * 1000:.1f} 毫秒)', file=sys.stderr)
+    return 0
+
+
+# 性能测试: 默认配置 (不读写config.json)
+def _bench_config():
+    """返回不读写config.json的默认配置"""
+    config = MotorConfig.__new__(MotorConfig)
+    config.inverter_slave, config.torque_meter_slave, config.daq_unit = 1, 2, 0
+    config.estop_second_connection, config.estop_broadcast = 0, 0
+    config.poll_registers, config.read_gap_fill = MotorConfig.POLL_REGISTERS, 4
+    return config
+
+
+# 性能测试: 计时工具
+def _bench(func, repeat):
+    """重复执行func并返回每秒次数"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = time.perf_counter() - start
+    return repeat / elapsed if elapsed > 0 else float('inf')
+
+
+# 性能测试: CRC16
+def _bench_crc():
+    """CRC16 逐位实现与查表实现对比 (帧/秒)"""
+    # 典型帧: 变频器7寄存器响应(19字节)、转矩仪响应(17字节)、读请求(8字节)
+    frames = [
+        CRCHelper.add_crc(bytes.fromhex('01030E') + bytes(range(14))),
+        CRCHelper.add_crc(bytes.fromhex('02030C') + bytes(range(12))),
+        CRCHelper.add_crc(bytes.fromhex('010370000007')),
+    ]
+    repeat = 20000
+    old = _bench(lambda: [CRCHelper.calculate_crc_bitwise(f[:-2]) == f[-2:] for f in frames], repeat)
+    new = _bench(lambda: [CRCHelper.verify_crc(f) for f in frames], repeat)
+    batch = _bench(lambda: CRCHelper.verify_many(frames), repeat)
+    n = len(frames)
+    print(f"CRC16 逐位校验: {old * n:12.0f} 帧/秒")
+    print(f"CRC16 查表校验: {new * n:12.0f} 帧/秒 ({new / old:.1f}x)")
+    print(f"CRC16 批量校验: {batch * n:12.0f} 帧/秒 ({batch / old:.1f}x)")
+
+
+# 性能测试: 响应解码
+def _bench_codec():
+    """十六进制字符串往返解码与二进制解码对比 (帧/秒)"""
+    # CRC校验两种路径相同, 这里只比较校验之后的格式转换与解码
+    payload = bytes.fromhex('01030E') + bytes(range(14))
+    view = memoryview(payload)
+    repeat = 100000
+
+    def hex_path():
+        response = payload.hex()
+        if response.startswith('0103'):
+            struct.unpack('>hhhhhhh', bytes.fromhex(response)[3:17])
+
+    def binary_path():
+        if ModbusCodec.matches(view, 0x01, 0x03):
+            ModbusCodec.INVERTER_PARAMS.unpack_from(view, 3)
+
+    old = _bench(hex_path, repeat)
+    new = _bench(binary_path, repeat)
+    print(f"十六进制往返解码: {old:12.0f} 帧/秒")
+    print(f"二进制直接解码:   {new:12.0f} 帧/秒 ({new / old:.2f}x)")
+
+
+# 性能测试: 每周期请求帧构造
+def _bench_poll_frames():
+    """每周期重新解析+计算CRC与预编译缓存对比 (周期/秒)"""
+    cache = RequestFrameCache(_bench_config())
+    polls = cache.polls
+    repeat = 50000
+
+    def old_cycle():
+        # 旧实现: _collect_data 每周期两个十六进制命令
+        CRCHelper.add_crc(bytes.fromhex('010370000007'))
+        CRCHelper.add_crc(bytes.fromhex('020300000006'))
+
+    def new_cycle():
+        cache.get(polls['inverter_params'])
+        cache.get(polls['torque_meter'])
+
+    old = _bench(old_cycle, repeat)
+    new = _bench(new_cycle, repeat)
+    print(f"每周期解析+CRC: {old:12.0f} 周期/秒 ({1e6 / old:.2f} us/周期)")
+    print(f"预编译请求帧:   {new:12.0f} 周期/秒 ({1e6 / new:.2f} us/周期, {new / old:.1f}x)")
+
+
+# 性能测试: 本地模拟RTU从站
+def _bench_rtu_slave(delay, drop=0.0):
+    """启动本地模拟RTU透传网关, 每帧响应前延时delay秒, 按drop比例丢帧, 返回监听端口"""
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(4)
+
+    def serve(conn):
+        with conn:
+            buf = b''
+            while True:
+                data = conn.recv(1024)
+                if not data:
+                    return
+                buf += data
+                while len(buf) >= 8:
+                    frame, buf = buf[:8], buf[8:]
+                    if frame[0] == 0x00 or random.random() < drop:  # 广播帧不应答
+                        continue
+                    if frame[1] in (0x03, 0x04):
+                        count = frame[5]
+                        reply = bytes([frame[0], frame[1], count * 2]) + bytes(count * 2)
+                    else:
+                        reply = frame[:6]
+                    time.sleep(delay)
+                    try:
+                        conn.sendall(CRCHelper.add_crc(reply))
+                    except OSError:
+                        return
+
+    def accept():
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return server.getsockname()[1]
+
+
+# 性能测试: 总线优先级队列
+def _bench_bus_priority():
+    """采集满速轮询时控制命令的延迟 (FIFO与优先级队列对比)"""
+    port = _bench_rtu_slave(delay=0.005)
+    cache = RequestFrameCache(_bench_config())
+    poll = cache.polls['inverter_params']
+    write = ModbusCodec.write_register(1, 0x1000, 1000)
+
+    for label, control_priority in (('FIFO(同优先级)', BusWorker.PRIORITY_POLL),
+                                    ('优先级队列', BusWorker.PRIORITY_CONTROL)):
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        bus = BusWorker(sock, cache, lambda level, message: None, 0.05)
+        bus.start()
+        running = True
+
+        def poller():
+            # 模拟采集线程: 始终保持4个轮询请求在队列中
+            pending = collections.deque()
+            while running:
+                while len(pending) < 4:
+                    pending.append(bus.submit(poll, poll[:2], 3, BusWorker.PRIORITY_POLL))
+                pending.popleft().result()
+
+        thread = threading.Thread(target=poller, daemon=True)
+        thread.start()
+        latencies = []
+        for _ in range(50):
+            start = time.perf_counter()
+            bus.submit(write, write[:2], 3, control_priority).result()
+            latencies.append((time.perf_counter() - start) * 1000)
+            time.sleep(0.01)
+        running = False
+        thread.join()
+        bus.stop()
+        bus.join()
+        latencies.sort()
+        print(f"{label}: 控制命令延迟 平均 {sum(latencies) / len(latencies):6.1f} ms, "
+              f"P99 {latencies[int(len(latencies) * 0.99) - 1]:6.1f} ms, 最大 {latencies[-1]:6.1f} ms")
+
+
+# 性能测试: 急停快速通道
+def _bench_estop():
+    """采集满速轮询时急停的点击到确认耗时 (主连接插队与备用连接对比)"""
+    port = _bench_rtu_slave(delay=0.02)  # 模拟低波特率, 每帧往返约20ms
+    config = _bench_config()
+    config.ip_address, config.port = '127.0.0.1', port
+    cache = RequestFrameCache(config)
+    poll = cache.polls['inverter_params']
+
+    for label, second in (('主连接插队', 0), ('备用连接', 1)):
+        config.estop_second_connection = second
+        bus = BusWorker(BusWorker.open_connection(('127.0.0.1', port), 0.05), cache, lambda *args: None, 0.05)
+        bus.start()
+        estop = EmergencyStop(config, cache, lambda *args: None, 0.05)
+        estop.open()
+        running = True
+
+        def poller():
+            while running:
+                bus.submit(poll, poll[:2], 3, BusWorker.PRIORITY_POLL).result()
+
+        thread = threading.Thread(target=poller, daemon=True)
+        thread.start()
+        for _ in range(20):
+            time.sleep(0.013)  # 让急停落在轮询事务中间的不同位置
+            estop.trigger(bus, time.perf_counter())
+        running = False
+        thread.join()
+        estop.close()
+        bus.stop()
+        bus.join()
+        latencies = sorted(t * 1000 for t in estop.latencies if t is not None)
+        print(f"{label}: 急停确认 {len(latencies)}/{len(estop.latencies)}, 平均 {sum(latencies) / len(latencies):6.1f} ms, "
+              f"最大 {latencies[-1]:6.1f} ms")
+
+
+# 性能测试: Modbus TCP 流水线
+def _bench_tcp_pipeline():
+    """采集卡请求 单个在途与事务号流水线吞吐对比 (请求/秒)"""
+    latency = 0.005  # 模拟采集卡往返延迟
+
+    async def handle(reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                request = await reader.readexactly(12)
+                count = request[11]
+                reply = request[:4] + (3 + count * 2).to_bytes(2, 'big') + request[6:8] + \
+                    bytes([count * 2]) + bytes(count * 2)
+                loop.call_later(latency, writer.write, reply)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    async def run(outstanding, total=400):
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        client = ModbusTcpClient('127.0.0.1', server.sockets[0].getsockname()[1], 1.0)
+        await client.connect()
+        request = ModbusCodec.tcp_read_registers(0, 0, 0x0101, 8, function=0x04)
+
+        async def worker(n):
+            for _ in range(n):
+                await client.execute(request)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(total // outstanding) for _ in range(outstanding)))
+        elapsed = time.perf_counter() - start
+        await client.close()
+        server.close()
+        return total / elapsed
+
+    single = asyncio.run(run(1))
+    pipelined = asyncio.run(run(ModbusTcpClient.MAX_OUTSTANDING))
+    print(f"单个在途:   {single:8.0f} 请求/秒")
+    print(f"流水线({ModbusTcpClient.MAX_OUTSTANDING}): {pipelined:8.0f} 请求/秒 ({pipelined / single:.1f}x)")
+
+
+# 性能测试: 自适应超时
+def _bench_adaptive_timeout():
+    """固定50ms超时与按往返时间自适应超时对比"""
+    cache = RequestFrameCache(_bench_config())
+    poll = cache.polls['inverter_params']
+    cases = (('快速设备 3ms 丢帧10%', 0.003, 0.1), ('慢速设备 80ms', 0.08, 0.0))
+    for label, delay, drop in cases:
+        port = _bench_rtu_slave(delay, drop)
+        for mode in ('固定', '自适应'):
+            bus = BusWorker(BusWorker.open_connection(('127.0.0.1', port), 0.05), cache, lambda *args: None, 0.05)
+            if mode == '固定':
+                bus.RTO_MIN = bus.RTO_MAX = 0.05
+            bus.start()
+            ok = 0
+            start = time.perf_counter()
+            for _ in range(60):
+                ok += bus.submit(poll, poll[:2], 3, BusWorker.PRIORITY_POLL).result()[0]
+            elapsed = time.perf_counter() - start
+            bus.stop()
+            bus.join()
+            print(f"{label} {mode}超时: 成功 {ok}/60, 平均 {elapsed / 60 * 1000:6.1f} ms/次, "
+                  f"超时 {bus.rtt[1].timeouts} 次")
+
+
+# 性能测试: 寄存器读取规划
+def _bench_read_planner():
+    """逐个寄存器读取与合并块读取对比 (模拟网关每帧3ms)"""
+    port = _bench_rtu_slave(delay=0.003)
+    config = _bench_config()
+    registers = ReadPlanner.from_config(config).registers
+    cases = (('逐个寄存器读取', [ReadPlanner([reg]) for reg in registers]),
+             ('合并相邻寄存器', [ReadPlanner(registers, 0)]),
+             ('间隔填充4', [ReadPlanner(registers, 4)]))
+    for label, plans in cases:
+        blocks = [block for plan in plans for block in plan.blocks]
+        bus = BusWorker(BusWorker.open_connection(('127.0.0.1', port), 0.05), RequestFrameCache(config),
+                        lambda *args: None, 0.05)
+        bus.start()
+        cycles = 30
+        start = time.perf_counter()
+        for _ in range(cycles):
+            for block in blocks:
+                success, response = bus.submit(block.request, block.request[:2], 3,
+                                               BusWorker.PRIORITY_POLL).result()
+                block.decode(response)
+        elapsed = time.perf_counter() - start
+        bus.stop()
+        bus.join()
+        print(f"{label}: {len(blocks)} 次事务/周期, 平均 {elapsed / cycles * 1000:6.1f} ms/周期")
+
+
+# 性能测试: 采集定时
+def _bench_scheduler():
+    """纯sleep与sleep+自旋的启动抖动, 以及错过截止时间的三种处理策略 (周期5ms, 第50周期卡顿30ms)"""
+
+    async def run(policy, spin, stall):
+        scheduler = PollScheduler(policy, spin)
+        scheduler.add('bench', 'rtu', 0.005)
+        for i in range(200):
+            started, due = await scheduler.wait()
+            end = scheduler.clock() + (0.03 if stall and i == 50 else 0.001)
+            while scheduler.clock() < end:
+                pass  # 模拟读取耗时
+            scheduler.complete(due, started)
+        task = scheduler.tasks[0]
+        phase = (task.due - scheduler.start) / task.period % 1 * task.period * 1000
+        return scheduler, task, phase
+
+    for label, spin in (('纯sleep', 0.0), ('sleep+自旋2ms', 0.002)):
+        scheduler, _, _ = asyncio.run(run('skip', spin, False))
+        print(f"{label}: {scheduler.jitter}")
+    for policy in PollScheduler.POLICIES:
+        scheduler, task, phase = asyncio.run(run(policy, 0.002, True))
+        elapsed = scheduler.clock() - scheduler.start
+        print(f"{policy:8s}: 200 次读取耗时 {elapsed * 1000:6.0f} ms, 错过 {task.missed:2d} 个周期, "
+              f"相位偏移 {phase:4.2f} ms, {scheduler.jitter}")
+
+
+# 性能测试: 采样历史
+def _bench_sample_buffer():
+    """采样历史写入与窗口读取: 字典列表与预分配环形缓冲区对比"""
+    fields = DataCollectionThread.RTU_FIELDS + DataCollectionThread.DAQ_FIELDS
+    data = {name: 1.5 for name in fields}
+    data['gap'] = ''
+    stamps = {'inverter': 1, 'torque_meter': 1, 'daq': 1}
+    repeat = 50000
+
+    history = collections.deque(maxlen=36000)
+    samples = SampleBuffer(fields, 36000)
+    old = _bench(lambda: history.append(dict(data)), repeat)
+    new = _bench(lambda: samples.append(data, 1, stamps), repeat)
+    print(f"字典列表写入:     {old:10.0f} 行/秒 ({1e6 / old:.2f} us/行)")
+    print(f"环形缓冲区逐行写入: {new:8.0f} 行/秒 ({1e6 / new:.2f} us/行, {new / old:.1f}x)")
+    # 采集线程 push (每个采样), 界面线程每次刷新 flush 一批 (200Hz采集、10Hz刷新时每批20行)
+    batch = 20
+    pushed = _bench(lambda: samples.push(dict(data), 1, stamps), repeat)
+    samples.flush()
+    elapsed = 0.0
+    for _ in range(repeat // batch):
+        for _ in range(batch):
+            samples.push(dict(data), 1, stamps)
+        began = time.perf_counter()
+        samples.flush()
+        elapsed += time.perf_counter() - began
+    flushed = repeat / elapsed
+    print(f"采集线程 push:    {pushed:10.0f} 行/秒 ({1e6 / pushed:.2f} us/行, {pushed / old:.1f}x)")
+    print(f"界面线程 flush:   {flushed:10.0f} 行/秒 ({1e6 / flushed:.2f} us/行, 每批 {batch} 行)")
+    row_bytes = sys.getsizeof(data) + sum(sys.getsizeof(value) for value in data.values())
+    print(f"每行内存: 字典 {row_bytes} 字节, 环形缓冲区 {samples._data.itemsize * 2} 字节 (含镜像)")
+
+    old = _bench(lambda: sum(row['ch3'] for row in itertools.islice(reversed(history), 10000)) / 10000, 50)
+    new = _bench(lambda: samples.column('ch3', 10000).mean(), 50)
+    print(f"字典列表最近1万行均值:   {old:8.0f} 次/秒 ({1e3 / old:.3f} ms/次)")
+    print(f"环形缓冲区最近1万行均值: {new:8.0f} 次/秒 ({1e3 / new:.3f} ms/次, {new / old:.1f}x)")
+
+
+# 性能测试: CSV写入
+def _bench_csv_writer():
+    """逐行 flush 与后台组提交 (及组提交+fsync) 的写入吞吐"""
+    fields = DataCollectionThread.RTU_FIELDS + DataCollectionThread.DAQ_FIELDS
+    data = {name: 12.345678 for name in fields}
+    data['gap'] = ''
+    rows = 20000
+    samples = SampleBuffer(fields, rows)
+    for _ in range(rows):
+        samples.append(data, time.time_ns(), {})
+
+    path = os.path.join(tempfile.gettempdir(), 'bench_motor_data.csv')
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        start = time.perf_counter()
+        for seq in range(rows):
+            writer.writerow(MotorController._csv_record(samples.record(seq)))
+            file.flush()
+        old = rows / (time.perf_counter() - start)
+    print(f"逐行flush(界面线程): {old:9.0f} 行/秒, 界面线程每行 {1e6 / old:.2f} us")
+
+    for label, fsync in (('组提交', 0), ('组提交+fsync', 1)):
+        file = open(path, 'w', newline='', encoding='utf-8')
+        writer = CsvWriter(file, samples, MotorController._csv_record, 0.5, 500, fsync, lambda *args: None)
+        writer.start()
+        start = time.perf_counter()
+        enqueue = 0.0
+        for begin in range(0, rows, 20):  # 每次界面刷新提交20行
+            t = time.perf_counter()
+            writer.write(samples.range(begin, begin + 20).copy())
+            enqueue += time.perf_counter() - t
+        writer.close()
+        new = rows / (time.perf_counter() - start)
+        print(f"{label}(后台线程): {new:9.0f} 行/秒 ({new / old:.1f}x), 界面线程每行 {enqueue / rows * 1e6:.2f} us, "
+              f"提交 {writer.commits} 次, {writer.flush_time}")
+    os.remove(path)
+
+
+# 性能测试: 二进制记录
+def _bench_recording():
+    """CSV与二进制记录的写入耗时和文件大小, 以及二进制记录导出CSV的速度 (模拟10Hz、2万行)"""
+    fields = DataCollectionThread.RTU_FIELDS + DataCollectionThread.DAQ_FIELDS
+    rows = 20000
+    samples = SampleBuffer(fields, rows, {'speed', 'voltage', 'status'})
+    rng = random.Random(1)
+    raw = [30000] * 8
+    data = {name: None for name in fields}
+    for i in range(rows):
+        raw = [min(65535, max(0, value + rng.randint(-30, 30))) for value in raw]
+        data.update({f'ch{k}': round(raw[k] * 100 / 65536, 6) for k in range(8)})
+        data.update(speed=1020, voltage=380, status=1, current=rng.randint(1200, 1260) / 100,
+                    power=5.5, torque=7.7, torque_meter_torque=rng.randint(1200, 1260) / 100,
+                    torque_meter_speed=2550.0, torque_meter_power=56.78)
+        samples.append(data, 1_700_000_000_000_000_000 + i * 100_000_000, {})
+
+    path = os.path.join(tempfile.gettempdir(), 'bench_motor_data')
+    header = {'config': {'modbus_head': [f'CH{k}' for k in range(8)]}}
+    for label, suffix, make in (
+            ('CSV', '.csv', lambda f: CsvWriter(f, samples, MotorController._csv_record, 0.5, 500, 0,
+                                                 lambda *args: None)),
+            ('二进制', '.mrec', lambda f: BinaryWriter(f, samples, header, 1, 0.5, 500, 0, lambda *args: None))):
+        file = open(path + suffix, 'w' if suffix == '.csv' else 'wb', newline='' if suffix == '.csv' else None,
+                    encoding='utf-8' if suffix == '.csv' else None)
+        writer = make(file)
+        writer.start()
+        start = time.process_time()
+        for begin in range(0, rows, 100):
+            writer.write(samples.range(begin, begin + 100).copy())
+        writer.close()
+        cpu = time.process_time() - start
+        size = os.path.getsize(path + suffix)
+        print(f"{label}记录: CPU {cpu / rows * 1e6:6.2f} us/行, 文件 {size / rows:6.1f} 字节/行")
+
+    start = time.perf_counter()
+    export_recording(path + '.mrec', path + '.csv')
+    print(f"二进制导出CSV: {rows / (time.perf_counter() - start):9.0f} 行/秒")
+    os.remove(path + '.csv')
+    os.remove(path + '.mrec')
+
+
+# 性能测试: 记录文件按时间查询
+def _bench_log_query():
+    """在约1小时的记录 (10Hz, 3.6万行) 中查询1分钟: 稀疏索引 vs 从头扫描"""
+    fields = DataCollectionThread.RTU_FIELDS + DataCollectionThread.DAQ_FIELDS
+    rows = 36000
+    samples = SampleBuffer(fields, rows, {'speed', 'voltage', 'status'})
+    data = {name: 1.5 for name in fields}
+    base = 1_700_000_000_000_000_000
+    for i in range(rows):
+        data['ch3'] = i / 1000
+        samples.append(data, base + i * 100_000_000, {})
+
+    path = os.path.join(tempfile.gettempdir(), 'bench_motor_query')
+    header = {'config': {'modbus_head': [f'CH{k}' for k in range(8)]}}
+    with open(path + '.csv', 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(MotorController._csv_header(header['config']['modbus_head']))
+        writer.writerows(MotorController._csv_record(samples.to_dict(row)) for row in samples.range(0, rows))
+    with open(path + '.mrec', 'wb') as f:
+        writer = BinaryWriter(f, samples, header, 1, 0.5, 500, 0, lambda *args: None)
+        writer.start()
+        for begin in range(0, rows, 10):
+            writer.write(samples.range(begin, begin + 10).copy())
+        writer.close()
+
+    start, end = base + 1800 * 10 ** 9, base + 1860 * 10 ** 9  # 第30分钟起的1分钟
+    for suffix in ('.csv', '.mrec'):
+        for name in (path + suffix + '.idx',):
+            if os.path.exists(name):
+                os.remove(name)
+        with LogReader.open(path + suffix) as reader:
+            began = time.perf_counter()
+            reader.time_index()
+            build = time.perf_counter() - began
+            began = time.perf_counter()
+            result = reader.query(start, end, ['ch3'])
+            indexed = time.perf_counter() - began
+            # 不使用索引: 从头扫描
+            reader.time_index = lambda: TimeIndex(path + '.none')
+            began = time.perf_counter()
+            reader.query(start, end, ['ch3'])
+            scan = time.perf_counter() - began
+        print(f"{suffix[1:]:>4}: 建索引 {build * 1000:6.1f} ms, 查询1分钟 ({len(result['time'])} 行) "
+              f"索引 {indexed * 1000:6.2f} ms / 从头扫描 {scan * 1000:6.2f} ms")
+        os.remove(path + suffix)
+        os.remove(path + suffix + '.idx')
+
+# 性能测试: 预写日志
+def _bench_journal():
+    """断电保护的两种做法: 逐行 flush+fsync CSV vs CSV组提交 + 预写日志定时 fsync (模拟100Hz、各1000行)"""
+    fields = DataCollectionThread.RTU_FIELDS + DataCollectionThread.DAQ_FIELDS
+    rows = 1000
+    samples = SampleBuffer(fields, rows, {'speed', 'voltage', 'status'})
+    data = {name: 1.5 for name in fields}
+    for i in range(rows):
+        samples.append(data, 1_700_000_000_000_000_000 + i * 10_000_000, {})
+    path = os.path.join(tempfile.gettempdir(), 'bench_motor_journal.csv')
+    log = lambda *args: None
+
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        start = time.perf_counter()
+        for row in samples.range(0, rows):
+            writer.writerow(MotorController._csv_record(samples.to_dict(row)))
+            f.flush()
+            os.fsync(f.fileno())
+        elapsed = time.perf_counter() - start
+    print(f"逐行flush+fsync:      {elapsed / rows * 1e6:8.1f} us/行 (界面线程), {rows} 次 fsync")
+
+    record = CsvWriter(open(path, 'w', newline='', encoding='utf-8'), samples, MotorController._csv_record,
+                       0.5, 500, 0, log)
+    journal = JournalWriter(open(path + '.wal', 'wb'), samples, {'record': path}, 1.0, 0.5, 500, log)
+    record.start()
+    journal.start()
+    start = time.perf_counter()
+    gui = 0.0
+    for begin in range(0, rows, 10):  # 每0.1秒界面刷新一次, 每次10行
+        began = time.perf_counter()
+        batch = samples.range(begin, begin + 10).copy()
+        journal.write(batch)
+        record.write(batch)
+        gui += time.perf_counter() - began
+        time.sleep(max(0.0, start + (begin + 10) / 100 - time.perf_counter()))
+    journal.close()
+    record.close(sync=True)
+    print(f"组提交+预写日志:      {gui / rows * 1e6:8.1f} us/行 (界面线程), {journal.syncs + 1} 次 fsync, "
+          f"日志 {os.path.getsize(path + '.wal') / rows:.0f} 字节/行")
+    os.remove(path)
+    os.remove(path + '.wal')
+
+
+# 性能测试: 采集卡通道标定
+def _bench_calibration():
+    """采集卡8通道换算: 逐通道Python循环 vs NumPy整批换算 (每1000帧耗时)"""
+    config = _bench_config()
+    config.modbus_min, config.modbus_max = [0] * 8, [100] * 8
+    rng = np.random.default_rng(1)
+    frames = rng.integers(0, 65536, size=(1000, 8), dtype=np.uint16)
+    rows = frames.tolist()
+
+    def python_loop():
+        for raw in rows:
+            [round(raw[i] * (config.modbus_max[i] - config.modbus_min[i]) / 65536 + config.modbus_min[i], 6)
+             for i in range(8)]
+
+    config.calibration_sets = {
+        'mixed': {'version': 1, 'channels': {
+            'ch1': {'type': 'poly', 'coefficients': [-2.5, 1.6e-3, -1.2e-9]},
+            'ch2': {'type': 'table', 'points': [[0, 0], [13107, 20], [32768, 55], [52428, 85], [65535, 100]]},
+            'ch5': {'type': 'linear', 'gain': 0.002, 'offset': -10},
+        }}}
+    config.calibration = ''
+    linear = Calibration.from_config(config)
+    config.calibration = 'mixed'
+    mixed = Calibration.from_config(config)
+    repeat = 20
+    for label, func in (('Python循环(线性)', python_loop),
+                        ('NumPy整批(线性)', lambda: linear.apply(frames)),
+                        ('NumPy整批(多项式+查表+线性)', lambda: mixed.apply(frames)),
+                        ('NumPy逐帧(线性)', lambda: [linear.apply(raw) for raw in frames]),
+                        ('Python逐帧(线性, 采集时)', lambda: [linear.apply_frame(raw) for raw in rows]),
+                        ('Python逐帧(多项式+查表+线性)', lambda: [mixed.apply_frame(raw) for raw in rows])):
+        print(f"{label:24s} {1000 / _bench(func, repeat):8.3f} ms/千帧")
+
+
+# 性能测试: 派生量计算
+def _bench_derived():
+    """派生量 (机械功率、效率、转差率、电能) 逐个样本计算 vs 整批计算 (1万个样本, 10Hz, 含读取失败)"""
+    config = _bench_config()
+    config.derived_channels = [
+        {"name": "mech_power", "type": "mech_power", "torque": "torque_meter_torque", "speed": "torque_meter_speed"},
+        {"name": "efficiency", "type": "ratio", "numerator": "torque_meter_power", "denominator": "power",
+         "scale": 0.1},
+        {"name": "slip", "type": "slip", "sync": "speed", "actual": "torque_meter_speed"},
+        {"name": "energy", "type": "energy", "power": "power"},
+    ]
+    fields = DataCollectionThread.RTU_FIELDS
+    rng = random.Random(1)
+    count = 10000
+    times = np.arange(count, dtype='i8') * 100_000_000 + 1_700_000_000_000_000_000
+    samples = []
+    for i in range(count):
+        data = {name: rng.uniform(1, 10) for name in fields}
+        if i % 97 == 0:
+            data['power'] = None  # 读取失败
+        samples.append(data)
+
+    per_sample = DerivedChannels.from_config(config, fields)
+    start = time.perf_counter()
+    for data, time_ns in zip(samples, times.tolist()):
+        per_sample.update(data, time_ns)
+    elapsed = time.perf_counter() - start
+    print(f"逐个样本: {elapsed / count * 1e6:6.2f} us/样本")
+
+    batch = DerivedChannels.from_config(config, fields)
+    columns = {name: np.array([np.nan if data[name] is None else data[name] for data in samples]) for name in fields}
+    start = time.perf_counter()
+    result = batch.compute(columns, times)
+    elapsed = time.perf_counter() - start
+    same = all(np.allclose(result[name], [np.nan if data[name] is None else data[name] for data in samples],
+                           equal_nan=True) for name in batch.names)
+    print(f"整批计算: {elapsed / count * 1e6:6.2f} us/样本, 与逐个计算一致: {same}, "
+          f"累计电能 {batch.energy['energy']:.6f} kWh")
+
+
+# 性能测试: 运行统计
+def _bench_running_stats():
+    """4个统计通道: 逐个样本累计 vs 每次刷新重算全部历史, 以及10秒滑动窗口 (10Hz运行1小时, 3.6万个样本)"""
+    fields = DataCollectionThread.RTU_FIELDS + DataCollectionThread.DAQ_FIELDS
+    channels = ('ch3', 'ch7', 'torque_meter_torque', 'current')
+    count = 36000
+    samples = SampleBuffer(fields, count, {'speed', 'voltage', 'status'})
+    rng = random.Random(1)
+    rows = []
+    for i in range(count):
+        data = {name: rng.gauss(10, 2) for name in fields}
+        samples.append(data, 1_700_000_000_000_000_000 + i * 100_000_000, {})
+        rows.append(data)
+
+    stats = {name: RunningStats() for name in channels}
+    start = time.perf_counter()
+    for data in rows:
+        for name, item in stats.items():
+            item.add(data[name])
+    print(f"逐个样本累计:       {(time.perf_counter() - start) / count * 1e6:8.2f} us/样本")
+
+    history = samples.window()
+    rate = _bench(lambda: [RunningStats.of(history[name]) for name in channels], 20)
+    print(f"重算全部历史:       {1000 / rate:8.2f} ms/次刷新")
+    end = history['time'][-1]
+
+    def window_stats():
+        window = samples.since(end - 10 * 10 ** 9)
+        return [RunningStats.of(window[name]) for name in channels]
+
+    rate = _bench(window_stats, 200)
+    print(f"10秒滑动窗口:       {1000 / rate:8.3f} ms/次刷新")
+    error = max(abs(stats[name].stdev - float(np.std(history[name], ddof=1))) for name in channels)
+    print(f"累计标准差与NumPy相差: {error:.2e}")
+
+
+# 性能测试: 滚动曲线图
+def _bench_rolling_chart():
+    """8条曲线、显示60秒、宽1000像素, 采集卡200Hz: 运行10秒、1分钟和10小时时每次刷新的耗时
+
+    采样历史容量有限, 运行10小时与写满两轮后的采样历史内容相同, 只模拟最后两轮的数据。
+    """
+    app = QApplication.instance() or QApplication([])
+    fields = DataCollectionThread.DAQ_FIELDS
+    rng = np.random.default_rng(1)
+    for label, seconds in (('运行10秒', 10), ('运行1分钟', 60), ('运行10小时', 36000)):
+        samples = SampleBuffer(fields, 36000, ())
+        count = min(seconds * 200, 2 * samples.capacity)
+        values = rng.normal(50, 5, size=(count, len(fields))).tolist()
+        base = time.time_ns() - count * 5_000_000
+        for i, row in enumerate(values):
+            samples.append(dict(zip(fields, row)), base + i * 5_000_000, {})
+        chart = RollingChart('采集卡', fields, {}, 60)
+        chart.resize(1000, 400)
+        chart.show()
+        app.processEvents()
+        chart.refresh(samples)
+        total = 0.0
+        refreshes = 20
+        for _ in range(refreshes):  # 每次刷新新增0.2秒的数据
+            for _ in range(40):
+                samples.append(dict(zip(fields, rng.normal(50, 5, len(fields)).tolist())),
+                               base + count * 5_000_000, {})
+                count += 1
+            start = time.perf_counter()
+            chart.refresh(samples)
+            total += time.perf_counter() - start
+        app.processEvents()
+        print(f"{label}: 每次刷新 {total / refreshes * 1000:6.2f} ms, 每条曲线 {chart.series[0].count()} 个点")
+        chart.close()
+
+
+# 性能测试: 数据金字塔
+def _bench_pyramid():
+    """72小时记录 (采集卡8通道, 10Hz, 约260万行): 记录时汇总的开销, 以及查看全程 (1000个桶) 的耗时:
+    数据金字塔 vs 对全部原始数据分桶"""
+    fields = DataCollectionThread.DAQ_FIELDS
+    rows = 72 * 3600 * 10
+    batch = 1000
+    base = 1_700_000_000_000_000_000
+    times = base + np.arange(rows, dtype='i8') * 100_000_000
+    values = np.random.default_rng(1).normal(50, 5, size=(rows, len(fields)))
+    path = os.path.join(tempfile.gettempdir(), 'bench_motor_pyramid.mrec')
+
+    writer = PyramidWriter(path, fields)
+    began = time.perf_counter()
+    for begin in range(0, rows, batch):
+        writer.feed(times[begin:begin + batch], values[begin:begin + batch])
+    writer.close()
+    build = time.perf_counter() - began
+    print(f"记录时汇总: 每批 {batch} 行 {build / (rows / batch) * 1e6:6.1f} us "
+          f"(记录写入线程, 组提交一次约 {batch} 行)")
+
+    start, end = base, base + rows * 100_000_000
+    began = time.perf_counter()
+    result = PyramidReader(path).query(start, end, list(fields), 1000)
+    pyramid = time.perf_counter() - began
+    began = time.perf_counter()
+    decimator = MinMaxDecimator(fields, (end - start) // 1000)
+    decimator.feed_values(times, values)
+    decimator.finish()
+    raw = time.perf_counter() - began
+    print(f"查看72小时 (1000个桶): 金字塔 {pyramid * 1000:6.2f} ms ({result['level']}秒级, "
+          f"{len(result['time'])} 个桶) / 原始数据 {raw * 1000:7.1f} ms ({rows} 行, 不含读文件)")
+    for level in PyramidWriter.LEVELS:
+        os.remove(PyramidWriter.level_path(path, level))
+
+
+BENCHMARKS = [
+    ('CRC16', _bench_crc),
+    ('响应解码', _bench_codec),
+    ('轮询请求帧', _bench_poll_frames),
+    ('总线优先级', _bench_bus_priority),
+    ('急停通道', _bench_estop),
+    ('Modbus TCP流水线', _bench_tcp_pipeline),
+    ('自适应超时', _bench_adaptive_timeout),
+    ('寄存器读取规划', _bench_read_planner),
+    ('采集定时', _bench_scheduler),
+    ('采样历史', _bench_sample_buffer),
+    ('CSV写入', _bench_csv_writer),
+    ('二进制记录', _bench_recording),
+    ('记录查询', _bench_log_query),
+    ('预写日志', _bench_journal),
+    ('采集卡标定', _bench_calibration),
+    ('派生量', _bench_derived),
+    ('运行统计', _bench_running_stats),
+    ('滚动曲线图', _bench_rolling_chart),
+    ('数据金字塔', _bench_pyramid),
+]
+
+
+# 运行全部性能测试
+def run_benchmarks():
+    """运行全部性能测试 (命令行: --bench)"""
+    for name, func in BENCHMARKS:
+        print(f"== {name} ==")
+        func()
+
+
+if __name__ == '__main__':
+    if '--bench' in sys.argv:
+        run_benchmarks()
+        sys.exit(0)
+    if '--export' in sys.argv:
+        sys.exit(run_export(sys.argv))
+    if '--query' in sys.argv:
+        sys.exit(run_query(sys.argv))
 
-if __name__ == '__main__':
     app = QApplication(sys.argv)
 
     try:
         controller = MotorController()
+        app.aboutToQuit.connect(controller.shutdown)  # 显示的是 controller.ui, 关闭它不会触发 closeEvent
         controller.ui.show()
         sys.exit(app.exec_())
     except Exception as e: